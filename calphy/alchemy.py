@@ -76,10 +76,11 @@ class Alchemy(cph.Phase):
         At the end of the run, the averaged box dimensions are calculated. 
         """
         lmp = ph.create_object(self.cores, self.simfolder, self.calc.md.timestep, 
-            self.calc.md.cmdargs, self.calc.md.init_commands)
+            self.calc.md.cmdargs, self.calc.md.init_commands, session=self.session, 
+            logfile=self.lammps_logfile("run_averaging"), profile=self.profile_file)
 
         #set up structure
-        lmp = ph.create_structure(lmp, self.calc)
+        lmp = self.create_structure(lmp)
 
         #set up potential
         lmp = ph.set_potential(lmp, self.calc, ghost_elements=self.calc._ghost_element_count)
@@ -112,9 +113,7 @@ class Alchemy(cph.Phase):
         self.check_if_melted(lmp, "traj.equilibration_stage2.dat")
 
         #close object and process traj
-        lmp = ph.write_data(lmp, "current.data")
-        lmp.close()
-        self.process_traj("traj.equilibration_stage2.dat", "conf.equilibration.data")
+        self.save_configuration(lmp, "traj.equilibration_stage2.dat", "conf.equilibration.data")
 
 
     
@@ -140,7 +139,8 @@ class Alchemy(cph.Phase):
 
         #create lammps object
         lmp = ph.create_object(self.cores, self.simfolder, self.calc.md.timestep, 
-            self.calc.md.cmdargs, self.calc.md.init_commands)
+            self.calc.md.cmdargs, self.calc.md.init_commands, session=self.session, 
+            logfile=self.lammps_logfile("run_integration", iteration=iteration), profile=self.profile_file)
         
         # Adiabatic switching parameters.
         lmp.command("variable        li       equal   1.0")
@@ -148,8 +148,7 @@ class Alchemy(cph.Phase):
         
         #read dump file
         #conf = os.path.join(self.simfolder, "conf.equilibration.dump")
-        conf = os.path.join(self.simfolder, "conf.equilibration.data")
-        lmp = ph.read_data(lmp, conf)
+        lmp = self.load_configuration(lmp)
 
         #set up hybrid potential
         #here we only need to set one potential
@@ -159,7 +158,7 @@ class Alchemy(cph.Phase):
         #remap the box to get the correct pressure
         lmp = ph.remap_box(lmp, self.lx, self.ly, self.lz)
 
-        lmp.command("velocity          all create %f %d mom yes rot yes dist gaussian"%(self.calc._temperature, np.random.randint(0, 10000)))
+        lmp.command("velocity          all create %f %s mom yes rot yes dist gaussian"%(self.calc._temperature, self.seed()))
         # Integrator & thermostat.
         if self.calc._npt:
             lmp.command("fix             f1 all npt temp %f %f %f %s %f %f %f"%(self.calc._temperature, self.calc._temperature, 
@@ -227,8 +226,8 @@ class Alchemy(cph.Phase):
 
 
         #save the necessary items to a file: first step
-        lmp.command("fix             f2 all print 1 \"${dU1} ${dU2} ${flambda}\" screen no file forward_%d.dat"%iteration)
-        lmp.command("run             %d"%self.calc._n_switching_steps)
+        self.fix_switching_output(lmp, "f2", ["dU1", "dU2", "flambda"], "forward_%s.dat"%iteration)
+        self.run_switching(lmp, "forward_%s.dat"%iteration, self.calc._n_switching_steps, solid=False)
 
 
         #now equilibrate at the second potential
@@ -279,8 +278,8 @@ class Alchemy(cph.Phase):
 
 
         #save the necessary items to a file: first step
-        lmp.command("fix             f2 all print 1 \"${dU1} ${dU2} ${flambda}\" screen no file backward_%d.dat"%iteration)
-        lmp.command("run             %d"%self.calc._n_switching_steps)
+        self.fix_switching_output(lmp, "f2", ["dU1", "dU2", "flambda"], "backward_%s.dat"%iteration)
+        self.run_switching(lmp, "backward_%s.dat"%iteration, self.calc._n_switching_steps, solid=False)
 
 
         #now equilibrate at the second potential
@@ -309,9 +308,8 @@ class Alchemy(cph.Phase):
         Calculates the final work, energy dissipation; In alchemical mode, there is reference system,
         the calculated free energy is the same as the work.
         """
-        w, q, qerr = find_w(self.simfolder, nelements=self.calc.n_elements, 
-            concentration=self.concentration, nsims=self.calc.n_iterations, 
-            full=True, solid=False, alchemy=True)
+        w, q, qerr = self.find_w(nelements=self.calc.n_elements, 
+            concentration=self.concentration, solid=False, alchemy=True)
 
         self.w = w
         self.ferr = qerr
@@ -319,7 +317,7 @@ class Alchemy(cph.Phase):
         
         if self.calc.mode == "composition_scaling":
             w_arr, q_arr, qerr_arr, flambda_arr = find_w(self.simfolder, nelements=self.calc.n_elements, 
-                concentration=self.concentration, nsims=self.calc.n_iterations, 
+                concentration=self.concentration, nsims=self.n_switching_iterations, 
                 full=True, solid=False, alchemy=True, composition_integration=True)
 
             #now we need to process the comp scaling
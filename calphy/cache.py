@@ -0,0 +1,338 @@
+"""
+calphy: a Python library and command line interface for automated free
+energy calculations.
+
+Copyright 2021  (c) Sarath Menon^1, Yury Lysogorskiy^2, Ralf Drautz^2
+^1: Max Planck Institut für Eisenforschung, Dusseldorf, Germany 
+^2: Ruhr-University Bochum, Bochum, Germany
+
+calphy is published and distributed under the Academic Software License v1.0 (ASL). 
+calphy is distributed in the hope that it will be useful for non-commercial academic research, 
+but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  
+calphy API is published and distributed under the BSD 3-Clause "New" or "Revised" License
+See the LICENSE FILE for more details. 
+
+More information about the program can be found in:
+Menon, Sarath, Yury Lysogorskiy, Jutta Rogal, and Ralf Drautz.
+“Automated Free Energy Calculation from Atomistic Simulations.” Physical Review Materials 5(10), 2021
+DOI: 10.1103/PhysRevMaterials.5.103801
+
+For more information contact:
+sarath.menon@ruhr-uni-bochum.de/yury.lysogorskiy@icams.rub.de
+"""
+
+import os
+import glob
+import json
+import shutil
+import hashlib
+import numpy as np
+import yaml
+
+
+def file_hash(filename):
+    """
+    SHA-256 hash of the contents of a file
+
+    Parameters
+    ----------
+    filename : string
+        name of the file
+
+    Returns
+    -------
+    hash : string
+    """
+    sha = hashlib.sha256()
+    with open(filename, "rb") as fin:
+        for block in iter(lambda: fin.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def equilibration_key(calc):
+    """
+    Hash of the settings which determine the equilibrated state, except temperature and pressure
+
+    Parameters
+    ----------
+    calc : Calculation object
+
+    Returns
+    -------
+    key : string
+
+    Notes
+    -----
+    Files used by the potential (found in `pair_coeff`), the potential file and a lattice given
+    as a file enter the hash with their contents, so that a changed file gives a new key.
+    """
+    files = {}
+    for pc in calc.pair_coeff:
+        for token in pc.split():
+            if os.path.isfile(token):
+                files[token] = file_hash(token)
+    for filename in [calc.potential_file, calc.lattice]:
+        if (filename is not None) and os.path.isfile(filename):
+            files[filename] = file_hash(filename)
+
+    settings = {}
+    settings["alchemy"] = calc.mode in ["alchemy", "composition_scaling"]
+    settings["element"] = calc.element
+    settings["mass"] = calc.mass
+    settings["pair_style"] = calc.pair_style
+    settings["pair_style_options"] = calc.pair_style_options
+    settings["pair_coeff"] = calc.pair_coeff
+    settings["potential_file"] = calc.potential_file
+    settings["files"] = files
+    settings["lattice"] = calc.lattice
+    settings["lattice_constant"] = calc.lattice_constant
+    settings["repeat"] = calc.repeat
+    settings["reference_phase"] = calc.reference_phase
+    settings["npt"] = calc.npt
+    settings["fix_lattice"] = calc._fix_lattice
+    settings["melting_cycle"] = calc.melting_cycle
+    settings["equilibration_control"] = calc.equilibration_control
+    settings["n_equilibration_steps"] = calc.n_equilibration_steps
+    #only used to melt the liquid, so that for example fe and ts runs of a solid share states
+    settings["temperature_high"] = calc._temperature_high if calc.reference_phase == "liquid" else None
+    settings["spring_constants"] = calc.spring_constants
+    settings["md"] = {key: calc.md.to_dict()[key] for key in ["timestep", "n_small_steps", "n_every_steps", 
+        "n_repeat_steps", "n_cycles", "thermostat_damping", "barostat_damping", "init_commands"]}
+    settings["nose_hoover"] = calc.nose_hoover.to_dict()
+    settings["berendsen"] = calc.berendsen.to_dict()
+    settings["tolerance"] = calc.tolerance.to_dict()
+
+    text = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def state_folder(cachefolder, key, temperature, pressure):
+    """
+    Folder of a cached state
+
+    Parameters
+    ----------
+    cachefolder : string
+        main folder of the cache
+
+    key : string
+        key from `equilibration_key`
+
+    temperature : float
+
+    pressure : float or None
+
+    Returns
+    -------
+    folder : string
+    """
+    ps = "None" if pressure is None else "%f"%pressure
+    return os.path.join(cachefolder, key, "T_%f-P_%s"%(temperature, ps))
+
+
+def find_state(cachefolder, key, temperature, pressure, near_match=True):
+    """
+    Find a cached state
+
+    Parameters
+    ----------
+    cachefolder : string
+        main folder of the cache
+
+    key : string
+        key from `equilibration_key`
+
+    temperature : float
+
+    pressure : float or None
+
+    near_match : bool, optional
+        if True and there is no state at the given temperature and pressure, return the closest one 
+        with the same key. Default True.
+
+    Returns
+    -------
+    folder : string or None
+        folder of the state, None if nothing is found
+
+    exact : bool
+        True if the state is at the given temperature and pressure
+    """
+    folder = state_folder(cachefolder, key, temperature, pressure)
+    if os.path.exists(os.path.join(folder, "state.yaml")):
+        return folder, True
+
+    if not near_match:
+        return None, False
+
+    best = None
+    bestdist = np.inf
+    for statefile in glob.glob(os.path.join(cachefolder, key, "*", "state.yaml")):
+        with open(statefile, "r") as fin:
+            state = yaml.safe_load(fin)
+        #compare relative differences in temperature and pressure
+        dist = np.abs(state["temperature"] - temperature)/temperature
+        if (pressure is not None) and (state["input_pressure"] is not None):
+            dist += np.abs(state["input_pressure"] - pressure)/max(np.abs(pressure), 1.0E4)
+        elif (pressure is None) != (state["input_pressure"] is None):
+            continue
+        if dist < bestdist:
+            best = os.path.dirname(statefile)
+            bestdist = dist
+    return best, False
+
+
+def store_state(folder, state, conffile=None, configuration=None):
+    """
+    Store an equilibrated state in the cache
+
+    Parameters
+    ----------
+    folder : string
+        folder of the state, see `state_folder`
+
+    state : dict
+        averaged quantities of the state
+
+    conffile : string, optional
+        data file of the equilibrated configuration
+
+    configuration : dict, optional
+        configuration from `helpers.gather_configuration`
+
+    Returns
+    -------
+    None
+
+    Notes
+    -----
+    The state is written to a temporary folder which is then renamed, so that a state
+    is never read half written.
+    """
+    tmpfolder = folder + ".tmp%d"%os.getpid()
+    os.makedirs(tmpfolder, exist_ok=True)
+    if conffile is not None:
+        shutil.copy(conffile, os.path.join(tmpfolder, "conf.equilibration.data"))
+    if configuration is not None:
+        np.savez(os.path.join(tmpfolder, "configuration.npz"), **configuration)
+    with open(os.path.join(tmpfolder, "state.yaml"), "w") as fout:
+        yaml.safe_dump(state, fout)
+
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
+    os.rename(tmpfolder, folder)
+
+
+def load_state(folder):
+    """
+    Load a cached state
+
+    Parameters
+    ----------
+    folder : string
+        folder of the state
+
+    Returns
+    -------
+    state : dict
+        averaged quantities of the state
+
+    conffile : string or None
+        data file of the configuration
+
+    configuration : dict or None
+        configuration for `helpers.scatter_configuration`
+    """
+    with open(os.path.join(folder, "state.yaml"), "r") as fin:
+        state = yaml.safe_load(fin)
+
+    conffile = os.path.join(folder, "conf.equilibration.data")
+    if not os.path.exists(conffile):
+        conffile = None
+
+    configuration = None
+    npzfile = os.path.join(folder, "configuration.npz")
+    if os.path.exists(npzfile):
+        with np.load(npzfile) as data:
+            configuration = {key: data[key] for key in data.files}
+            configuration["ntypes"] = int(configuration["ntypes"])
+    return state, conffile, configuration
+
+
+def free_energy_key(calc):
+    """
+    Hash of the settings which determine the free energy at the equilibrated state
+
+    Parameters
+    ----------
+    calc : Calculation object
+
+    Returns
+    -------
+    key : string
+
+    Notes
+    -----
+    The key extends `equilibration_key` with the settings of the switching runs, so that
+    for example an `fe` and a `ts` calculation with the same settings share the free energy.
+    """
+    settings = {}
+    settings["equilibration"] = equilibration_key(calc)
+    settings["n_switching_steps"] = calc.n_switching_steps
+    settings["n_iterations"] = calc.n_iterations
+    settings["estimator"] = calc.estimator
+    settings["adaptive"] = calc.adaptive.to_dict()
+
+    text = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def store_free_energy(folder, key, result):
+    """
+    Store the free energy of a state in the cache
+
+    Parameters
+    ----------
+    folder : string
+        folder of the state, see `state_folder`
+
+    key : string
+        key from `free_energy_key`
+
+    result : dict
+        free energy and its contributions
+
+    Returns
+    -------
+    None
+    """
+    outfile = os.path.join(folder, "free_energy_%s.yaml"%key)
+    tmpfile = outfile + ".tmp%d"%os.getpid()
+    with open(tmpfile, "w") as fout:
+        yaml.safe_dump(result, fout)
+    os.replace(tmpfile, outfile)
+
+
+def load_free_energy(folder, key):
+    """
+    Load the free energy of a state from the cache
+
+    Parameters
+    ----------
+    folder : string
+        folder of the state, see `state_folder`
+
+    key : string
+        key from `free_energy_key`
+
+    Returns
+    -------
+    result : dict or None
+        see `store_free_energy`, None if nothing is found
+    """
+    infile = os.path.join(folder, "free_energy_%s.yaml"%key)
+    if not os.path.exists(infile):
+        return None
+    with open(infile, "r") as fin:
+        return yaml.safe_load(fin)
@@ -0,0 +1,177 @@
+"""
+calphy: a Python library and command line interface for automated free
+energy calculations.
+
+Copyright 2021  (c) Sarath Menon^1, Yury Lysogorskiy^2, Ralf Drautz^2
+^1: Max Planck Institut für Eisenforschung, Dusseldorf, Germany 
+^2: Ruhr-University Bochum, Bochum, Germany
+
+calphy is published and distributed under the Academic Software License v1.0 (ASL). 
+calphy is distributed in the hope that it will be useful for non-commercial academic research, 
+but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  
+calphy API is published and distributed under the BSD 3-Clause "New" or "Revised" License
+See the LICENSE FILE for more details. 
+
+More information about the program can be found in:
+Menon, Sarath, Yury Lysogorskiy, Jutta Rogal, and Ralf Drautz.
+“Automated Free Energy Calculation from Atomistic Simulations.” Physical Review Materials 5(10), 2021
+DOI: 10.1103/PhysRevMaterials.5.103801
+
+For more information contact:
+sarath.menon@ruhr-uni-bochum.de/yury.lysogorskiy@icams.rub.de
+"""
+
+import numpy as np
+
+
+def autocorrelation_time(x):
+    """
+    Integrated autocorrelation time of a time series
+
+    Parameters
+    ----------
+    x : array of floats
+        time series
+
+    Returns
+    -------
+    tau : float
+        integrated autocorrelation time in units of the sampling interval, 
+        defined such that the number of uncorrelated samples is len(x)/tau
+
+    Notes
+    -----
+    The autocorrelation function is calculated with FFT and summed up to its first
+    non-positive value. The result is at least 1.
+    """
+    x = np.asarray(x, dtype=float)
+    n = len(x)
+    if n < 3:
+        return 1.0
+
+    dx = x - np.mean(x)
+    var = np.var(x)
+    if var == 0:
+        return 1.0
+
+    fx = np.fft.rfft(dx, n=2*n)
+    acf = np.fft.irfft(fx*np.conj(fx))[:n]/(var*np.arange(n, 0, -1))
+
+    t = np.arange(1, n)
+    c = acf[1:]
+    negative = np.nonzero(c <= 0)[0]
+    cut = negative[0] if len(negative) > 0 else len(c)
+    tau = 1.0 + 2.0*np.sum((1.0 - t[:cut]/n)*c[:cut])
+    return max(1.0, tau)
+
+
+def block_average(x, nblocks=5):
+    """
+    Block average of a time series
+
+    Parameters
+    ----------
+    x : array of floats
+        time series
+
+    nblocks : int, optional
+        number of blocks, default 5
+
+    Returns
+    -------
+    mean : float
+        mean of the block averages
+
+    error : float
+        standard error of the mean from the spread of the block averages
+    """
+    x = np.asarray(x, dtype=float)
+    nblocks = min(int(nblocks), len(x))
+    if nblocks < 2:
+        return np.mean(x), np.inf
+
+    size = len(x)//nblocks
+    blocks = np.mean(x[len(x)-size*nblocks:].reshape(nblocks, size), axis=1)
+    return np.mean(blocks), np.std(blocks, ddof=1)/np.sqrt(nblocks)
+
+
+def detect_equilibration(x, ncandidates=50):
+    """
+    Find the start of the equilibrated part of a time series
+
+    Parameters
+    ----------
+    x : array of floats
+        time series
+
+    ncandidates : int, optional
+        number of start points that are tested, default 50
+
+    Returns
+    -------
+    start : int
+        index where the equilibrated part starts
+
+    tau : float
+        integrated autocorrelation time of the equilibrated part
+
+    n_effective : float
+        effective number of uncorrelated samples in the equilibrated part
+
+    Notes
+    -----
+    The start is chosen to maximise the number of uncorrelated samples after it,
+    which discards the initial transient (Chodera, J. Chem. Theory Comput. 12, 1799 (2016)).
+    """
+    x = np.asarray(x, dtype=float)
+    n = len(x)
+    if n < 3:
+        return 0, 1.0, float(n)
+
+    step = max(1, (n-2)//int(ncandidates))
+    best = (0, 1.0, 0.0)
+    for start in range(0, n-2, step):
+        tau = autocorrelation_time(x[start:])
+        n_effective = (n - start)/tau
+        if n_effective > best[2]:
+            best = (start, tau, n_effective)
+    return best
+
+
+def equilibrated_statistics(x, nblocks=5):
+    """
+    Statistics of the equilibrated part of a time series
+
+    Parameters
+    ----------
+    x : array of floats
+        time series
+
+    nblocks : int, optional
+        number of blocks used for the block average, default 5
+
+    Returns
+    -------
+    stats : dict
+        `start` of the equilibrated part, its `mean` and standard `error`,
+        the autocorrelation time `tau` and the effective number of samples `n_effective`
+
+    Notes
+    -----
+    The error is the larger of the estimates from the autocorrelation time and from block averaging.
+    """
+    x = np.asarray(x, dtype=float)
+    start, tau, n_effective = detect_equilibration(x)
+    prod = x[start:]
+    error = np.sqrt(np.var(prod)/max(n_effective, 1.0))
+    _, block_error = block_average(prod, nblocks=nblocks)
+    if np.isfinite(block_error):
+        error = max(error, block_error)
+
+    stats = {}
+    stats["start"] = int(start)
+    stats["mean"] = float(np.mean(prod))
+    stats["error"] = float(error)
+    stats["tau"] = float(tau)
+    stats["n_effective"] = float(n_effective)
+    return stats
@@ -33,4 +33,7 @@ class MeltedError(CustomError):
 
 class SolidifiedError(CustomError):
     pass
-    
\ No newline at end of file
+    
+
+class SwitchingAbortedError(CustomError):
+    pass
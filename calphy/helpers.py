@@ -23,14 +23,228 @@ sarath.menon@ruhr-uni-bochum.de/yury.lysogorskiy@icams.rub.de
 
 import os
 import logging
+import threading
+import numpy as np
 import calphy.lattice as pl
 import pyscal.core as pc
 from ase.io import read, write
 from pyscal.trajectory import Trajectory
 from pylammpsmpi import LammpsLibrary
+from calphy.profiling import CommandTracer
 
 
-def create_object(cores, directory, timestep, cmdargs=None, init_commands=None):
+class SessionHandle:
+    """
+    LAMMPS object handed out by a `LammpsSession`
+
+    All calls are passed on to the LAMMPS object of the session, except
+    `close`, which keeps the LAMMPS instance running for the next stage.
+    """
+    def __init__(self, session):
+        self._session = session
+
+    def __getattr__(self, name):
+        return getattr(self._session.lmp, name)
+
+    def close(self):
+        pass
+
+
+class RestartReplay:
+    """
+    LAMMPS object that replays the setup of a stage on top of a restart file
+
+    Parameters
+    ----------
+    lmp : LammpsLibrary object
+        object in which the restart file was read
+
+    checkpoint : dict
+        checkpoint of the switching run, see `Phase.write_checkpoint`
+
+    Notes
+    -----
+    While `replaying` is True, commands that would move the atoms or change
+    the box and velocities read from the restart file, `run`, `velocity` and
+    `change_box`, are skipped. All other commands, such as the potential, fixes,
+    computes and variables, are passed on, so that the fixes stored in the restart
+    file are specified again. `Phase.run_switching` stops replaying once it reaches
+    the switching run of the checkpoint.
+    """
+    skipped = ["run", "velocity", "change_box"]
+
+    def __init__(self, lmp, checkpoint):
+        self._lmp = lmp
+        self.checkpoint = checkpoint
+        self.replaying = True
+
+    def __getattr__(self, name):
+        return getattr(self._lmp, name)
+
+    def command(self, cmd):
+        raw = cmd.split()
+        if self.replaying and (len(raw) > 0) and (raw[0] in self.skipped):
+            return
+        return self._lmp.command(cmd)
+
+
+class LammpsSession:
+    """
+    A LAMMPS instance kept alive over the stages of a calculation
+
+    Parameters
+    ----------
+    cores : int
+        number of cores
+
+    directory: string
+        location of the work directory
+
+    cmdargs: list of strings, optional
+        command line arguments for LAMMPS
+
+    Notes
+    -----
+    The instance is started at the first call to `create_object` and reset with
+    `clear` at the following calls, which avoids spawning new MPI processes for
+    every stage. Since `clear` also removes the pair style, the stages still set
+    the potential themselves. Call `close` once the calculation is finished.
+    """
+    def __init__(self, cores, directory, cmdargs=None):
+        self.cores = cores
+        self.directory = directory
+        self.cmdargs = cmdargs
+        self.lmp = None
+        self.n_stages = 0
+
+    def start(self):
+        """
+        Start a new stage and return a handle to the LAMMPS object
+        """
+        if self.lmp is None:
+            self.lmp = LammpsLibrary(
+                mode="local", cores=self.cores, working_directory=self.directory, cmdargs=self.cmdargs
+            )
+        else:
+            self.lmp.command("clear")
+        self.n_stages += 1
+        return SessionHandle(self)
+
+    def close(self):
+        """
+        Close the LAMMPS instance
+        """
+        if self.lmp is not None:
+            self.lmp.close()
+            self.lmp = None
+
+
+#binding of the MPI processes started from the current thread, see `set_group_binding`
+_binding = threading.local()
+_launch_lock = threading.Lock()
+
+
+def group_cpu_sets(cores, ngroups, cpu_set=None):
+    """
+    Split the cores into disjoint sets, one for each group of iterations
+
+    Parameters
+    ----------
+    cores : int
+        total number of cores
+
+    ngroups : int
+        number of groups
+
+    cpu_set : list of ints, optional
+        logical core ids which are split, by default the cores from zero
+
+    Returns
+    -------
+    cpu_sets : list of lists of ints
+        logical core ids of each group
+    """
+    ncores = max(1, cores//ngroups)
+    cpu_sets = [list(range(i*ncores, (i+1)*ncores)) for i in range(ngroups)]
+    if cpu_set is not None:
+        cpu_sets = [[cpu_set[x] for x in group] for group in cpu_sets]
+    return cpu_sets
+
+
+def current_cpu_set():
+    """
+    Cores of the binding set for the current thread with `set_group_binding`
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    cpu_set : list of ints or None
+        logical core ids, None if the thread is not bound to cores
+    """
+    env = getattr(_binding, "env", None)
+    if (not env) or ("OMPI_MCA_hwloc_base_cpu_set" not in env):
+        return None
+    return [int(x) for x in env["OMPI_MCA_hwloc_base_cpu_set"].split(",")]
+
+
+def binding_environment(binding, cpu_set=None):
+    """
+    Environment variables which set the binding of the MPI processes
+
+    Parameters
+    ----------
+    binding : string
+        `none` to not bind the processes, `cores` to bind them to `cpu_set`,
+        `default` to keep the binding of the MPI library
+
+    cpu_set : list of ints, optional
+        logical core ids, used if `binding` is `cores`
+
+    Returns
+    -------
+    env : dict
+        variables for Open MPI, both the older `hwloc_base` and the PRRTE names
+
+    Notes
+    -----
+    The variables are read by `mpiexec` when LAMMPS is started. Other MPI libraries
+    have to be configured by the user.
+    """
+    if binding == "default":
+        return {}
+    elif binding == "none":
+        return {"OMPI_MCA_hwloc_base_binding_policy": "none",
+            "PRTE_MCA_hwloc_default_binding_policy": "none"}
+    elif binding == "cores":
+        cpus = ",".join([str(x) for x in cpu_set])
+        return {"OMPI_MCA_hwloc_base_binding_policy": "core",
+            "OMPI_MCA_hwloc_base_cpu_set": cpus,
+            "PRTE_MCA_hwloc_default_binding_policy": "core",
+            "PRTE_MCA_hwloc_default_cpu_set": cpus}
+    else:
+        raise ValueError("group_binding should be one of none, cores or default, got %s"%binding)
+
+
+def set_group_binding(env=None):
+    """
+    Set the binding environment for LAMMPS objects created from the current thread
+
+    Parameters
+    ----------
+    env : dict, optional
+        see `binding_environment`, None to remove the binding
+
+    Returns
+    -------
+    None
+    """
+    _binding.env = env
+
+
+def create_object(cores, directory, timestep, cmdargs=None, init_commands=None, session=None, logfile=None, profile=None):
     """
     Create LAMMPS object
 
@@ -45,13 +259,50 @@ def create_object(cores, directory, timestep, cmdargs=None, init_commands=None):
     timestep: float
         timestep for the simulation
 
+    session: LammpsSession, optional
+        if provided, the running instance of the session is reset and reused
+
+    logfile: string, optional
+        if provided, the LAMMPS log is written to this file
+
+    profile: string, optional
+        if provided, all calls to the LAMMPS object are timed and the profile
+        is added to this file when the object is closed, see `calphy.profiling.CommandTracer`
+
     Returns
     -------
     lmp : LammpsLibrary object
+
+    Notes
+    -----
+    If a binding was set for the current thread with `set_group_binding`, LAMMPS is
+    started with it.
     """
-    lmp = LammpsLibrary(
-        mode="local", cores=cores, working_directory=directory, cmdargs=cmdargs
-    )
+    env = getattr(_binding, "env", None)
+    if (session is None) and env:
+        #mpiexec takes the environment at launch, so launches with a binding are serialised
+        with _launch_lock:
+            backup = {key: os.environ.get(key) for key in env}
+            os.environ.update(env)
+            try:
+                lmp = LammpsLibrary(
+                    mode="local", cores=cores, working_directory=directory, cmdargs=cmdargs
+                )
+            finally:
+                for key, val in backup.items():
+                    if val is None:
+                        os.environ.pop(key, None)
+                    else:
+                        os.environ[key] = val
+    elif session is None:
+        lmp = LammpsLibrary(
+            mode="local", cores=cores, working_directory=directory, cmdargs=cmdargs
+        )
+    else:
+        lmp = session.start()
+
+    if profile is not None:
+        lmp = CommandTracer(lmp, profile)
 
     commands = [["units", "metal"],
                 ["boundary", "p p p"],
@@ -76,6 +327,10 @@ def create_object(cores, directory, timestep, cmdargs=None, init_commands=None):
     for command in commands:
         lmp.command(" ".join(command))
 
+    #after the initial commands, which can define variables used in the name
+    if logfile is not None:
+        lmp.command("log %s"%logfile)
+
     return lmp
 
 
@@ -171,6 +426,67 @@ def read_data(lmp, file):
     return lmp
 
 
+def gather_configuration(lmp):
+    """
+    Gather the current configuration from LAMMPS
+
+    Parameters
+    ----------
+    lmp : LammpsLibrary object
+
+    Returns
+    -------
+    conf : dict
+        box, tilt factors, number of atom types, and ids, types, positions
+        and velocities of the atoms sorted by ids
+    """
+    boxlo, boxhi, xy, yz, xz, _, _ = lmp.extract_box()
+    conf = {}
+    conf["boxlo"] = np.array(boxlo, dtype=float)
+    conf["boxhi"] = np.array(boxhi, dtype=float)
+    conf["tilt"] = np.array([xy, xz, yz], dtype=float)
+    conf["ntypes"] = int(lmp.extract_global("ntypes"))
+    conf["ids"] = np.array(lmp.gather_atoms("id"), dtype=int)
+    conf["types"] = np.array(lmp.gather_atoms("type"), dtype=int)
+    conf["x"] = np.array(lmp.gather_atoms("x"), dtype=float).reshape(-1, 3)
+    conf["v"] = np.array(lmp.gather_atoms("v"), dtype=float).reshape(-1, 3)
+    return conf
+
+
+def scatter_configuration(lmp, conf):
+    """
+    Create the box and atoms of a gathered configuration in LAMMPS
+
+    Parameters
+    ----------
+    lmp : LammpsLibrary object
+
+    conf : dict
+        configuration from `gather_configuration`
+
+    Returns
+    -------
+    lmp : LammpsLibrary object
+
+    Notes
+    -----
+    This replaces reading a data file written after the equilibration. As for
+    `read_data`, masses and the potential have to be set afterwards.
+    """
+    lo = conf["boxlo"]
+    hi = conf["boxhi"]
+    if np.any(conf["tilt"] != 0):
+        lmp.command("region           box prism %.10f %.10f %.10f %.10f %.10f %.10f %.10f %.10f %.10f"%(lo[0], hi[0],
+            lo[1], hi[1], lo[2], hi[2], conf["tilt"][0], conf["tilt"][1], conf["tilt"][2]))
+    else:
+        lmp.command("region           box block %.10f %.10f %.10f %.10f %.10f %.10f"%(lo[0], hi[0],
+            lo[1], hi[1], lo[2], hi[2]))
+    lmp.command("create_box       %d box"%conf["ntypes"])
+    lmp.create_atoms(len(conf["ids"]), conf["ids"].tolist(), conf["types"].tolist(),
+        conf["x"].ravel().tolist(), v=conf["v"].ravel().tolist())
+    return lmp
+
+
 def convert_to_data_file(inputfile, outputfile, ghost_elements=0):
     atoms = read(inputfile, format="lammps-dump-text")
     write(outputfile, atoms, format="lammps-data")
@@ -347,13 +663,14 @@ def write_data(lmp, file):
     return lmp
 
 
-def reset_timestep(conf, file="current.data"):
+def reset_timestep(conf, file="current.data", session=None):
     lmp = create_object(
         cores=1,
         directory=os.path.dirname(file),
         timestep=0,
         cmdargs=None,
         init_commands=None,
+        session=session,
     )
     lmp = read_data(lmp, file)
     lmp = write_data(lmp, conf)
@@ -173,6 +173,8 @@ class Calculation(InputTemplate):
         self._n_iterations = 1
         self._equilibration_control = None
         self._folder_prefix = None
+        self._estimator = "mean"
+        self._energy_scaling = "single"
 
         #add second level options; for example spring constants
         self._spring_constants = None
@@ -188,6 +190,10 @@ class Calculation(InputTemplate):
         self.md.barostat_damping = 0.1
         self.md.cmdargs = None
         self.md.init_commands = None
+        self.md.persistent_session = False
+        self.md.in_memory_configuration = False
+        self.md.write_configuration = True
+        self.md.profile = False
 
         self.nose_hoover = InputTemplate()
         self.nose_hoover.thermostat_damping = 0.1
@@ -207,6 +213,14 @@ class Calculation(InputTemplate):
         self.queue.commands = None
         self.queue.options = None
         self.queue.modules = None
+        self.queue.iterations_in_parallel = 1
+        self.queue.use_partitions = False
+        self.queue.group_binding = "none"
+        self.queue.job_array = False
+        self.queue.pack = 1
+        self.queue.total_cores = None
+        self.queue.max_jobs = None
+        self.queue.priority = 0
         
         self.tolerance = InputTemplate()
         self.tolerance.lattice_constant = 0.0002
@@ -214,15 +228,39 @@ class Calculation(InputTemplate):
         self.tolerance.solid_fraction = 0.7
         self.tolerance.liquid_fraction = 0.05
         self.tolerance.pressure = 0.5
+        self.tolerance.effective_samples = 10
         
         #specific input options
         self.melting_temperature = InputTemplate()
         self.melting_temperature.guess = None
         self.melting_temperature.step = 200
         self.melting_temperature.attempts = 5
+        self.melting_temperature.concurrent = False
+        self.melting_temperature.incremental = True
 
         #new mode for composition trf
         self.composition_scaling = CompositionScaling()
+
+        #on the fly monitoring of switching runs
+        self.monitor = InputTemplate()
+        self.monitor.n_steps = 0
+
+        #cache of equilibrated states
+        self.equilibration_cache = InputTemplate()
+        self.equilibration_cache.folder = None
+        self.equilibration_cache.near_match = True
+
+        #error driven number of switching iterations
+        self.adaptive = InputTemplate()
+        self.adaptive.target_error = None
+        self.adaptive.n_min = 2
+        self.adaptive.n_max = None
+
+        #output of the switching runs
+        self.output = InputTemplate()
+        self.output.n_average = 1
+        self.output.binary = False
+        self.output.keep_text = True
     
     def __repr__(self):
         """
@@ -584,6 +622,26 @@ class Calculation(InputTemplate):
             raise ValueError("Equilibration control should be either berendsen or nose-hoover or None")
         self._equilibration_control = val
 
+    @property
+    def estimator(self):
+        return self._estimator
+
+    @estimator.setter
+    def estimator(self, val):
+        if val not in ["mean", "bar", "crooks"]:
+            raise ValueError("estimator should be either mean, bar or crooks")
+        self._estimator = val
+
+    @property
+    def energy_scaling(self):
+        return self._energy_scaling
+
+    @energy_scaling.setter
+    def energy_scaling(self, val):
+        if val not in ["single", "hybrid"]:
+            raise ValueError("energy_scaling should be either single or hybrid")
+        self._energy_scaling = val
+
     @property
     def melting_cycle(self):
         return self._melting_cycle
@@ -665,7 +723,7 @@ class Calculation(InputTemplate):
             identistring = "-".join([self.folder_prefix, prefix, l, str(ts), str(ps)])
         return identistring
 
-    def create_folders(self, prefix=None):
+    def create_folders(self, prefix=None, resume=False):
         """
         Create the necessary folder for calculation
 
@@ -674,6 +732,9 @@ class Calculation(InputTemplate):
         calc : dict
             calculation block
 
+        resume : bool, optional
+            if True, an existing folder is kept so that the calculation can be resumed
+
         Returns
         -------
         folder : string
@@ -685,6 +746,9 @@ class Calculation(InputTemplate):
         else:
             simfolder = os.path.join(prefix, identistring)
 
+        if resume and os.path.exists(simfolder):
+            return simfolder
+
         #if folder exists, delete it -> then create
         try:
             if os.path.exists(simfolder):
@@ -721,6 +785,14 @@ class Calculation(InputTemplate):
                 calc.berendsen.add_from_dict(indata["berendsen"])
             if "composition_scaling" in indata.keys():
                 calc.composition_scaling.add_from_dict(indata["composition_scaling"])
+            if "monitor" in indata.keys():
+                calc.monitor.add_from_dict(indata["monitor"])
+            if "adaptive" in indata.keys():
+                calc.adaptive.add_from_dict(indata["adaptive"])
+            if "equilibration_cache" in indata.keys():
+                calc.equilibration_cache.add_from_dict(indata["equilibration_cache"])
+            if "output" in indata.keys():
+                calc.output.add_from_dict(indata["output"])
             #if temperature_high is present, set it
             if "temperature_high" in indata.keys():
                 calc.temperature_high = indata["temperature_high"]
@@ -760,7 +832,7 @@ def read_inputfile(file):
             calc = Calculation.generate(indata)
             calc.add_from_dict(ci, keys=["mode", "pair_style", "pair_coeff", "repeat", "n_equilibration_steps",
                                 "n_switching_steps", "n_print_steps", "n_iterations", "spring_constants", "equilibration_control",
-                                "folder_prefix"])
+                                "folder_prefix", "energy_scaling"])
             calc.pressure = Calculation.convert_to_list(ci["pressure"], check_none=True) if "pressure" in ci.keys() else 0
             calc.temperature = Calculation.convert_to_list(ci["temperature"]) if "temperature" in ci.keys() else None
             calc.lattice = Calculation.convert_to_list(ci["lattice"]) if "lattice" in ci.keys() else None
@@ -796,7 +868,8 @@ def read_inputfile(file):
                 calc = Calculation.generate(indata)
                 calc.add_from_dict(ci, keys=["mode", "pair_style", "pair_coeff", "pair_style_options", "npt", "repeat", "n_equilibration_steps",
                                 "n_switching_steps", "n_print_steps", "n_iterations", "potential_file", "spring_constants",
-                                "melting_cycle", "equilibration_control", "folder_prefix", "temperature_high"])
+                                "melting_cycle", "equilibration_control", "folder_prefix", "temperature_high",
+                                "estimator", "energy_scaling"])
                 calc.lattice = combo[0]["lattice"]
                 calc.lattice_constant = combo[0]["lattice_constant"]
                 calc.reference_phase = combo[0]["reference_phase"]
@@ -27,8 +27,11 @@ import sys
 import math
 import os
 import warnings
-from calphy.splines import splines, sum_spline1, sum_spline25, sum_spline50, sum_spline75, sum_spline100
+from calphy.splines import splines, sum_splines
 from scipy.integrate import cumtrapz
+from scipy.optimize import brentq
+from scipy.special import expit
+from scipy.signal import medfilt, savgol_filter
 from tqdm import tqdm
 import pyscal.core as pc
 from ase.io import read
@@ -46,10 +49,257 @@ eV2J = const.eV
 #             TI PATH INTEGRATION ROUTINES
 #--------------------------------------------------------------------
 
+def is_block_averaged(filename):
+    """
+    Check if a switching file was written by `fix ave/time`
+
+    Parameters
+    ----------
+    filename: string
+        name of the file
+
+    Returns
+    -------
+    averaged : bool
+        True if the header of `fix ave/time` is found, in which case the first column is the timestep
+    """
+    with open(filename, "r") as fin:
+        for count, line in enumerate(fin):
+            if line.startswith("# TimeStep"):
+                return True
+            if (count > 2) or (not line.startswith("#")):
+                break
+    return False
+
+
+def pad_block_averages(data):
+    """
+    Extend block averaged switching data by half a block at both ends
+
+    Parameters
+    ----------
+    data : ndarray of shape (ncols, nblocks)
+        block averages, with lambda as the last column
+
+    Returns
+    -------
+    data : ndarray of shape (ncols, nblocks+2)
+
+    Notes
+    -----
+    The trapezoid rule over the block averages misses half a block at the start and at the end of
+    the path. Adding the first and last averages half a block spacing beyond the ends makes the
+    trapezoid sum equal to the sum of block averages times block widths, which is the integral
+    over the per-step data.
+    """
+    if data.shape[1] < 2:
+        return data
+    first = np.copy(data[:, :1])
+    last = np.copy(data[:, -1:])
+    first[-1] -= 0.5*(data[-1, 1] - data[-1, 0])
+    last[-1] += 0.5*(data[-1, -1] - data[-1, -2])
+    return np.ascontiguousarray(np.concatenate((first, data, last), axis=1))
+
+
+def check_block_averaging(n_average, steps):
+    """
+    Check that runs written as block averages consist of whole blocks
+
+    Parameters
+    ----------
+    n_average : int
+        number of steps in each block
+
+    steps : dict
+        number of steps of each run, by name. Runs with zero steps are ignored.
+
+    Returns
+    -------
+    None
+
+    Notes
+    -----
+    `fix ave/time` writes a block only on timesteps that are multiples of `n_average`. If a run,
+    or one of the runs before it, is not a multiple of `n_average`, up to `n_average-1` steps
+    at the ends of the switching path are not written and the integral is not preserved.
+    """
+    if n_average <= 1:
+        return
+    for key, nsteps in steps.items():
+        if int(nsteps)%n_average != 0:
+            raise ValueError("%s (%d) should be a multiple of output.n_average (%d)"%(key, int(nsteps), n_average))
+
+
+def load_switching_data(filename, cache=False):
+    """
+    Read a switching file in a single pass
+
+    Parameters
+    ----------
+    filename: string
+        name of the file written by `fix print` or `fix ave/time` during switching
+
+    cache : bool, optional
+        If True, a binary copy of the data is stored next to the file as
+        `filename.npy` and reused as long as it is newer than the text file.
+        Default False.
+
+    Returns
+    -------
+    data : ndarray of shape (ncols, nsteps)
+        contiguous array with one row per column of the input file
+
+    Notes
+    -----
+    If a binary file written by `store_switching_data` exists and is not older than
+    the text file, it is read instead. For files written by `fix ave/time`, the timestep column
+    is removed and the block averages are padded with `pad_block_averages`.
+    """
+    binfile = binary_filename(filename)
+    if os.path.exists(binfile):
+        if (not os.path.exists(filename)) or (os.path.getmtime(binfile) >= os.path.getmtime(filename)):
+            with np.load(binfile) as fin:
+                return fin["data"]
+
+    cachefile = ".".join([filename, "npy"])
+    if cache and os.path.exists(cachefile):
+        if os.path.getmtime(cachefile) >= os.path.getmtime(filename):
+            return np.load(cachefile)
+
+    data = np.loadtxt(filename, comments="#", ndmin=2)
+    data = np.ascontiguousarray(data.T)
+    if is_block_averaged(filename):
+        data = pad_block_averages(data[1:])
+
+    if cache:
+        #write to a temporary file first so that a partial sidecar is never read
+        tmpfile = ".".join([filename, "tmp", "npy"])
+        np.save(tmpfile, data)
+        os.replace(tmpfile, cachefile)
+    return data
+
+
+def binary_filename(filename):
+    """
+    Name of the binary file of a switching file
+
+    Parameters
+    ----------
+    filename: string
+        name of the text file, for example `forward_1.dat`
+
+    Returns
+    -------
+    binfile: string
+        name of the binary file, for example `forward_1.npz`
+    """
+    return ".".join([os.path.splitext(filename)[0], "npz"])
+
+
+def store_switching_data(filename, keep_text=True):
+    """
+    Store a switching file as compressed binary data
+
+    Parameters
+    ----------
+    filename: string
+        name of the switching file
+
+    keep_text: bool, optional
+        if False, the text file is removed after the binary file is written
+
+    Returns
+    -------
+    binfile: string
+        name of the binary file
+    """
+    data = load_switching_data(filename)
+    binfile = binary_filename(filename)
+    #np.savez adds the extension itself
+    tmpfile = ".".join([os.path.splitext(filename)[0], "tmp"])
+    np.savez_compressed(tmpfile, data=data)
+    os.replace(".".join([tmpfile, "npz"]), binfile)
+    if not keep_text:
+        os.remove(filename)
+    return binfile
+
+
+def truncate_switching_data(filename, nrows):
+    """
+    Keep only the first rows of a switching file
+
+    Parameters
+    ----------
+    filename: string
+        name of the switching file
+
+    nrows: int
+        number of data rows to keep
+
+    Returns
+    -------
+    None
+
+    Notes
+    -----
+    Comment lines before the kept rows are kept as well. Used when a switching run is
+    restarted from a checkpoint, so that rows written after the checkpoint are not repeated.
+    """
+    lines = []
+    count = 0
+    with open(filename, "r") as fin:
+        for line in fin:
+            if count >= nrows:
+                break
+            if (not line.strip()) or line.lstrip().startswith("#"):
+                lines.append(line)
+                continue
+            #an incomplete last line
+            if not line.endswith("\n"):
+                break
+            lines.append(line)
+            count += 1
+    with open(filename, "w") as fout:
+        fout.writelines(lines)
+
+
+def get_du_lambda(data, nelements=1, concentration=[1,], 
+    usecols=(0, 1, 2), solid=True):
+    """
+    Extract the energy difference and lambda from switching data
+
+    Parameters
+    ----------
+    data : ndarray of shape (ncols, ...)
+        data as returned by `load_switching_data`, the column index should be
+        the first axis. Further axes, for example independent iterations, are kept.
+
+    usecols : list
+        column numbers to be used from input file, only used if solid is False
+
+    Returns
+    -------
+    du : ndarray
+        energy difference between the two systems
+
+    lmbda : ndarray
+        switching parameter
+    """
+    if solid:
+        conc = np.array(concentration[:nelements], dtype=float)
+        #concentration weighted sum over the spring energy of each element
+        dur = np.tensordot(conc, data[1:nelements+1], axes=1)
+        return data[0] - dur, data[nelements+1]
+    
+    dui, dur, lmbda = data[list(usecols)]
+    return dui - dur, lmbda
+
+
 def integrate_path(fwdfilename, bkdfilename, 
     nelements=1, concentration=[1,], 
     usecols=(0, 1, 2), solid=True,
-    alchemy=False, composition_integration=False):
+    alchemy=False, composition_integration=False,
+    cache=False):
     """
     Get a filename with columns du and dlambda and integrate
 
@@ -64,6 +314,9 @@ def integrate_path(fwdfilename, bkdfilename,
     usecols : list
         column numbers to be used from input file
 
+    cache : bool, optional
+        If True, cache the parsed files as binary sidecars. Default False.
+
     Returns
     -------
     w : float
@@ -72,26 +325,13 @@ def integrate_path(fwdfilename, bkdfilename,
     q : float
         heat dissipation during switching of system
     """
-    if solid:
-        fdui = np.loadtxt(fwdfilename, unpack=True, comments="#", usecols=(0,))
-        bdui = np.loadtxt(bkdfilename, unpack=True, comments="#", usecols=(0,))
-
-        fdur = np.zeros(len(fdui))
-        bdur = np.zeros(len(bdui))
-
-        for i in range(nelements):
-            fdur += concentration[i]*np.loadtxt(fwdfilename, unpack=True, comments="#", usecols=(i+1,))
-            bdur += concentration[i]*np.loadtxt(bkdfilename, unpack=True, comments="#", usecols=(i+1,))
-
-        flambda = np.loadtxt(fwdfilename, unpack=True, comments="#", usecols=(nelements+1,))
-        blambda = np.loadtxt(bkdfilename, unpack=True, comments="#", usecols=(nelements+1,))
+    fdata = load_switching_data(fwdfilename, cache=cache)
+    bdata = load_switching_data(bkdfilename, cache=cache)
 
-    else:
-        fdui, fdur, flambda = np.loadtxt(fwdfilename, unpack=True, comments="#", usecols=usecols)
-        bdui, bdur, blambda = np.loadtxt(bkdfilename, unpack=True, comments="#", usecols=usecols)
-
-    fdu = fdui - fdur
-    bdu = bdui - bdur
+    fdu, flambda = get_du_lambda(fdata, nelements=nelements, 
+        concentration=concentration, usecols=usecols, solid=solid)
+    bdu, blambda = get_du_lambda(bdata, nelements=nelements, 
+        concentration=concentration, usecols=usecols, solid=solid)
     
     if composition_integration:
         fw = cumtrapz(fdu, flambda, initial=0)
@@ -106,11 +346,94 @@ def integrate_path(fwdfilename, bkdfilename,
     return w, q, flambda
 
 
+def integrate_paths(mainfolder, nelements=1, 
+    concentration=[1,], nsims=5, 
+    usecols=(0,1,2), solid=True,
+    composition_integration=False,
+    cache=False):
+    """
+    Integrate the forward and backward work of all independent simulations at once
+
+    Parameters
+    ----------
+    mainfolder: string
+        main simulation folder
+
+    nsims : int, optional
+        number of independent simulations, default 5
+
+    usecols : tuple, optional
+        Columns to read in from data file. Default (0, 1, 2)
+
+    composition_integration : bool, optional
+        If True, the cumulative integral along lambda is returned. Default False
+
+    cache : bool, optional
+        If True, cache the parsed files as binary sidecars. Default False.
+
+    Returns
+    -------
+    fw : ndarray of shape (nsims,) or (nsims, nsteps)
+        work in the forward direction for each simulation
+
+    bw : ndarray of shape (nsims,) or (nsims, nsteps)
+        work in the backward direction for each simulation
+
+    flambda : ndarray of shape (nsteps,)
+        lambda values of the forward switching
+
+    Notes
+    -----
+    All files of one direction should have the same number of steps, they are
+    stacked into a single (ncols, nsims, nsteps) array and integrated together.
+    """
+    fdata = np.stack([load_switching_data(os.path.join(mainfolder, 'forward_%d.dat'%(i+1)), 
+        cache=cache) for i in range(nsims)], axis=1)
+    bdata = np.stack([load_switching_data(os.path.join(mainfolder, 'backward_%d.dat'%(i+1)), 
+        cache=cache) for i in range(nsims)], axis=1)
+
+    fdu, flambda = get_du_lambda(fdata, nelements=nelements, 
+        concentration=concentration, usecols=usecols, solid=solid)
+    bdu, blambda = get_du_lambda(bdata, nelements=nelements, 
+        concentration=concentration, usecols=usecols, solid=solid)
+
+    if composition_integration:
+        fw = cumtrapz(fdu, flambda, axis=1, initial=0)
+        bw = cumtrapz(bdu, blambda, axis=1, initial=0)
+    else:
+        fw = np.trapz(fdu, flambda, axis=1)
+        bw = np.trapz(bdu, blambda, axis=1)
+
+    return fw, bw, flambda[-1]
+
+
+def standard_error(values):
+    """
+    Standard error of the mean of independent samples
+
+    Parameters
+    ----------
+    values : array
+        samples along the first axis
+
+    Returns
+    -------
+    err : float or array
+        sample standard deviation divided by the square root of the number of samples,
+        zero for a single sample
+    """
+    values = np.asarray(values)
+    if len(values) < 2:
+        return np.zeros(values.shape[1:]) if values.ndim > 1 else 0.0
+    return np.std(values, axis=0, ddof=1)/np.sqrt(len(values))
+
+
 def find_w(mainfolder, nelements=1, 
     concentration=[1,], nsims=5, 
     full=False, usecols=(0,1,2), 
     solid=True,
-    alchemy=False, composition_integration=False):
+    alchemy=False, composition_integration=False,
+    cache=False):
     """
     Integrate the irreversible work and dissipation for independent simulations
 
@@ -128,6 +451,9 @@ def find_w(mainfolder, nelements=1,
     usecols : tuple, optional
         Columns to read in from data file. Default (0, 1)
 
+    cache : bool, optional
+        If True, cache the parsed files as binary sidecars. Default False.
+
     Returns
     -------
     ws : float
@@ -137,32 +463,26 @@ def find_w(mainfolder, nelements=1,
         average energy dissipation, only returned if full is True
 
     err : float
-        Error in free energy, only returned if full is True
+        Standard error of the work, only returned if full is True
     """
-    ws = []
-    qs = []
-
-    for i in range(nsims):
-        fwdfilestring = 'forward_%d.dat' % (i+1)
-        fwdfilename = os.path.join(mainfolder,fwdfilestring)
-        bkdfilestring = 'backward_%d.dat' % (i+1)
-        bkdfilename = os.path.join(mainfolder,bkdfilestring)
-        w, q, flambda = integrate_path(fwdfilename, bkdfilename, 
-            nelements=nelements, concentration=concentration, 
-            usecols=usecols, solid=solid,
-            alchemy=alchemy, composition_integration=composition_integration)
-        ws.append(w)
-        qs.append(q)
+    fw, bw, flambda = integrate_paths(mainfolder, nelements=nelements, 
+        concentration=concentration, nsims=nsims, 
+        usecols=usecols, solid=solid, 
+        composition_integration=composition_integration,
+        cache=cache)
+
+    ws = 0.5*(fw - bw)
+    qs = 0.5*(fw + bw)
     
     if composition_integration:
         wsmean = np.mean(ws, axis=0)
         qsmean = np.mean(qs, axis=0)
-        wsstd = np.std(ws, axis=0)
+        wsstd = standard_error(ws)
         return wsmean, qsmean, wsstd, flambda
 
     wsmean = np.mean(ws)
     qsmean = np.mean(qs)
-    wsstd = np.std(ws)
+    wsstd = standard_error(ws)
 
     if full:
         return wsmean, qsmean, wsstd
@@ -170,10 +490,394 @@ def find_w(mainfolder, nelements=1,
         return wsmean
 
 
+def bar_estimate(wf, wr, beta=1.0):
+    """
+    Bennett acceptance ratio estimate of the free energy difference
+
+    Parameters
+    ----------
+    wf : array of floats
+        work values of the forward process
+
+    wr : array of floats
+        work values of the reverse process
+
+    beta : float, optional
+        inverse temperature in units of the work. Default 1.0
+
+    Returns
+    -------
+    df : float
+        free energy difference in the forward direction
+    """
+    wf = beta*np.asarray(wf, dtype=float)
+    wr = beta*np.asarray(wr, dtype=float)
+    m = np.log(len(wf)/len(wr))
+
+    def _func(df):
+        return np.sum(expit(-(m + wf - df))) - np.sum(expit(-(-m + wr + df)))
+
+    #the function is monotonic in df, bracket the root with some margin
+    lo = min(np.min(wf), -np.max(wr)) - 50
+    hi = max(np.max(wf), -np.min(wr)) + 50
+    df = brentq(_func, lo, hi)
+    return df/beta
+
+
+def crooks_gaussian_estimate(wf, wr, beta=1.0):
+    """
+    Crooks Gaussian intersection estimate of the free energy difference
+
+    Parameters
+    ----------
+    wf : array of floats
+        work values of the forward process
+
+    wr : array of floats
+        work values of the reverse process
+
+    beta : float, optional
+        not used, present to keep the signature same as `bar_estimate`
+
+    Returns
+    -------
+    df : float
+        free energy difference in the forward direction
+
+    Notes
+    -----
+    Both work distributions are approximated as Gaussians, and the free energy difference
+    is the work at which the forward distribution and the mirrored reverse distribution cross.
+    """
+    if (len(wf) < 2) or (len(wr) < 2):
+        raise ValueError("Crooks Gaussian estimator needs at least two iterations")
+
+    mf, sf = np.mean(wf), np.std(wf, ddof=1)
+    mr, sr = np.mean(wr), np.std(wr, ddof=1)
+    guess = 0.5*(mf - mr)
+    if (sf == 0) or (sr == 0):
+        return guess
+
+    a = 1/sf**2 - 1/sr**2
+    b = -2*(mf/sf**2 + mr/sr**2)
+    c = mf**2/sf**2 - mr**2/sr**2 + 2*np.log(sf/sr)
+
+    if np.isclose(a, 0):
+        return -c/b
+
+    roots = np.roots([a, b, c])
+    roots = np.real(roots[np.isreal(roots)])
+    if len(roots) == 0:
+        return guess
+    return roots[np.argmin(np.abs(roots - guess))]
+
+
+def bootstrap_estimate(estimate, wf, wr, beta=1.0, nboot=200, seed=None):
+    """
+    Bootstrap the error of a free energy estimate
+
+    Parameters
+    ----------
+    estimate : callable
+        estimator with signature estimate(wf, wr, beta)
+
+    wf, wr, beta:
+        see `bar_estimate`
+
+    nboot : int, optional
+        number of bootstrap samples. Default 200
+
+    seed : int, optional
+        seed for the random number generator
+
+    Returns
+    -------
+    df : float
+        free energy difference estimated from all values
+
+    err : float
+        standard deviation of the bootstrap estimates
+
+    ci : tuple of floats
+        95% confidence interval from the bootstrap estimates
+    """
+    wf = np.asarray(wf, dtype=float)
+    wr = np.asarray(wr, dtype=float)
+    df = estimate(wf, wr, beta)
+
+    if (len(wf) < 2) or (len(wr) < 2):
+        return df, 0.0, (df, df)
+
+    rng = np.random.default_rng(seed)
+    findex = rng.integers(0, len(wf), size=(nboot, len(wf)))
+    rindex = rng.integers(0, len(wr), size=(nboot, len(wr)))
+    samples = np.array([estimate(wf[fi], wr[ri], beta) for fi, ri in zip(findex, rindex)])
+
+    ci = (np.percentile(samples, 2.5), np.percentile(samples, 97.5))
+    return df, np.std(samples), ci
+
+
+estimators = {"bar": bar_estimate, "crooks": crooks_gaussian_estimate}
+
+
+def find_w_estimate(mainfolder, temperature, natoms, 
+    estimator="bar", nelements=1, 
+    concentration=[1,], nsims=5, 
+    usecols=(0,1,2), solid=True,
+    nboot=200, cache=False):
+    """
+    Find the irreversible work from the forward and backward work distributions
+
+    Parameters
+    ----------
+    mainfolder: string
+        main simulation folder
+
+    temperature: float
+        temperature of the switching
+
+    natoms: int
+        number of atoms, the work values are per atom
+
+    estimator: string, optional
+        `bar` or `crooks`. Default `bar`
+
+    nboot: int, optional
+        number of bootstrap samples used for the error. Default 200
+
+    Returns
+    -------
+    w : float
+        irreversible work, same convention as `find_w`
+
+    q : float
+        average energy dissipation
+
+    err : float
+        bootstrap error of the work
+
+    ci : tuple of floats
+        95% bootstrap confidence interval of the work
+    """
+    if estimator not in estimators:
+        raise ValueError("estimator should be one of %s"%", ".join(estimators.keys()))
+
+    fw, bw, _ = integrate_paths(mainfolder, nelements=nelements, 
+        concentration=concentration, nsims=nsims, 
+        usecols=usecols, solid=solid, cache=cache)
+    q = np.mean(0.5*(fw + bw))
+
+    #for the Einstein crystal, du is the negative of the derivative of the Hamiltonian
+    #and the integrated values are the negative of the physical work
+    sign = -1 if solid else 1
+    beta = natoms/(kb*temperature)
+
+    df, err, ci = bootstrap_estimate(estimators[estimator], sign*fw, sign*bw, 
+        beta=beta, nboot=nboot)
+    w = sign*df
+    ci = tuple(sorted([sign*ci[0], sign*ci[1]]))
+    return w, q, err, ci
+
+
+class IncrementalReader:
+    """
+    Read a text file written by LAMMPS while the run goes on
+
+    Parameters
+    ----------
+    filename: string
+        name of the file, for example the output of `fix ave/time` or `fix print`
+
+    usecols: tuple of ints, optional
+        columns to be read, default all
+
+    Notes
+    -----
+    The reader remembers the file offset, so that each call parses only the rows
+    appended since the previous one. Lines starting with `#` are skipped and an
+    incomplete last line is kept until the rest of it is written. If `usecols` is not
+    given and the file has the `# TimeStep` header of `fix ave/time`, the timestep column
+    is dropped.
+    """
+    def __init__(self, filename, usecols=None):
+        self.filename = filename
+        self.usecols = usecols
+        self.timestep_column = False
+        self.offset = 0
+        self.nrows = 0
+        self._remainder = b""
+        self._chunks = []
+
+    def read_rows(self):
+        """
+        Read the rows written since the last call
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        data : array of floats or None
+            new rows of shape (ncols, nrows), None if there are no new rows
+        """
+        if not os.path.exists(self.filename):
+            return None
+
+        #the file was written anew, start from the beginning
+        if os.path.getsize(self.filename) < self.offset:
+            self.offset = 0
+            self.nrows = 0
+            self.timestep_column = False
+            self._remainder = b""
+            self._chunks = []
+
+        with open(self.filename, "rb") as fin:
+            fin.seek(self.offset)
+            chunk = fin.read()
+            self.offset = fin.tell()
+
+        lines = (self._remainder + chunk).split(b"\n")
+        self._remainder = lines[-1]
+        if (self.usecols is None) and any([line.startswith(b"# TimeStep") for line in lines[:-1]]):
+            self.timestep_column = True
+        rows = [line for line in lines[:-1] if line.strip() and not line.lstrip().startswith(b"#")]
+        if len(rows) == 0:
+            return None
+
+        data = np.loadtxt(rows, ndmin=2, usecols=self.usecols).T
+        if self.timestep_column:
+            data = data[1:]
+        self.nrows += data.shape[1]
+        return data
+
+    def update(self):
+        """
+        Read the new rows and add them to `data`
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        nrows : int
+            number of new rows
+        """
+        data = self.read_rows()
+        if data is None:
+            return 0
+        self._chunks.append(data)
+        return data.shape[1]
+
+    @property
+    def data(self):
+        """
+        All rows read so far, of shape (ncols, nrows)
+        """
+        if len(self._chunks) == 0:
+            return None
+        if len(self._chunks) > 1:
+            self._chunks = [np.concatenate(self._chunks, axis=1)]
+        return self._chunks[0]
+
+
+class StreamingIntegrator:
+    """
+    Integrate a switching file while it is being written
+
+    Parameters
+    ----------
+    filename: string
+        name of the switching file
+
+    nelements, concentration, usecols, solid:
+        see `get_du_lambda`
+
+    Notes
+    -----
+    Each call to `update` parses only the rows appended since the last call and adds
+    them to a running trapezoid sum. Running mean and standard deviation of the energy
+    difference are kept as well.
+    """
+    def __init__(self, filename, nelements=1, concentration=[1,], 
+        usecols=(0, 1, 2), solid=True):
+        self.filename = filename
+        self.nelements = nelements
+        self.concentration = concentration
+        self.usecols = usecols
+        self.solid = solid
+
+        self.reader = IncrementalReader(filename)
+        self.nsteps = 0
+        self.work = 0.0
+        self.lmbda = None
+        self.du = None
+        self.du_mean = 0.0
+        self._du_m2 = 0.0
+
+    @property
+    def du_std(self):
+        if self.nsteps == 0:
+            return 0.0
+        return np.sqrt(self._du_m2/self.nsteps)
+
+    def update(self):
+        """
+        Read the newly written rows and update the running values
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        nrows : int
+            number of new rows
+        """
+        data = self.reader.read_rows()
+        if data is None:
+            return 0
+
+        du, lmbda = get_du_lambda(data, nelements=self.nelements, 
+            concentration=self.concentration, usecols=self.usecols, solid=self.solid)
+
+        #join with the last point of the previous chunk for the trapezoid
+        if self.lmbda is not None:
+            self.work += np.trapz(np.insert(du, 0, self.du), np.insert(lmbda, 0, self.lmbda))
+        else:
+            self.work += np.trapz(du, lmbda)
+
+        #merge the running mean and variance with those of the new chunk
+        n = len(du)
+        ntotal = self.nsteps + n
+        delta = np.mean(du) - self.du_mean
+        self._du_m2 += np.sum((du - np.mean(du))**2) + delta**2*self.nsteps*n/ntotal
+        self.du_mean += delta*n/ntotal
+        self.nsteps = ntotal
+
+        self.du = du[-1]
+        self.lmbda = lmbda[-1]
+        return n
+
+    def to_dict(self):
+        """
+        Current state as a dict
+        """
+        state = {}
+        state["file"] = os.path.basename(self.filename)
+        state["steps"] = int(self.nsteps)
+        state["lambda"] = None if self.lmbda is None else float(self.lmbda)
+        state["work"] = float(self.work)
+        state["du_mean"] = float(self.du_mean)
+        state["du_std"] = float(self.du_std)
+        return state
+
+
 def integrate_rs(simfolder, f0, t, 
     natoms, p=0, nsims=5, 
     scale_energy=False, 
-    return_values=False):
+    return_values=False, cache=False):
     """
     Carry out the reversible scaling integration
 
@@ -194,6 +898,9 @@ def integrate_rs(simfolder, f0, t,
     scale_energy: bool, optional
         if True, scale energy with switching parameter
 
+    cache : bool, optional
+        If True, cache the parsed files as binary sidecars. Default False.
+
     Returns
     -------
     None
@@ -207,8 +914,8 @@ def integrate_rs(simfolder, f0, t,
     p = p/(10000*160.21766208)
     
     for i in range(1, nsims+1):
-        fdx, fp, fvol, flambda = np.loadtxt(os.path.join(simfolder, "ts.forward_%d.dat"%i), unpack=True, comments="#")
-        bdx, bp, bvol, blambda = np.loadtxt(os.path.join(simfolder, "ts.backward_%d.dat"%i), unpack=True, comments="#")
+        fdx, fp, fvol, flambda = load_switching_data(os.path.join(simfolder, "ts.forward_%d.dat"%i), cache=cache)
+        bdx, bp, bvol, blambda = load_switching_data(os.path.join(simfolder, "ts.backward_%d.dat"%i), cache=cache)
         
         if scale_energy:
             fdx /= flambda
@@ -240,7 +947,7 @@ def integrate_rs(simfolder, f0, t,
 
 
 def integrate_ps(simfolder, f0, natoms, pi, pf, nsims=1, 
-    return_values=False):
+    return_values=False, cache=False):
     """
     Carry out the reversible scaling integration
     
@@ -252,6 +959,8 @@ def integrate_ps(simfolder, f0, natoms, pi, pf, nsims=1,
         initial free energy for integration
     nsims : int, optional
         number of independent switching
+    cache : bool, optional
+        If True, cache the parsed files as binary sidecars. Default False.
     
     Returns
     -------
@@ -266,8 +975,8 @@ def integrate_ps(simfolder, f0, natoms, pi, pf, nsims=1,
     ws = []
 
     for i in range(1, nsims+1):
-        _, fp, fvol, _ = np.loadtxt(os.path.join(simfolder, "ps.forward_%d.dat"%i), unpack=True, comments="#")
-        _, bp, bvol, _ = np.loadtxt(os.path.join(simfolder, "ps.backward_%d.dat"%i), unpack=True, comments="#")
+        _, fp, fvol, _ = load_switching_data(os.path.join(simfolder, "ps.forward_%d.dat"%i), cache=cache)
+        _, bp, bvol, _ = load_switching_data(os.path.join(simfolder, "ps.backward_%d.dat"%i), cache=cache)
         
         fvol = fvol/natoms
         bvol = bvol/natoms
@@ -295,6 +1004,78 @@ def integrate_ps(simfolder, f0, natoms, pi, pf, nsims=1,
         return (press, f, werr)
 
 
+def fit_free_energy(t, f, deg=2):
+    """
+    Fit a polynomial in temperature to a free energy curve
+
+    Parameters
+    ----------
+    t : array of floats
+        temperatures
+
+    f : array of floats
+        free energies
+
+    deg : int, optional
+        degree of the polynomial. Default 2
+
+    Returns
+    -------
+    coef : array of floats
+        polynomial coefficients, highest power first
+    """
+    deg = min(deg, len(t)-1)
+    return np.polyfit(t, f, deg)
+
+
+def find_crossing_temperature(solres, lqdres, deg=2):
+    """
+    Find the temperature at which the free energies of two phases are equal
+
+    Parameters
+    ----------
+    solres : list of arrays
+        temperature, free energy and error of the first phase
+
+    lqdres : list of arrays
+        temperature, free energy and error of the second phase
+
+    deg : int, optional
+        degree of the polynomials fit to the free energies. Default 2
+
+    Returns
+    -------
+    tm : float or None
+        temperature at which the fits cross, None if they do not cross
+        within the common temperature range
+
+    tmerr : float or None
+        error of `tm`
+
+    Notes
+    -----
+    The error is propagated from the errors of the free energies at `tm`,
+    divided by the difference in slopes of the two fits.
+    """
+    solres = [np.asarray(x) for x in solres]
+    lqdres = [np.asarray(x) for x in lqdres]
+    tmin = max(np.min(solres[0]), np.min(lqdres[0]))
+    tmax = min(np.max(solres[0]), np.max(lqdres[0]))
+
+    diff = np.polysub(fit_free_energy(solres[0], solres[1], deg=deg),
+        fit_free_energy(lqdres[0], lqdres[1], deg=deg))
+    if np.polyval(diff, tmin)*np.polyval(diff, tmax) > 0:
+        return None, None
+    tm = brentq(lambda t: np.polyval(diff, t), tmin, tmax)
+
+    solargs = np.argsort(solres[0])
+    lqdargs = np.argsort(lqdres[0])
+    solerr = np.interp(tm, solres[0][solargs], solres[2][solargs])
+    lqderr = np.interp(tm, lqdres[0][lqdargs], lqdres[2][lqdargs])
+    tmerr = np.sqrt(solerr**2 + lqderr**2)/np.abs(np.polyval(np.polyder(diff), tm))
+    return tm, tmerr
+
+
 def integrate_mass(flambda, ref_mass, target_masses, target_counts,
     temperature, natoms):
     
@@ -308,25 +1089,101 @@ def integrate_mass(flambda, ref_mass, target_masses, target_counts,
     return mcorarr, mcorsum
 
 def remove_steps(w, stdscale):
-    peak  = np.abs(w-np.roll(w, shift=-1))
-    peak = np.where(peak> stdscale*np.std(peak), peak, 0)
-    args = np.nonzero(peak)[0]
-    print(f'No of peaks #{len(args)}')
-    diff = [w[x]-w[x-1] if x in args else 0 for x in range(len(w[:-1]))]
-    diff.append(0)
-    cum_diff = np.cumsum(diff)
-    w = w-cum_diff
-    return w
+    """
+    Remove steps from a curve
+
+    Parameters
+    ----------
+    w : array of floats
+        input curve
+
+    stdscale : float
+        jumps to the next point larger than stdscale times the standard
+        deviation of all jumps are treated as steps
+
+    Returns
+    -------
+    w : array of floats
+        curve with the steps subtracted
+    """
+    w = np.asarray(w)
+    peak = np.abs(w-np.roll(w, shift=-1))
+    mask = peak > stdscale*np.std(peak)
+    print(f'No of peaks #{np.count_nonzero(mask)}')
+    mask[-1] = False
+    diff = np.where(mask, w-np.roll(w, shift=1), 0)
+    return w-np.cumsum(diff)
 
 def remove_peaks(w, stdscale):
+    """
+    Remove single point peaks from a curve
+
+    Parameters
+    ----------
+    w : array of floats
+        input curve
+
+    stdscale : float
+        points whose smaller jump to a neighbour is larger than stdscale times
+        the standard deviation of these jumps are treated as peaks
+
+    Returns
+    -------
+    w : array of floats
+        curve with the peaks replaced by the mean of the neighbours
+    """
+    w = np.asarray(w)
     peak = np.minimum(np.abs(w-np.roll(w, shift=-1)), np.abs(np.roll(w, shift=1)-w))
-    args = np.argwhere(peak > stdscale*np.std(peak))
-    k = [(w[x-1]+w[x+1])/2 if x in args else w[x] for x in range(len(w[:-1]))]
-    k.append(w[-1])
-    return k
+    mask = peak > stdscale*np.std(peak)
+    mask[-1] = False
+    return np.where(mask, 0.5*(np.roll(w, shift=1)+np.roll(w, shift=-1)), w)
+
+def smooth_curve(w, method="median", window=51, order=3):
+    """
+    Smooth a curve with a robust filter
+
+    Parameters
+    ----------
+    w : array of floats
+        input curve
+
+    method : string or callable, optional
+        `median` for a running median, `savgol` for a Savitzky-Golay filter.
+        A callable is applied to the curve directly. Default `median`.
+
+    window : int, optional
+        width of the filter window. It is made odd and is limited to the length
+        of the curve. Default 51.
+
+    order : int, optional
+        polynomial order of the Savitzky-Golay filter. Default 3.
+
+    Returns
+    -------
+    w : array of floats
+        smoothed curve
+    """
+    if callable(method):
+        return np.asarray(method(w))
+
+    w = np.asarray(w)
+    window = min(int(window), len(w))
+    if window%2 == 0:
+        window -= 1
+    if window < 3:
+        return w
+
+    if method == "median":
+        return medfilt(w, kernel_size=window)
+    elif method == "savgol":
+        return savgol_filter(w, window, min(order, window-1))
+    else:
+        raise ValueError("unknown smoothing method %s, use median or savgol"%method)
 
 def integrate_dcc(folder1, folder2, nsims=1, scale_energy=True, 
-                  full=False, stdscale=0.25, fit_order=None):
+                  full=False, stdscale=0.25, fit_order=None,
+                  cache=False, smooth=None, smooth_window=51,
+                  smooth_order=3):
     """
     Integrate Dynamic Clausius-Clapeyron equation
 
@@ -353,6 +1210,19 @@ def integrate_dcc(folder1, folder2, nsims=1, scale_energy=True,
         If specified, a final fitting is done to remove kinks in the values
         Optional, default None.
 
+    cache: bool
+        If True, cache the parsed files as binary sidecars. Default False.
+
+    smooth: None, string or callable
+        Robust smoother applied to the integrand after the peak removal,
+        `median` or `savgol`, see `smooth_curve`. Optional, default None.
+
+    smooth_window: int
+        Window of the smoother, default 51
+
+    smooth_order: int
+        Polynomial order of the Savitzky-Golay smoother, default 3
+
     """
 
     #get number of atoms
@@ -380,10 +1250,10 @@ def integrate_dcc(folder1, folder2, nsims=1, scale_energy=True,
 
     ws = []
     for i in range(nsims):
-        fsu, fsp, fsv, fsl = np.loadtxt(os.path.join(folder1, "ts.forward_%d.dat"%(i+1)), unpack=True)
-        bsu, bsp, bsv, bsl = np.loadtxt(os.path.join(folder1, "ts.backward_%d.dat"%(i+1)), unpack=True)
-        flu, flp, flv, fll = np.loadtxt(os.path.join(folder2, "ts.forward_%d.dat"%(i+1)), unpack=True)
-        blu, blp, blv, bll = np.loadtxt(os.path.join(folder2, "ts.backward_%d.dat"%(i+1)), unpack=True)
+        fsu, fsp, fsv, fsl = load_switching_data(os.path.join(folder1, "ts.forward_%d.dat"%(i+1)), cache=cache)
+        bsu, bsp, bsv, bsl = load_switching_data(os.path.join(folder1, "ts.backward_%d.dat"%(i+1)), cache=cache)
+        flu, flp, flv, fll = load_switching_data(os.path.join(folder2, "ts.forward_%d.dat"%(i+1)), cache=cache)
+        blu, blp, blv, bll = load_switching_data(os.path.join(folder2, "ts.backward_%d.dat"%(i+1)), cache=cache)
 
         if scale_energy:
             fsu = fsu/fsl
@@ -411,6 +1281,10 @@ def integrate_dcc(folder1, folder2, nsims=1, scale_energy=True,
             fx = remove_peaks(fx, stdscale=stdscale)
             bx = remove_peaks(bx, stdscale=stdscale)
 
+        if smooth is not None:
+            fx = smooth_curve(fx, method=smooth, window=smooth_window, order=smooth_order)
+            bx = smooth_curve(bx, method=smooth, window=smooth_window, order=smooth_order)
+
         wf = cumtrapz(fx, fsl, initial=0)
         wb = cumtrapz(bx[::-1], bsl[::-1], initial=0)
 
@@ -561,10 +1435,10 @@ def get_uhlenbeck_ford_fe(temp, rho, p, sigma):
 
     Parameters
     ----------
-    temp : temperature, float
+    temp : temperature, float or array of floats
         units - K
 
-    rho : density, float
+    rho : density, float or array of floats
         units - no of atoms/ angstrom^3
 
     p : uf scale, float
@@ -572,25 +1446,64 @@ def get_uhlenbeck_ford_fe(temp, rho, p, sigma):
 
     Returns
     -------
-    fe : float
+    fe : float or array of floats
         excess free energy/atom of uf system
+
+    Notes
+    -----
+    `temp` and `rho` are broadcast against each other, so that a whole
+    temperature sweep or density scan can be evaluated in one call.
     """
-    x = (0.5*(np.pi*sigma*sigma)**1.5)*rho
+    x = (0.5*(np.pi*sigma*sigma)**1.5)*np.asarray(rho)
     _, fe = find_fe(p, x)
-    beta = (1/(kb*temp))
+    beta = (1/(kb*np.asarray(temp)))
     fe = fe/beta
     return fe
 
+#tables of the UF splines and their cumulative integrals as arrays
+uf_splines = {key: np.array(val) for key, val in splines.items()}
+uf_sum_splines = {key: np.array(val) for key, val in sum_splines.items()}
+
+def find_segment(x):
+    """
+    Find the spline segment of the UF tables
+
+    Parameters
+    ----------
+    x : array of floats
+        x values for UF system
+
+    Returns
+    -------
+    index : array of ints
+        index of the segment in the spline table
+
+    x_0 : array of floats
+        lower end of the segment
+
+    knot : array of bools
+        True if x lies exactly on the lower end of the segment
+    """
+    x = np.asarray(x, dtype=float)
+    conditions = [x < 0.1, x < 1, x < 4]
+    index = np.select(conditions, [(x*400).astype(int), 
+        40 + (x*40 - 4).astype(int), 76 + (x*10 - 10).astype(int)], 105)
+    x_0 = np.select(conditions, [0.0025*(x*400).astype(int), 
+        0.025*(x*40).astype(int), 0.1*(x*10).astype(int)], 4.0)
+    knot = np.select(conditions, [x*10000%25 == 0, 
+        x*1000%25 == 0, x*100%10 == 0], True)
+    return index, x_0, knot
+
 def press(x, coef):
     """
     Find pressure of system
 
     Parameters
     ----------
-    x : float
+    x : float or array of floats
         x value for UF system
     
-    coef : list of floats
+    coef : list of floats or array of shape (n, 4)
         coefficients
 
     Returns
@@ -599,38 +1512,41 @@ def press(x, coef):
         result pressure
 
     """
+    coef = np.asarray(coef).T
     result = coef[0]*(x**3) + coef[1]*(x**2) + coef[2]*x + coef[3]
     return result
 
 def fe(x, coef, sum_spline, index):
     """
     Fe inbuilt method
-    """
-    if x < 0.0025:
-        result = coef[0]*(x**2)/2.0 + coef[1]*x
-        return result
 
-    elif x < 0.1:
-        if x*10000%25 == 0:
-            return sum_spline[index-1]
-        else:
-            x_0 = 0.0025*int(x*400)
-    
-    elif x < 1:
-        if x*1000%25 == 0:
-            return sum_spline[index-1]
-        else:
-            x_0 = 0.025*int(x*40)
+    Parameters
+    ----------
+    x : float or array of floats
+        x value for UF system
 
-    elif x < 4:
-        if x*100%10 == 0:
-            return sum_spline[index-1]
-        else:
-            x_0 = 0.1*int(x*10)
-    else:
-        return sum_spline[index]
+    coef : list of floats or array of shape (n, 4)
+        coefficients of the segment of each x
+
+    sum_spline : list of floats
+        cumulative integral of the spline table
 
-    result =  sum_spline[index-1] + coef[0]*(x**2.0 - x_0**2.0)/2.0 + coef[1]*(x - x_0) + (coef[2] - 1.0)*math.log(x/x_0) - coef[3]*(1.0/x - 1.0/x_0)
+    index : int or array of ints
+        index of the segment of each x
+    """
+    x = np.asarray(x, dtype=float)
+    coef = np.asarray(coef).T
+    sum_spline = np.asarray(sum_spline)
+    _, x_0, knot = find_segment(x)
+
+    #avoid division by zero in the first segment, which is handled separately
+    x_0 = np.where(x_0 > 0, x_0, x)
+    
+    lower = sum_spline[index-1]
+    result = lower + coef[0]*(x**2.0 - x_0**2.0)/2.0 + coef[1]*(x - x_0) + (coef[2] - 1.0)*np.log(x/x_0) - coef[3]*(1.0/x - 1.0/x_0)
+    result = np.where(knot, lower, result)
+    result = np.where(x >= 4, sum_spline[index], result)
+    result = np.where(x < 0.0025, coef[0]*(x**2)/2.0 + coef[1]*x, result)
     return result
 
 
@@ -640,52 +1556,38 @@ def find_fe(p, x):
 
     Parameters
     ----------
-    x : float
-        x value of system
+    p : int
+        UF scale, one of 1, 25, 50, 75 and 100
 
-    coef : list of floats
-        Coefficients of system
+    x : float or array of floats
+        x value of system
 
     Returns
     -------
-    fe : float
+    pressure : float or array of floats
+        pressure of UF system
+
+    fe : float or array of floats
         free energy of UF system
 
     """
     if not p in splines:
         raise ValueError('Invalid p. Valid numbers are: 1, 25, 50, 75, and 100.')
 
-    if (x <= 0.0) or (x > 4.0):
-        raise ValueError('Invalid x. Valid numbers are 0.0 < x <= 4.0')
-
-    table1 = splines[p]
+    scalar = (np.ndim(x) == 0)
+    x = np.asarray(x, dtype=float)
 
-    if x < 0.1:
-        index =  0 + int(x*400)
-    elif x < 1:
-        index = 40 + int((x*40 - 4))
-    elif x < 4:
-        index = 76 + int((x*10 - 10))
-    else:
-        index = 105
+    if np.any((x <= 0.0) | (x > 4.0)):
+        raise ValueError('Invalid x. Valid numbers are 0.0 < x <= 4.0')
 
-    coef = table1[index]
+    index, _, _ = find_segment(x)
+    coef = uf_splines[p][index]
 
     pressure = press(x, coef)
+    free_energy = fe(x, coef, uf_sum_splines[p], index)
 
-    if p==1:
-        sum_spline = sum_spline1
-    elif p==25:
-        sum_spline = sum_spline25
-    elif p==50:
-        sum_spline = sum_spline50
-    elif p==75:
-        sum_spline = sum_spline75
-    else:
-        sum_spline = sum_spline100
-
-    free_energy = fe(x,coef,sum_spline,index)
-
+    if scalar:
+        return float(pressure), float(free_energy)
     return pressure, free_energy
 
 #--------------------------------------------------------------------
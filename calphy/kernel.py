@@ -29,10 +29,173 @@ import warnings
 
 from calphy.input import read_inputfile #, create_identifier
 import calphy.scheduler as pq
+import calphy.helpers as ph
 import argparse as ap
 from calphy import __version__ as version
 
-def run_jobs(inputfile):
+def create_scheduler(calc, cores=None, pool=None):
+    """
+    Create the scheduler object of a calculation
+
+    Parameters
+    ----------
+    calc : Calculation object
+
+    cores : int, optional
+        number of cores of the job, by default `queue.cores`
+
+    pool : LocalPool, optional
+        pool which runs the jobs of the local scheduler
+
+    Returns
+    -------
+    scheduler : scheduler object
+    """
+    queueoptions = dict(calc.queue.__dict__)
+    if cores is not None:
+        queueoptions["cores"] = cores
+    else:
+        cores = calc.queue.cores
+
+    if calc.queue.scheduler == "local":
+        scheduler = pq.Local(queueoptions, cores=cores, pool=pool)
+    elif calc.queue.scheduler == "slurm":
+        scheduler = pq.SLURM(queueoptions, cores=cores)
+    elif calc.queue.scheduler == "sge":
+        scheduler = pq.SGE(queueoptions, cores=cores)
+    else:
+        raise ValueError("Unknown scheduler")
+    return scheduler
+
+
+def kernel_command(inputfile, kernel, resume=False):
+    """
+    Command to run one calculation
+
+    Parameters
+    ----------
+    inputfile : string
+        name of the input file
+
+    kernel : int or string
+        index of the calculation, can be a shell expression
+
+    resume : bool, optional
+        add the resume flag
+
+    Returns
+    -------
+    command : string
+    """
+    command = "calphy_kernel -i %s -k %s"%(inputfile, str(kernel))
+    if resume:
+        command = " ".join([command, "--resume"])
+    return command
+
+
+def packed_command(inputfile, kernels, cores, npack, resume=False):
+    """
+    Command to run several calculations at the same time within one job
+
+    Parameters
+    ----------
+    inputfile : string
+        name of the input file
+
+    kernels : string
+        shell word list of the calculation indices
+
+    cores : int
+        number of cores of each calculation
+
+    npack : int
+        largest number of calculations in `kernels`
+
+    resume : bool, optional
+        add the resume flag
+
+    Returns
+    -------
+    command : string
+        a command group which starts each calculation in the background and waits for all of them
+
+    Notes
+    -----
+    Each calculation is bound to its own set of cores through the environment of `mpiexec`,
+    see `calphy.helpers.binding_environment`. If the job itself is bound to a cpu set, for
+    example by a `LocalPool`, the cores of the calculations are taken from it. The command
+    group fails if any of the calculations fails.
+    """
+    cpu_sets = ph.group_cpu_sets(cores*npack, npack)
+    sets = " ".join(["\"%s\""%" ".join([str(x) for x in cpu_set]) for cpu_set in cpu_sets])
+    #the cpu set of each calculation is picked at run time from its slot in the pack,
+    #as positions in the cpu set of the job if there is one
+    env = ph.binding_environment("cores", cpu_set=["${SET}"])
+    env = " ".join(["%s=%s"%(key, val) for (key, val) in env.items()])
+    return ("{ CPUS=(${OMPI_MCA_hwloc_base_cpu_set//,/ }); SETS=(%s); PIDS=(); S=0; for K in %s; do "
+        "SET=; for I in ${SETS[$S]}; do SET=${SET}${SET:+,}${CPUS[$I]:-$I}; done; "
+        "%s %s > kernel_${K}.out 2> kernel_${K}.err & PIDS+=($!); S=$((S+1)); done; "
+        "STATUS=0; for P in \"${PIDS[@]}\"; do wait $P || STATUS=1; done; [ $STATUS -eq 0 ]; }")%(sets, 
+        kernels, env, kernel_command(inputfile, "${K}", resume=resume))
+
+
+def array_command(inputfile, kernels, task_index, cores, pack, resume=False):
+    """
+    Command of one task of a job array
+
+    Parameters
+    ----------
+    inputfile : string
+        name of the input file
+
+    kernels : list of ints
+        indices of the calculations of the whole array
+
+    task_index : string
+        index of the task, starting from zero, can be a shell expression
+
+    cores : int
+        number of cores of each calculation
+
+    pack : int
+        number of calculations run by each task
+
+    resume : bool, optional
+        add the resume flag
+
+    Returns
+    -------
+    command : string
+        runs the calculations `task_index*pack` to `(task_index+1)*pack` of `kernels`
+    """
+    task_kernels = "${KERNELS[@]:$((%s*%d)):%d}"%(task_index, pack, pack)
+    return "KERNELS=(%s); %s"%(" ".join([str(x) for x in kernels]), 
+        packed_command(inputfile, "\"%s\""%task_kernels, cores, pack, resume=resume))
+
+
+def group_calculations(calculations):
+    """
+    Group calculations with the same queue options
+
+    Parameters
+    ----------
+    calculations : list of Calculation objects
+
+    Returns
+    -------
+    groups : list of lists of ints
+        indices of the calculations in each group, in input order
+    """
+    groups = {}
+    for count, calc in enumerate(calculations):
+        key = yaml.safe_dump(calc.queue.__dict__)
+        if key not in groups.keys():
+            groups[key] = []
+        groups[key].append(count)
+    return list(groups.values())
+
+
+def run_jobs(inputfile, resume=False):
     """
     Spawn jobs which are submitted to cluster
 
@@ -40,10 +203,24 @@ def run_jobs(inputfile):
     ----------
     options : dict
         dict containing input options
-    
+
+    resume : bool, optional
+        if True, the jobs resume calculations from their existing simulation folders
+
     Returns
     -------
     None
+
+    Notes
+    -----
+    By default each calculation is submitted as its own job. Calculations with the same
+    `queue` options are bundled if `queue.job_array` is True, which submits them as one
+    job array, or if `queue.pack` is larger than 1, which runs `pack` calculations at the same
+    time within one job, each with `queue.cores` cores.
+
+    Jobs of the local scheduler are run through a `LocalPool` with `queue.total_cores` cores
+    and at most `queue.max_jobs` jobs at the same time. The function returns once all of them
+    are finished.
     """
     
     #the jobs are well set up in calculations dict now
@@ -55,29 +232,63 @@ def run_jobs(inputfile):
     calculations = read_inputfile(inputfile)
     print("Total number of %d calculations found" % len(calculations))
 
-    for count, calc in enumerate(calculations):
+    pool = None
+    local = [calc for calc in calculations if calc.queue.scheduler == "local"]
+    if len(local) > 0:
+        pool = pq.LocalPool(cores=local[0].queue.total_cores, max_jobs=local[0].queue.max_jobs)
+
+    for group in group_calculations(calculations):
+        calc = calculations[group[0]]
+        pack = max(1, int(calc.queue.pack))
+
+        if calc.queue.job_array:
+            scheduler = create_scheduler(calc, cores=calc.queue.cores*min(pack, len(group)), pool=pool)
+            if scheduler.task_index is None:
+                raise ValueError("job arrays need a slurm or sge scheduler")
+            scheduler.array = int(np.ceil(len(group)/pack))
+            if (pack == 1) and (group == list(range(len(calculations)))):
+                scheduler.maincommand = kernel_command(inputfile, scheduler.task_index, resume=resume)
+            else:
+                scheduler.maincommand = array_command(inputfile, group, scheduler.task_index, 
+                    calc.queue.cores, pack, resume=resume)
+            scriptpath = os.path.join(os.getcwd(), "%s.array_%d.sub"%(calc.queue.jobname, group[0]))
+            scheduler.write_script(scriptpath)
+            _ = scheduler.submit()
+            print("Submitted calculations %s as a job array of %d tasks"%(" ".join([str(x) for x in group]), 
+                scheduler.array))
+
+        elif pack > 1:
+            for start in range(0, len(group), pack):
+                kernels = group[start:start+pack]
+                scheduler = create_scheduler(calc, cores=calc.queue.cores*len(kernels), pool=pool)
+                scheduler.maincommand = packed_command(inputfile, " ".join([str(x) for x in kernels]), 
+                    calc.queue.cores, len(kernels), resume=resume)
+                scriptpath = os.path.join(os.getcwd(), "%s.pack_%d.sub"%(calc.queue.jobname, kernels[0]))
+                scheduler.write_script(scriptpath)
+                _ = scheduler.submit()
 
-        identistring = calc.create_identifier()
-        scriptpath = os.path.join(os.getcwd(), ".".join([identistring, "sub"]))
-        errfile = os.path.join(os.getcwd(), ".".join([identistring, "err"]))
-
-        #the below part assigns the schedulers
-        #now we have to write the submission scripts for the job
-        #parse Queue and import module
-        if calc.queue.scheduler == "local":
-            scheduler = pq.Local(calc.queue.__dict__, cores=calc.queue.cores)
-        elif calc.queue.scheduler == "slurm":
-            scheduler = pq.SLURM(calc.queue.__dict__, cores=calc.queue.cores)
-        elif calc.queue.scheduler == "sge":
-            scheduler = pq.SGE(calc.queue.__dict__, cores=calc.queue.cores)
         else:
-            raise ValueError("Unknown scheduler")
+            for count in group:
+                calc = calculations[count]
+                identistring = calc.create_identifier()
+                scriptpath = os.path.join(os.getcwd(), ".".join([identistring, "sub"]))
+
+                #the below part assigns the schedulers
+                #now we have to write the submission scripts for the job
+                #parse Queue and import module
+                scheduler = create_scheduler(calc, pool=pool)
 
-        #for lattice just provide the number of position
-        scheduler.maincommand = "calphy_kernel -i %s -k %d"%(inputfile, 
-            count)
-        scheduler.write_script(scriptpath)
-        _ = scheduler.submit()
+                #for lattice just provide the number of position
+                scheduler.maincommand = kernel_command(inputfile, count, resume=resume)
+                scheduler.write_script(scriptpath)
+                _ = scheduler.submit()
+
+    if pool is not None:
+        print("Running %d local jobs on %d cores"%(pool.poll(), pool.cores))
+        returncodes = pool.wait()
+        for job in pool.failed:
+            print("Job %s failed with exit code %d"%(pool.scripts[job], returncodes[job]))
+        print("%d of %d local jobs finished successfully"%(len(returncodes)-len(pool.failed), len(returncodes)))
 
 
 
@@ -101,6 +312,9 @@ def main():
 
     arg.add_argument("-v", "--version", action='store_true',
     help="name of the input file")
+
+    arg.add_argument("-r", "--resume", action='store_true',
+    help="resume calculations, skipping stages finished in an earlier run")
     
     #parse args
     args = vars(arg.parse_args())
@@ -110,4 +324,4 @@ def main():
     else:
         #spawn job
         if args["input"]:
-            run_jobs(args["input"])
+            run_jobs(args["input"], resume=args["resume"])
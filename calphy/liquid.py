@@ -113,10 +113,11 @@ class Liquid(cph.Phase):
         """
         #create lammps object
         lmp = ph.create_object(self.cores, self.simfolder, self.calc.md.timestep, 
-            self.calc.md.cmdargs, self.calc.md.init_commands)
+            self.calc.md.cmdargs, self.calc.md.init_commands, session=self.session, 
+            logfile=self.lammps_logfile("run_averaging"), profile=self.profile_file)
 
         #set up structure
-        lmp = ph.create_structure(lmp, self.calc, species=self.calc.n_elements+self.calc._ghost_element_count)
+        lmp = self.create_structure(lmp, species=self.calc.n_elements+self.calc._ghost_element_count)
 
         #set up potential
         lmp = ph.set_potential(lmp, self.calc, ghost_elements=self.calc._ghost_element_count)
@@ -145,11 +146,7 @@ class Liquid(cph.Phase):
         self.dump_current_snapshot(lmp, "traj.equilibration_stage1.dat")
         self.check_if_solidfied(lmp, "traj.equilibration_stage1.dat")
         self.dump_current_snapshot(lmp, "traj.equilibration_stage2.dat")
-        lmp = ph.write_data(lmp, "current.data")
-        lmp.close()
-
-        #process the trajectory
-        self.process_traj("traj.equilibration_stage2.dat", "conf.equilibration.data")
+        self.save_configuration(lmp, "traj.equilibration_stage2.dat", "conf.equilibration.data")
 
 
 
@@ -173,7 +170,8 @@ class Liquid(cph.Phase):
         the lambda parameter. See algorithm 4 in publication.
         """
         lmp = ph.create_object(self.cores, self.simfolder, self.calc.md.timestep, 
-            self.calc.md.cmdargs, self.calc.md.init_commands)
+            self.calc.md.cmdargs, self.calc.md.init_commands, session=self.session, 
+            logfile=self.lammps_logfile("run_integration", iteration=iteration), profile=self.profile_file)
 
         # Adiabatic switching parameters.
         lmp.command("variable        li       equal   1.0")
@@ -181,8 +179,7 @@ class Liquid(cph.Phase):
 
         #read in the conf file
         #conf = os.path.join(self.simfolder, "conf.equilibration.dump")
-        conf = os.path.join(self.simfolder, "conf.equilibration.data")
-        lmp = ph.read_data(lmp, conf)
+        lmp = self.load_configuration(lmp)
 
         #set hybrid ufm and normal potential
         #lmp = ph.set_hybrid_potential(lmp, self.options, self.eps)
@@ -193,8 +190,8 @@ class Liquid(cph.Phase):
 
         
         lmp.command("fix              f1 all nve")
-        lmp.command("fix              f2 all langevin %f %f %f %d zero yes"%(self.calc._temperature, self.calc._temperature, self.calc.md.thermostat_damping[1], 
-                                        np.random.randint(0, 10000)))
+        lmp.command("fix              f2 all langevin %f %f %f %s zero yes"%(self.calc._temperature, self.calc._temperature, self.calc.md.thermostat_damping[1], 
+                                        self.seed()))
         lmp.command("run               %d"%self.calc.n_equilibration_steps)
 
         lmp.command("unfix            f1")
@@ -227,16 +224,16 @@ class Liquid(cph.Phase):
         lmp.command("thermo           1000")
 
 
-        lmp.command("velocity         all create %f %d mom yes rot yes dist gaussian"%(self.calc._temperature, np.random.randint(0, 10000)))
+        lmp.command("velocity         all create %f %s mom yes rot yes dist gaussian"%(self.calc._temperature, self.seed()))
 
         lmp.command("fix              f1 all nve")
-        lmp.command("fix              f2 all langevin %f %f %f %d zero yes"%(self.calc._temperature, self.calc._temperature, self.calc.md.thermostat_damping[1], 
-                                        np.random.randint(0, 10000)))
+        lmp.command("fix              f2 all langevin %f %f %f %s zero yes"%(self.calc._temperature, self.calc._temperature, self.calc.md.thermostat_damping[1], 
+                                        self.seed()))
         lmp.command("compute          Tcm all temp/com")
         lmp.command("fix_modify       f2 temp Tcm")
 
-        lmp.command("fix              f3 all print 1 \"${dU1} ${dU2} ${flambda}\" screen no file forward_%d.dat"%iteration)
-        lmp.command("run               %d"%self.calc._n_switching_steps)
+        self.fix_switching_output(lmp, "f3", ["dU1", "dU2", "flambda"], "forward_%s.dat"%iteration)
+        self.run_switching(lmp, "forward_%s.dat"%iteration, self.calc._n_switching_steps, solid=False)
 
         lmp.command("unfix            f1")
         lmp.command("unfix            f2")
@@ -255,8 +252,8 @@ class Liquid(cph.Phase):
         lmp.command("thermo           1000")
 
         lmp.command("fix              f1 all nve")
-        lmp.command("fix              f2 all langevin %f %f %f %d zero yes"%(self.calc._temperature, self.calc._temperature, self.calc.md.thermostat_damping[1], 
-                                        np.random.randint(0, 10000)))
+        lmp.command("fix              f2 all langevin %f %f %f %s zero yes"%(self.calc._temperature, self.calc._temperature, self.calc.md.thermostat_damping[1], 
+                                        self.seed()))
         lmp.command("fix_modify       f2 temp Tcm")
 
         lmp.command("run               %d"%self.calc.n_equilibration_steps)
@@ -287,12 +284,12 @@ class Liquid(cph.Phase):
         lmp.command("thermo           1000")
 
         lmp.command("fix              f1 all nve")
-        lmp.command("fix              f2 all langevin %f %f %f %d zero yes"%(self.calc._temperature, self.calc._temperature, self.calc.md.thermostat_damping[1], 
-                                        np.random.randint(0, 10000)))
+        lmp.command("fix              f2 all langevin %f %f %f %s zero yes"%(self.calc._temperature, self.calc._temperature, self.calc.md.thermostat_damping[1], 
+                                        self.seed()))
         lmp.command("fix_modify       f2 temp Tcm")
 
-        lmp.command("fix              f3 all print 1 \"${dU1} ${dU2} ${flambda}\" screen no file backward_%d.dat"%iteration)
-        lmp.command("run               %d"%self.calc._n_switching_steps)
+        self.fix_switching_output(lmp, "f3", ["dU1", "dU2", "flambda"], "backward_%s.dat"%iteration)
+        self.run_switching(lmp, "backward_%s.dat"%iteration, self.calc._n_switching_steps, solid=False)
 
         lmp.command("unfix            f1")
         lmp.command("unfix            f2")
@@ -320,8 +317,7 @@ class Liquid(cph.Phase):
         Calculates the final work, energy dissipation and free energy by
         matching with UFM model
         """
-        w, q, qerr = find_w(self.simfolder, nsims=self.calc.n_iterations, 
-            full=True, solid=False)  
+        w, q, qerr = self.find_w(solid=False)
         
         #TODO: Hardcoded UFM parameters - enable option to change          
         f1 = get_uhlenbeck_ford_fe(self.calc._temperature, 
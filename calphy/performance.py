@@ -0,0 +1,169 @@
+"""
+calphy: a Python library and command line interface for automated free
+energy calculations.
+
+Copyright 2021  (c) Sarath Menon^1, Yury Lysogorskiy^2, Ralf Drautz^2
+^1: Max Planck Institut für Eisenforschung, Dusseldorf, Germany 
+^2: Ruhr-University Bochum, Bochum, Germany
+
+calphy is published and distributed under the Academic Software License v1.0 (ASL). 
+calphy is distributed in the hope that it will be useful for non-commercial academic research, 
+but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  
+calphy API is published and distributed under the BSD 3-Clause "New" or "Revised" License
+See the LICENSE FILE for more details. 
+
+More information about the program can be found in:
+Menon, Sarath, Yury Lysogorskiy, Jutta Rogal, and Ralf Drautz.
+“Automated Free Energy Calculation from Atomistic Simulations.” Physical Review Materials 5(10), 2021
+DOI: 10.1103/PhysRevMaterials.5.103801
+
+For more information contact:
+sarath.menon@ruhr-uni-bochum.de/yury.lysogorskiy@icams.rub.de
+"""
+
+import os
+import re
+import json
+import resource
+
+#sections of the LAMMPS timing breakdown
+TIMING_SECTIONS = ["Pair", "Bond", "Kspace", "Neigh", "Comm", "Output", "Modify", "Other"]
+
+
+def parse_lammps_log(logfile):
+    """
+    Read the run statistics from a LAMMPS log file
+
+    Parameters
+    ----------
+    logfile : string
+        name of the log file
+
+    Returns
+    -------
+    stats : dict
+        number of MD steps, loop time, number of atoms, largest memory per MPI rank in Mbytes
+        and the time spent in each section of the timing breakdown, summed over all runs in the file
+
+    Notes
+    -----
+    Runs with zero steps are included in the loop time but do not contribute steps.
+    If the file does not exist, the counts are zero.
+    """
+    stats = {"steps": 0, "loop_time": 0.0, "natoms": 0, "memory": 0.0,
+        "timing": {key: 0.0 for key in TIMING_SECTIONS}}
+    if (logfile is None) or (not os.path.exists(logfile)):
+        return stats
+
+    with open(logfile, "r") as fin:
+        for line in fin:
+            if line.startswith("Loop time of"):
+                raw = re.match(r"Loop time of\s+(\S+)\s+on\s+(\d+)\s+procs\s+for\s+(\d+)\s+steps\s+with\s+(\d+)\s+atoms", line)
+                if raw is not None:
+                    stats["loop_time"] += float(raw.group(1))
+                    stats["steps"] += int(raw.group(3))
+                    stats["natoms"] = int(raw.group(4))
+            elif ("memory" in line) and ("Mbytes" in line):
+                #both the per rank and the older per processor format
+                values = re.findall(r"[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?", line.split("=")[-1])
+                if len(values) > 0:
+                    stats["memory"] = max(stats["memory"], max([float(x) for x in values]))
+            elif "|" in line:
+                raw = [x.strip() for x in line.split("|")]
+                if (raw[0] in TIMING_SECTIONS) and (len(raw) > 2):
+                    try:
+                        stats["timing"][raw[0]] += float(raw[2])
+                    except ValueError:
+                        pass
+    return stats
+
+
+def peak_rss():
+    """
+    Peak resident set size in Mbytes
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    rss : float
+
+    Notes
+    -----
+    The larger of the peak of the current process and the peak of its finished child processes
+    is returned. LAMMPS instances which are still running are not included.
+    """
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, 
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    #ru_maxrss is in kilobytes on linux
+    return rss/1024
+
+
+def stage_record(stage, walltime, cores, logfile=None, iteration=None):
+    """
+    Performance record of a finished stage
+
+    Parameters
+    ----------
+    stage : string
+        name of the stage
+
+    walltime : float
+        wall time of the stage in seconds
+
+    cores : int
+        number of cores used by the stage
+
+    logfile : string, optional
+        LAMMPS log file written by the stage
+
+    iteration : int, optional
+        iteration number of the stage
+
+    Returns
+    -------
+    record : dict
+    """
+    stats = parse_lammps_log(logfile)
+    record = {}
+    record["stage"] = str(stage)
+    if iteration is not None:
+        record["iteration"] = int(iteration)
+    record["wall_time"] = float(walltime)
+    record["cores"] = int(cores)
+    record["md_steps"] = int(stats["steps"])
+    record["natoms"] = int(stats["natoms"])
+    record["loop_time"] = float(stats["loop_time"])
+    if stats["loop_time"] > 0:
+        rate = stats["steps"]/stats["loop_time"]
+    else:
+        rate = 0.0
+    record["timesteps_per_second"] = float(rate)
+    record["atom_steps_per_second_per_core"] = float(rate*stats["natoms"]/max(1, cores))
+    record["lammps_timing"] = {key: float(val) for key, val in stats["timing"].items() if val > 0}
+    record["lammps_memory_per_rank"] = float(stats["memory"])
+    record["peak_rss"] = float(peak_rss())
+    return record
+
+
+def write_record(filename, record):
+    """
+    Append a performance record to a JSONL file
+
+    Parameters
+    ----------
+    filename : string
+        name of the file
+
+    record : dict
+        see `stage_record`
+
+    Returns
+    -------
+    None
+    """
+    with open(filename, "a") as fout:
+        fout.write(json.dumps(record))
+        fout.write("\n")
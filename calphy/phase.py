@@ -26,11 +26,17 @@ sarath.menon@ruhr-uni-bochum.de/yury.lysogorskiy@icams.rub.de
 """
 
 import yaml
+import shutil
+import threading
 import pyscal.traj_process as ptp
 from calphy.integrators import *
 import calphy.lattice as pl
 import calphy.helpers as ph
 from calphy.errors import *
+from calphy.convergence import equilibrated_statistics
+import calphy.cache as cc
+import calphy.performance as perf
+import calphy.profiling as prof
 
 
 class Phase:
@@ -126,6 +132,52 @@ class Phase:
         if self.calc._fix_lattice:
             self.logger.info("Lattice is fixed, pressure convergence criteria is 50*tolerance.pressure; change if needed!")
 
+        #callable that receives a StreamingIntegrator during switching,
+        #returning True from it stops the calculation
+        self.monitor_callback = None
+
+        #statistics of the equilibration runs
+        self.equilibration = {}
+
+        #iterations run as LAMMPS partitions, see run_integration_replicas
+        self.replicas = None
+
+        #equilibrated configuration, if kept in memory
+        self.configuration = None
+
+        #record of finished stages, used to resume a calculation
+        self.resume = False
+        self.ledger = {}
+        self.ledger_lock = threading.Lock()
+        #stage run by the current thread, used to find its checkpoint
+        self.local = threading.local()
+
+        #wall time, MD steps and LAMMPS timings of each stage
+        self.performance = []
+        self.performance_lock = threading.Lock()
+        self.report = None
+
+        #optional profile of the LAMMPS calls
+        if self.calc.md.profile:
+            self.profile_file = os.path.join(self.simfolder, "profile.folded")
+        else:
+            self.profile_file = None
+
+        #block averaged output of the switching runs needs whole blocks in each run
+        check_block_averaging(int(self.calc.output.n_average), {"n_equilibration_steps": self.calc.n_equilibration_steps, 
+            "n_switching_steps": self.calc._n_switching_steps, "n_sweep_steps": self.calc._n_sweep_steps, 
+            "monitor.n_steps": self.calc.monitor.n_steps})
+
+        #starting configuration from a cached state, and the folder and input pressure to store the state with
+        self.start_configuration = None
+        self.cache_folder = None
+        self.cache_pressure = None
+
+        #LAMMPS instance shared by all stages, if asked for
+        self.session = None
+        if self.calc.md.persistent_session and (self.simfolder is not None):
+            self.session = ph.LammpsSession(self.calc.queue.cores, self.simfolder, self.calc.md.cmdargs)
+
         self.l = None
         self.alat = None
         self.apc = None
@@ -150,12 +202,15 @@ class Phase:
         self.rho = None
 
         self.ferr = 0
+        self.ferr_ci = None
         self.fref = 0
         self.fideal = 0
         
         self.w = 0
         self.pv = 0
         self.fe = 0
+        #switching iterations carried out, set by adaptive cycles
+        self.n_switching_iterations = self.calc.n_iterations
 
         #box dimensions that need to be stored
         self.lx = None
@@ -232,6 +287,224 @@ class Phase:
         lmp.command("run               0")
         lmp.command("undump            2")
 
+    def fix_switching_output(self, lmp, fixid, variables, filename):
+        """
+        Write LAMMPS variables to a file during switching
+
+        Parameters
+        ----------
+        lmp: LAMMPS object
+
+        fixid: string
+            id of the fix
+
+        variables: list of strings
+            names of the LAMMPS variables, one column each
+
+        filename: string
+            name of the output file
+
+        Returns
+        -------
+        None
+
+        Notes
+        -----
+        By default the variables are written on every step with `fix print`. If `output.n_average`
+        is larger than 1, `fix ave/time` writes the average over each block of `n_average` steps instead.
+        The block averages keep the integral over the switching path, see `load_switching_data`, if
+        the run starts on a multiple of `n_average`, see `check_block_averaging`.
+        """
+        mode = "file"
+        if isinstance(lmp, ph.RestartReplay) and lmp.replaying:
+            if filename == lmp.checkpoint["filename"]:
+                #continue the file from the checkpoint
+                truncate_switching_data(os.path.join(self.simfolder, filename), lmp.checkpoint["rows"])
+                mode = "append"
+            else:
+                #this file was finished before the checkpoint
+                filename = os.devnull
+
+        n_average = int(self.calc.output.n_average)
+        if n_average > 1:
+            #blocks are written on multiples of n_average, the run has to start on one
+            check_block_averaging(n_average, {"timestep at the start of %s"%filename: lmp.extract_global("ntimestep")})
+            lmp.command("fix               %s all ave/time 1 %d %d %s %s %s"%(fixid, n_average, n_average, 
+                " ".join(["v_%s"%x for x in variables]), mode, filename))
+        else:
+            lmp.command("fix               %s all print 1 \"%s\" screen no %s %s"%(fixid, 
+                " ".join(["${%s}"%x for x in variables]), mode, filename))
+
+    def store_binary_output(self, iteration):
+        """
+        Store the switching files of an iteration in binary form
+
+        Parameters
+        ----------
+        iteration: int
+            iteration number
+
+        Returns
+        -------
+        None
+
+        Notes
+        -----
+        Each switching file of the iteration is written to a compressed `npz` file
+        with the same name, which `load_switching_data` reads instead of the text file.
+        If `output.keep_text` is False, the text file is removed.
+        """
+        for prefix in ["forward", "backward", "ts.forward", "ts.backward", "ps.forward", "ps.backward"]:
+            filename = os.path.join(self.simfolder, "%s_%s.dat"%(prefix, iteration))
+            if not os.path.exists(filename):
+                continue
+            store_switching_data(filename, keep_text=self.calc.output.keep_text)
+
+    def run_switching(self, lmp, filename, nsteps, solid=True, usecols=(0, 1, 2)):
+        """
+        Run a switching simulation and integrate the output on the fly
+
+        Parameters
+        ----------
+        lmp: LAMMPS object
+
+        filename: string
+            name of the file written by `fix print` during the run
+
+        nsteps: int
+            number of switching steps
+
+        solid, usecols:
+            format of the switching file, see `get_du_lambda`
+
+        Returns
+        -------
+        None
+
+        Notes
+        -----
+        If `monitor.n_steps` is zero, the switching is a single `run` command. Otherwise the run
+        is split into chunks of `monitor.n_steps`, using the start and stop keywords so that the
+        switching is unchanged. After each chunk, the partial work is written to `switching_status_<filename>.yaml`
+        and passed to `monitor_callback`. If the callback returns True, the calculation is stopped.
+
+        After each chunk a restart file is also written, see `write_checkpoint`. If the stage is resumed
+        from it, the switching continues from the step of the restart file.
+        """
+        nchunk = int(self.calc.monitor.n_steps)
+        #file names of replicas are only known inside LAMMPS
+        if (nchunk <= 0) or (self.replicas is not None):
+            lmp.command("run               %d"%nsteps)
+            return
+
+        if isinstance(lmp, ph.RestartReplay) and lmp.replaying:
+            if filename != lmp.checkpoint["filename"]:
+                #finished before the checkpoint
+                return
+            lmp.replaying = False
+            start = int(lmp.checkpoint["start"])
+            stop = int(lmp.checkpoint["stop"])
+            first = int(lmp.checkpoint["step"])
+            self.logger.info("%s: resuming switching from step %d of %d"%(filename, first-start, stop-start))
+        else:
+            start = int(lmp.extract_global("ntimestep"))
+            stop = start + nsteps
+            first = start
+
+        monitor = StreamingIntegrator(os.path.join(self.simfolder, filename), 
+            nelements=self.calc.n_elements, concentration=self.concentration, 
+            usecols=usecols, solid=solid)
+        #one status file for each switching file, iterations can run at the same time
+        statusfile = os.path.join(self.simfolder, "switching_status_%s.yaml"%os.path.splitext(filename)[0])
+
+        for step in range(first, stop, nchunk):
+            lmp.command("run               %d start %d stop %d"%(min(nchunk, stop-step), start, stop))
+            monitor.update()
+            with open(statusfile, 'w') as fout:
+                yaml.safe_dump(monitor.to_dict(), fout)
+            self.write_checkpoint(lmp, filename, step + min(nchunk, stop-step), start, stop, monitor.nsteps)
+
+            if self.monitor_callback is not None:
+                if self.monitor_callback(monitor):
+                    lmp.close()
+                    raise SwitchingAbortedError("Switching in %s stopped at lambda %s with work %f"%(filename, 
+                        str(monitor.lmbda), monitor.work))
+
+        self.logger.info("%s: work %f over %d steps"%(filename, monitor.work, monitor.nsteps))
+
+    def set_current_stage(self, stage=None):
+        """
+        Set the stage run by the current thread
+
+        Parameters
+        ----------
+        stage : string, optional
+            name of the stage in the ledger, for example `run_integration_3`. None once it is finished.
+
+        Returns
+        -------
+        None
+        """
+        self.local.stage = stage
+
+    def pending_checkpoint(self):
+        """
+        Checkpoint of the stage run by the current thread, if it is resumed
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        checkpoint : dict or None
+        """
+        stage = getattr(self.local, "stage", None)
+        if (stage is None) or (not self.resume):
+            return None
+        checkpoint = self.ledger.get("checkpoint_%s"%stage)
+        if (checkpoint is None) or (not os.path.exists(checkpoint["restart"])):
+            return None
+        return checkpoint
+
+    def write_checkpoint(self, lmp, filename, step, start, stop, rows):
+        """
+        Write a restart file during a switching run and record it in the ledger
+
+        Parameters
+        ----------
+        lmp : LAMMPS object
+
+        filename : string
+            switching file of the run
+
+        step : int
+            current timestep
+
+        start, stop : int
+            first and last timestep of the switching run
+
+        rows : int
+            number of rows in the switching file
+
+        Returns
+        -------
+        None
+
+        Notes
+        -----
+        Only done for stages run through `run_iterations`, which sets the current stage.
+        The restart file `<filename>.restart` is overwritten by each checkpoint.
+        """
+        stage = getattr(self.local, "stage", None)
+        if (stage is None) or (step >= stop):
+            return
+        restart = os.path.join(self.simfolder, "%s.restart"%os.path.splitext(filename)[0])
+        lmp.command("write_restart     %s"%(restart + ".tmp"))
+        os.replace(restart + ".tmp", restart)
+        self.mark_stage("checkpoint_%s"%stage, {"filename": filename, "restart": restart, 
+            "step": int(step), "start": int(start), "stop": int(stop), "rows": int(rows)})
+
     def get_structures(self, stage="fe", direction="forward", n_iteration=1):
         """
         """
@@ -460,30 +733,32 @@ class Phase:
 
         lmp.command("fix              2 all ave/time %d %d %d v_mlx v_mly v_mlz v_mpress file avg.dat"%(int(self.calc.md.n_every_steps),
             int(self.calc.md.n_repeat_steps), int(self.calc.md.n_every_steps*self.calc.md.n_repeat_steps)))
+        reader = IncrementalReader(os.path.join(self.simfolder, "avg.dat"), usecols=(1, 2, 3, 4))
         
-        laststd = 0.00
         converged = False
 
         for i in range(int(self.calc.md.n_cycles)):
             lmp.command("run              %d"%int(self.calc.md.n_small_steps))
-            ncount = int(self.calc.md.n_small_steps)//int(self.calc.md.n_every_steps*self.calc.md.n_repeat_steps)
             #now we can check if it converted
-            file = os.path.join(self.simfolder, "avg.dat")
-            lx, ly, lz, ipress = np.loadtxt(file, usecols=(1, 2, 3, 4), unpack=True)
+            reader.update()
+            lx, ly, lz, ipress = reader.data
             
-            lxpc = ipress
-            mean = np.mean(lxpc)
-            std = np.std(lxpc)
-            volatom = np.mean((lx*ly*lz)/self.natoms)
+            #only the part after the initial transient is used
+            stats = equilibrated_statistics(ipress)
+            start = stats["start"]
+            mean = stats["mean"]
+            volatom = np.mean((lx*ly*lz)[start:]/self.natoms)
             self.logger.info("At count %d mean pressure is %f with %f vol/atom"%(i+1, mean, volatom))
+            self.logger.info("Equilibrated from row %d, error %f, %f effective samples"%(start, stats["error"], stats["n_effective"]))
             
-            if (np.abs(mean - self.calc._pressure)) < self.calc.tolerance.pressure:
+            if ((np.abs(mean - self.calc._pressure)) < self.calc.tolerance.pressure) and (stats["n_effective"] >= self.calc.tolerance.effective_samples):
 
                 #process other means
-                self.lx = np.round(np.mean(lx[-ncount+1:]), decimals=3)
-                self.ly = np.round(np.mean(ly[-ncount+1:]), decimals=3)
-                self.lz = np.round(np.mean(lz[-ncount+1:]), decimals=3)
+                self.lx = np.round(np.mean(lx[start:]), decimals=3)
+                self.ly = np.round(np.mean(ly[start:]), decimals=3)
+                self.lz = np.round(np.mean(lz[start:]), decimals=3)
                 self.volatom = volatom
+                self.equilibration["pressure"] = stats
                 self.vol = self.lx*self.ly*self.lz
                 self.rho = self.natoms/(self.lx*self.ly*self.lz)
                 
@@ -491,7 +766,6 @@ class Phase:
                 self.logger.info("Avg box dimensions x: %f, y: %f, z:%f"%(self.lx, self.ly, self.lz))
                 converged = True
                 break
-            laststd = std
         
         if not converged:
             lmp.close()
@@ -517,32 +791,32 @@ class Phase:
         #this is when the averaging routine starts
         lmp.command("fix              2 all ave/time %d %d %d v_mlx v_mly v_mlz v_mpress file avg.dat"%(int(self.calc.md.n_every_steps),
             int(self.calc.md.n_repeat_steps), int(self.calc.md.n_every_steps*self.calc.md.n_repeat_steps)))
+        reader = IncrementalReader(os.path.join(self.simfolder, "avg.dat"), usecols=(1, 2, 3, 4))
 
         lastmean = 100000000
         converged = False
         for i in range(int(self.calc.md.n_cycles)):
             lmp.command("run              %d"%int(self.calc.md.n_small_steps))
-            ncount = int(self.calc.md.n_small_steps)//int(self.calc.md.n_every_steps*self.calc.md.n_repeat_steps)
             #now we can check if it converted
-            file = os.path.join(self.simfolder, "avg.dat")
-            lx, ly, lz, ipress = np.loadtxt(file, usecols=(1, 2, 3, 4), unpack=True)
+            reader.update()
+            lx, ly, lz, ipress = reader.data
             
-            lxpc = ipress
-            mean = np.mean(lxpc)
-            std = np.std(lxpc)
-            volatom = np.mean((lx*ly*lz)/self.natoms)
+            #only the part after the initial transient is used
+            stats = equilibrated_statistics(ipress)
+            start = stats["start"]
+            mean = stats["mean"]
+            volatom = np.mean((lx*ly*lz)[start:]/self.natoms)
             self.logger.info("At count %d mean pressure is %f with %f vol/atom"%(i+1, mean, volatom))
+            self.logger.info("Equilibrated from row %d, error %f, %f effective samples"%(start, stats["error"], stats["n_effective"]))
 
-            if (np.abs(mean - lastmean)) < 50*self.calc.tolerance.pressure:
+            if ((np.abs(mean - lastmean)) < 50*self.calc.tolerance.pressure) and (stats["n_effective"] >= self.calc.tolerance.effective_samples):
                 #here we actually have to set the pressure
                 self.calc._pressure = mean
-                std = np.std(lxpc)
-                volatom = np.mean((lx*ly*lz)/self.natoms)
-                self.logger.info("At count %d mean pressure is %f with %f vol/atom"%(i+1, mean, volatom))
-                self.lx = np.round(np.mean(lx[-ncount+1:]), decimals=3)
-                self.ly = np.round(np.mean(ly[-ncount+1:]), decimals=3)
-                self.lz = np.round(np.mean(lz[-ncount+1:]), decimals=3)
+                self.lx = np.round(np.mean(lx[start:]), decimals=3)
+                self.ly = np.round(np.mean(ly[start:]), decimals=3)
+                self.lz = np.round(np.mean(lz[start:]), decimals=3)
                 self.volatom = volatom
+                self.equilibration["pressure"] = stats
                 self.vol = self.lx*self.ly*self.lz
                 self.logger.info("finalized vol/atom %f at pressure %f"%(self.volatom, mean))
                 self.logger.info("Avg box dimensions x: %f, y: %f, z:%f"%(self.lx, self.ly, self.lz))
@@ -575,13 +849,594 @@ class Phase:
         files = ptp.split_trajectory(trajfile)
         conf = os.path.join(self.simfolder, outfilename)
 
-        ph.reset_timestep(conf, os.path.join(self.simfolder, "current.data"))
+        ph.reset_timestep(conf, os.path.join(self.simfolder, "current.data"), session=self.session)
 
         os.remove(trajfile)
         for file in files:
             os.remove(file)
 
 
+    def seed(self):
+        """
+        Random seed for a LAMMPS command
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        seed : string
+            a random integer, or an expression which gives a different value on each replica
+        """
+        if self.replicas is None:
+            return "%d"%np.random.randint(0, 10000)
+        return "$(v_seed+%d)"%np.random.randint(0, 10000)
+
+    def run_integration_replicas(self, iterations):
+        """
+        Run several iterations of the integration as partitions of one LAMMPS run
+
+        Parameters
+        ----------
+        iterations : list of ints
+            iteration numbers to be run
+
+        Returns
+        -------
+        None
+
+        Notes
+        -----
+        LAMMPS is started once with `-partition`, each partition being one replica with
+        `queue.cores/len(iterations)` cores. All replicas run the same commands. The world-style
+        variables `replica` and `seed` give each of them its own iteration number, used in the
+        names of the output files, and its own random seeds.
+        """
+        nreplicas = len(iterations)
+        if self.cores%nreplicas != 0:
+            raise ValueError("cores (%d) should be divisible by the number of replicas (%d)"%(self.cores, nreplicas))
+
+        cmdargs = self.calc.md.cmdargs
+        init_commands = self.calc.md.init_commands
+        session = self.session
+
+        seeds = np.random.choice(np.arange(1, 100000), size=nreplicas, replace=False)*10000
+        self.calc.md.cmdargs = [*(cmdargs if cmdargs is not None else []), "-partition", "%dx%d"%(nreplicas, self.cores//nreplicas)]
+        self.calc.md.init_commands = [*(init_commands if init_commands is not None else []),
+            "variable replica world %s"%" ".join([str(x) for x in iterations]),
+            "variable seed world %s"%" ".join([str(x) for x in seeds])]
+        self.session = None
+        self.replicas = iterations
+        self.logger.info("Running iterations %s as %d LAMMPS partitions"%(" ".join([str(x) for x in iterations]), nreplicas))
+        try:
+            self.run_integration(iteration="${replica}")
+        finally:
+            self.calc.md.cmdargs = cmdargs
+            self.calc.md.init_commands = init_commands
+            self.session = session
+            self.replicas = None
+
+    def create_structure(self, lmp, species=None):
+        """
+        Create the starting structure for the averaging routine
+
+        Parameters
+        ----------
+        lmp : LammpsLibrary object
+
+        species : int, optional
+            number of atom types
+
+        Returns
+        -------
+        lmp : LammpsLibrary object
+
+        Notes
+        -----
+        If a cached state at a neighbouring temperature or pressure was found, it is
+        used instead of the input lattice.
+        """
+        if self.start_configuration is None:
+            return ph.create_structure(lmp, self.calc, species=species)
+        elif isinstance(self.start_configuration, dict):
+            return ph.scatter_configuration(lmp, self.start_configuration)
+        return ph.read_data(lmp, self.start_configuration)
+
+    def load_equilibration(self):
+        """
+        Look for the equilibrated state in the cache
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        found : bool
+            True if the state was found and the averaging routine can be skipped
+
+        Notes
+        -----
+        The cache in `equilibration_cache.folder` is keyed by `cache.equilibration_key`,
+        which covers the potential, structure and MD settings, and then by temperature and pressure.
+        If only a state at a different temperature or pressure exists, and `equilibration_cache.near_match`
+        is True, the closest one is used as the starting structure.
+        """
+        cachefolder = self.calc.equilibration_cache.folder
+        if cachefolder is None:
+            return False
+
+        key = cc.equilibration_key(self.calc)
+        self.cache_pressure = self.calc._pressure
+        self.cache_folder = cc.state_folder(cachefolder, key, self.calc._temperature, self.calc._pressure)
+        folder, exact = cc.find_state(cachefolder, key, self.calc._temperature, self.calc._pressure, 
+            near_match=self.calc.equilibration_cache.near_match)
+        if folder is None:
+            self.logger.info("No equilibrated state found in cache for key %s"%key)
+            return False
+
+        state, conffile, configuration = cc.load_state(folder)
+
+        if not exact:
+            #with a fixed lattice, the structure should not be changed
+            if self.calc._fix_lattice:
+                return False
+            self.start_configuration = configuration if configuration is not None else conffile
+            self.logger.info("Starting from cached state at %f K and pressure %s"%(state["temperature"], 
+                str(state["input_pressure"])))
+            return False
+
+        if conffile is not None:
+            shutil.copy(conffile, os.path.join(self.simfolder, "conf.equilibration.data"))
+        elif configuration is None:
+            return False
+        if self.calc.md.in_memory_configuration or (conffile is None):
+            self.configuration = configuration
+
+        self.set_equilibration_state(state)
+        self.logger.info("Equilibrated state read from %s"%folder)
+        return True
+
+    def equilibration_state(self):
+        """
+        Averaged quantities of the equilibrated state
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        state : dict
+        """
+        def to_float(val):
+            return None if val is None else float(val)
+
+        state = {}
+        state["temperature"] = float(self.calc._temperature)
+        state["input_pressure"] = to_float(self.cache_pressure)
+        state["pressure"] = to_float(self.calc._pressure)
+        state["lx"] = to_float(self.lx)
+        state["ly"] = to_float(self.ly)
+        state["lz"] = to_float(self.lz)
+        state["volatom"] = to_float(self.volatom)
+        state["vol"] = to_float(self.vol)
+        state["rho"] = to_float(self.rho)
+        state["spring_constant"] = None if self.k is None else [float(x) for x in self.k]
+        state["equilibration"] = {key: {skey: float(sval) for skey, sval in val.items()} for key, val in self.equilibration.items()}
+        return state
+
+    def set_equilibration_state(self, state):
+        """
+        Set the averaged quantities from an equilibrated state
+
+        Parameters
+        ----------
+        state : dict
+            see `equilibration_state`
+
+        Returns
+        -------
+        None
+        """
+        self.lx = state["lx"]
+        self.ly = state["ly"]
+        self.lz = state["lz"]
+        self.volatom = state["volatom"]
+        self.vol = state["vol"]
+        self.rho = state["rho"]
+        self.k = state["spring_constant"]
+        self.calc._pressure = state["pressure"]
+        self.equilibration = state["equilibration"]
+
+    def save_equilibration(self):
+        """
+        Store the equilibrated state in the cache
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        if self.cache_folder is None:
+            return
+
+        state = self.equilibration_state()
+        conffile = os.path.join(self.simfolder, "conf.equilibration.data")
+        if not os.path.exists(conffile):
+            conffile = None
+        cc.store_state(self.cache_folder, state, conffile=conffile, configuration=self.configuration)
+        self.logger.info("Equilibrated state stored in %s"%self.cache_folder)
+
+    def load_free_energy(self):
+        """
+        Look for the free energy of the equilibrated state in the cache
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        found : bool
+            True if the free energy was found and the integration can be skipped
+
+        Notes
+        -----
+        The free energy is stored next to the equilibrated state by `save_free_energy`,
+        keyed by `cache.free_energy_key`.
+        """
+        if (self.cache_folder is None) or (not os.path.exists(self.cache_folder)):
+            return False
+        result = cc.load_free_energy(self.cache_folder, cc.free_energy_key(self.calc))
+        if result is None:
+            return False
+
+        self.fe = result["free_energy"]
+        self.ferr = result["error"]
+        self.ferr_ci = result["error_interval"]
+        self.fref = result["reference_system"]
+        self.fideal = result["ideal_gas"]
+        self.w = result["work"]
+        self.pv = result["pv"]
+        self.logger.info("Free energy read from %s"%self.cache_folder)
+        return True
+
+    def save_free_energy(self):
+        """
+        Store the free energy of the equilibrated state in the cache
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        if (self.cache_folder is None) or (not os.path.exists(self.cache_folder)):
+            return
+
+        result = {}
+        result["free_energy"] = float(self.fe)
+        result["error"] = float(self.ferr)
+        result["error_interval"] = None if self.ferr_ci is None else [float(x) for x in self.ferr_ci]
+        result["reference_system"] = float(self.fref)
+        result["ideal_gas"] = float(self.fideal)
+        result["work"] = float(self.w)
+        result["pv"] = float(self.pv)
+        cc.store_free_energy(self.cache_folder, cc.free_energy_key(self.calc), result)
+        self.logger.info("Free energy stored in %s"%self.cache_folder)
+
+    def lammps_logfile(self, stage, iteration=None):
+        """
+        Name of the LAMMPS log file of a stage
+
+        Parameters
+        ----------
+        stage : string
+            name of the stage
+
+        iteration : int, optional
+            iteration number of the stage
+
+        Returns
+        -------
+        logfile : string
+        """
+        if iteration is None:
+            return os.path.join(self.simfolder, "log.%s.lammps"%stage)
+        return os.path.join(self.simfolder, "log.%s_%s.lammps"%(stage, iteration))
+
+    def record_performance(self, stage, walltime, iteration=None, cores=None):
+        """
+        Record the performance of a finished stage
+
+        Parameters
+        ----------
+        stage : string
+            name of the stage
+
+        walltime : float
+            wall time of the stage in seconds
+
+        iteration : int, optional
+            iteration number of the stage
+
+        cores : int, optional
+            number of cores used, by default the cores of the job
+
+        Returns
+        -------
+        None
+
+        Notes
+        -----
+        The record is appended to `performance.jsonl` in the simulation folder. If the report
+        was already written, its `performance` section is updated.
+        """
+        if cores is None:
+            cores = self.cores
+        record = perf.stage_record(stage, walltime, cores, 
+            logfile=self.lammps_logfile(stage, iteration=iteration), iteration=iteration)
+        with self.performance_lock:
+            self.performance.append(record)
+            perf.write_record(os.path.join(self.simfolder, "performance.jsonl"), record)
+            if self.report is not None:
+                self.report["performance"] = self.performance
+                with open(os.path.join(self.simfolder, "report.yaml"), "w") as fout:
+                    yaml.dump(self.report, fout)
+        self.logger.info("%s: %d MD steps in %f s, %f timesteps/s"%(stage if iteration is None else "%s_%d"%(stage, iteration), 
+            record["md_steps"], record["wall_time"], record["timesteps_per_second"]))
+
+    def load_ledger(self):
+        """
+        Read the record of finished stages from the simulation folder
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        ledgerfile = os.path.join(self.simfolder, "ledger.yaml")
+        if os.path.exists(ledgerfile):
+            with open(ledgerfile, "r") as fin:
+                self.ledger = yaml.safe_load(fin)
+            if self.ledger is None:
+                self.ledger = {}
+        self.logger.info("Finished stages: %s"%" ".join(self.ledger.keys()))
+
+    def stage_done(self, stage):
+        """
+        Check if a stage can be skipped when resuming
+
+        Parameters
+        ----------
+        stage : string
+            name of the stage
+
+        Returns
+        -------
+        done : bool
+        """
+        return self.resume and (stage in self.ledger)
+
+    def mark_stage(self, stage, data=None):
+        """
+        Record a finished stage in `ledger.yaml` in the simulation folder
+
+        Parameters
+        ----------
+        stage : string
+            name of the stage, for example `averaging` or `run_integration_3`
+
+        data : dict, optional
+            results of the stage needed for resuming
+
+        Returns
+        -------
+        None
+        """
+        with self.ledger_lock:
+            self.ledger[stage] = {} if data is None else data
+            ledgerfile = os.path.join(self.simfolder, "ledger.yaml")
+            with open(ledgerfile + ".tmp", "w") as fout:
+                yaml.safe_dump(self.ledger, fout)
+            os.replace(ledgerfile + ".tmp", ledgerfile)
+
+    def mark_averaging(self):
+        """
+        Record the finished averaging routine with the equilibrated state
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        #a configuration kept only in memory is written out for resuming
+        if (self.configuration is not None) and (not os.path.exists(os.path.join(self.simfolder, "conf.equilibration.data"))):
+            np.savez(os.path.join(self.simfolder, "configuration.npz"), **self.configuration)
+        self.mark_stage("averaging", self.equilibration_state())
+
+    def resume_averaging(self):
+        """
+        Set the equilibrated state of a finished averaging routine
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        self.set_equilibration_state(self.ledger["averaging"])
+        npzfile = os.path.join(self.simfolder, "configuration.npz")
+        if os.path.exists(npzfile):
+            with np.load(npzfile) as data:
+                self.configuration = {key: data[key] for key in data.files}
+            self.configuration["ntypes"] = int(self.configuration["ntypes"])
+
+    def save_configuration(self, lmp, trajfile, outfilename):
+        """
+        Keep the equilibrated configuration for the integration stages
+        and close the LAMMPS object
+
+        Parameters
+        ----------
+        lmp : LammpsLibrary object
+
+        trajfile : string
+            trajectory dumped at the end of the equilibration
+
+        outfilename : string
+            data file for the equilibrated configuration
+
+        Returns
+        -------
+        None
+
+        Notes
+        -----
+        If `md.in_memory_configuration` is True, the configuration is gathered from
+        LAMMPS and used by `load_configuration`. The data file is then only written
+        as a checkpoint if `md.write_configuration` is True.
+        """
+        if not self.calc.md.in_memory_configuration:
+            lmp = ph.write_data(lmp, "current.data")
+            lmp.close()
+            self.process_traj(trajfile, outfilename)
+            return
+
+        self.configuration = ph.gather_configuration(lmp)
+        if self.calc.md.write_configuration:
+            lmp = ph.write_data(lmp, os.path.join(self.simfolder, outfilename))
+        lmp.close()
+        os.remove(os.path.join(self.simfolder, trajfile))
+
+    def load_configuration(self, lmp, filename="conf.equilibration.data"):
+        """
+        Create the equilibrated configuration in LAMMPS
+
+        Parameters
+        ----------
+        lmp : LammpsLibrary object
+
+        filename : string, optional
+            data file read if the configuration is not kept in memory
+
+        Returns
+        -------
+        lmp : LammpsLibrary object
+
+        Notes
+        -----
+        If the stage is resumed from a checkpoint, the restart file is read instead and
+        a `RestartReplay` object is returned.
+        """
+        checkpoint = self.pending_checkpoint()
+        if checkpoint is not None:
+            self.logger.info("Reading restart file %s"%checkpoint["restart"])
+            lmp.command("read_restart      %s"%checkpoint["restart"])
+            return ph.RestartReplay(lmp, checkpoint)
+        if self.configuration is not None:
+            return ph.scatter_configuration(lmp, self.configuration)
+        return ph.read_data(lmp, os.path.join(self.simfolder, filename))
+
+    def find_w(self, nelements=1, concentration=[1,], solid=True, alchemy=False):
+        """
+        Find the irreversible work with the estimator chosen in the input
+
+        Parameters
+        ----------
+        nelements, concentration, solid, alchemy:
+            see `find_w`
+
+        Returns
+        -------
+        w : float
+            irreversible work
+
+        q : float
+            average energy dissipation
+
+        err : float
+            error in the work
+        """
+        if self.calc.estimator == "mean":
+            return find_w(self.simfolder, nelements=nelements, 
+                concentration=concentration, nsims=self.n_switching_iterations, 
+                full=True, solid=solid, alchemy=alchemy)
+
+        w, q, err, ci = find_w_estimate(self.simfolder, self.calc._temperature, 
+            self.natoms, estimator=self.calc.estimator, nelements=nelements, 
+            concentration=concentration, nsims=self.n_switching_iterations, solid=solid)
+        self.ferr_ci = ci
+        self.logger.info("Work from %s estimator: %f, 95%% bootstrap interval %f to %f"%(self.calc.estimator, 
+            w, ci[0], ci[1]))
+        return w, q, err
+
+    def close_session(self):
+        """
+        Close the shared LAMMPS instance, if any
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        if self.session is not None:
+            self.logger.info("Closing LAMMPS session after %d stages"%self.session.n_stages)
+            self.session.close()
+
+        if (self.profile_file is not None) and os.path.exists(self.profile_file):
+            totals = prof.read_profile(self.profile_file)
+            self.logger.info("Time spent in LAMMPS calls, written to %s:"%self.profile_file)
+            for key, val in list(totals.items())[:10]:
+                self.logger.info("%s: %f s"%(key, val))
+
+    def switching_error(self, nsims):
+        """
+        Standard error of the work from the finished switching iterations
+
+        Parameters
+        ----------
+        nsims : int
+            number of finished iterations
+
+        Returns
+        -------
+        err : float
+            standard error of the work in eV/atom
+        """
+        if self.calc.mode in ["alchemy", "composition_scaling"] or self.calc.reference_phase != "solid":
+            solid = False
+        else:
+            solid = True
+
+        if self.calc.estimator == "mean":
+            fw, bw, _ = integrate_paths(self.simfolder, nelements=self.calc.n_elements, 
+                concentration=self.concentration, nsims=nsims, solid=solid)
+            return standard_error(0.5*(fw - bw))
+
+        _, _, err, _ = find_w_estimate(self.simfolder, self.calc._temperature, 
+            self.natoms, estimator=self.calc.estimator, nelements=self.calc.n_elements, 
+            concentration=self.concentration, nsims=nsims, solid=solid)
+        return err
+
     def submit_report(self, extra_dict=None):
         """
         Submit final report containing results
@@ -613,11 +1468,16 @@ class Phase:
             report["average"]["spring_constant"] = " ".join(np.array(self.k).astype(str))
         if self.rho is not None:
             report["average"]["density"] = float(self.rho)
+        if len(self.equilibration) > 0:
+            report["average"]["effective_samples"] = {key: float(val["n_effective"]) for key, val in self.equilibration.items()}
 
         #results
         report["results"] = {}
         report["results"]["free_energy"] = float(self.fe)
         report["results"]["error"] = float(self.ferr)
+        report["results"]["estimator"] = str(self.calc.estimator)
+        if self.ferr_ci is not None:
+            report["results"]["error_interval"] = [float(x) for x in self.ferr_ci]
         report["results"]["reference_system"] = float(self.fref)
         report["results"]["work"] = float(self.w)
         report["results"]["pv"] = float(self.pv)
@@ -625,6 +1485,9 @@ class Phase:
         if extra_dict is not None:
             self._from_dict(report, extra_dict)
 
+        if len(self.performance) > 0:
+            report["performance"] = self.performance
+
         self.report = report
 
         reportfile = os.path.join(self.simfolder, "report.yaml")
@@ -644,6 +1507,41 @@ class Phase:
                 self.logger.info("- 10.1016/j.commatsci.2018.12.029")
                 self.logger.info("- 10.1063/1.4967775")
 
+    def set_scaled_potential(self, lmp, lambda_variable, scale_variable):
+        """
+        Set the potential scaled by lambda for reversible scaling
+
+        Parameters
+        ----------
+        lmp : LammpsLibrary object
+
+        lambda_variable : string
+            name of the LAMMPS variable with the scaling factor lambda
+
+        scale_variable : string
+            name of the LAMMPS variable with lambda-1
+
+        Returns
+        -------
+        None
+
+        Notes
+        -----
+        With `energy_scaling: single`, the potential is the only sub-style of `hybrid/scaled`
+        and is evaluated once per step. With `energy_scaling: hybrid`, the potential is added
+        twice with weights 1 and lambda-1.
+        """
+        pcraw = self.calc.pair_coeff[0].split()
+        pair_style = self.calc.pair_style_with_options[0]
+
+        if self.calc.energy_scaling == "single":
+            lmp.command("pair_style       hybrid/scaled v_%s %s"%(lambda_variable, pair_style))
+            lmp.command("pair_coeff       %s"%" ".join([*pcraw[:2], self.calc.pair_style[0], *pcraw[2:]]))
+        else:
+            lmp.command("pair_style       hybrid/scaled v_one %s v_%s %s"%(pair_style, scale_variable, pair_style))
+            lmp.command("pair_coeff       %s"%" ".join([*pcraw[:2], self.calc.pair_style[0], "1", *pcraw[2:]]))
+            lmp.command("pair_coeff       %s"%" ".join([*pcraw[:2], self.calc.pair_style[0], "2", *pcraw[2:]]))
+
     def reversible_scaling(self, iteration=1):
         """
         Perform reversible scaling calculation in NPT
@@ -670,7 +1568,8 @@ class Phase:
 
         #create lammps object
         lmp = ph.create_object(self.cores, self.simfolder, self.calc.md.timestep, 
-            self.calc.md.cmdargs, self.calc.md.init_commands)
+            self.calc.md.cmdargs, self.calc.md.init_commands, session=self.session, 
+            logfile=self.lammps_logfile("reversible_scaling", iteration=iteration), profile=self.profile_file)
 
         lmp.command("echo              log")
         lmp.command("variable          li equal %f"%li)
@@ -678,8 +1577,7 @@ class Phase:
 
         #read in conf file
         #conf = os.path.join(self.simfolder, "conf.equilibration.dump")
-        conf = os.path.join(self.simfolder, "conf.equilibration.data")
-        lmp = ph.read_data(lmp, conf)
+        lmp = self.load_configuration(lmp)
 
         #set up potential
         lmp = ph.set_potential(lmp, self.calc, ghost_elements=self.calc._ghost_element_count)
@@ -728,21 +1626,11 @@ class Phase:
         lmp.command("variable         one equal 1.0")
 
         #set up potential
-        pc =  self.calc.pair_coeff[0]
-        pcraw = pc.split()
-        pcnew1 = " ".join([*pcraw[:2], *[self.calc.pair_style], "1", *pcraw[2:]])
-        pcnew2 = " ".join([*pcraw[:2], *[self.calc.pair_style], "2", *pcraw[2:]])
-
-        # lmp.command('pair_style  {}'.format(self.calc.pair_style))
-        # lmp.command('pair_coeff  {}'.format(self.calc.pair_coeff))
-
-        print(pcnew1, pcnew2)
-
-        lmp.command("pair_style       hybrid/scaled v_one %s v_fscale %s"%(self.calc.pair_style, self.calc.pair_style))
-        lmp.command("pair_coeff       %s"%pcnew1)
-        lmp.command("pair_coeff       %s"%pcnew2)
+        self.set_scaled_potential(lmp, "flambda", "fscale")
 
-        lmp.command("fix               f3 all print 1 \"${dU} $(press) $(vol) ${flambda}\" screen no file ts.forward_%d.dat"%iteration)
+        lmp.command("variable          mpress equal press")
+        lmp.command("variable          mvol equal vol")
+        self.fix_switching_output(lmp, "f3", ["dU", "mpress", "mvol", "flambda"], "ts.forward_%d.dat"%iteration)
 
         if self.calc.n_print_steps > 0:
             lmp.command("dump              d1 all custom %d traj.ts.forward_%d.dat id type mass x y z vx vy vz"%(self.calc.n_print_steps,
@@ -761,11 +1649,11 @@ class Phase:
         lmp.command("run               %d"%self.calc.n_equilibration_steps)
 
         #check melting or freezing
-        self.dump_current_snapshot(lmp, "traj.temp.dat")
+        self.dump_current_snapshot(lmp, "traj.temp_%d.dat"%iteration)
         if solid:
-            self.check_if_melted(lmp, "traj.temp.dat")
+            self.check_if_melted(lmp, "traj.temp_%d.dat"%iteration)
         else:
-            self.check_if_solidfied(lmp, "traj.temp.dat")
+            self.check_if_solidfied(lmp, "traj.temp_%d.dat"%iteration)
 
         lmp = ph.set_potential(lmp, self.calc, ghost_elements=self.calc._ghost_element_count)
 
@@ -776,12 +1664,10 @@ class Phase:
         lmp.command("variable         bscale equal v_blambda-1.0")
         lmp.command("variable         one equal 1.0")
 
-        lmp.command("pair_style       hybrid/scaled v_one %s v_bscale %s"%(self.calc.pair_style_with_options[0], self.calc.pair_style_with_options[0]))
-        lmp.command("pair_coeff       %s"%pcnew1)
-        lmp.command("pair_coeff       %s"%pcnew2)
+        self.set_scaled_potential(lmp, "blambda", "bscale")
 
         #apply fix and perform switching        
-        lmp.command("fix               f3 all print 1 \"${dU} $(press) $(vol) ${blambda}\" screen no file ts.backward_%d.dat"%iteration)
+        self.fix_switching_output(lmp, "f3", ["dU", "mpress", "mvol", "blambda"], "ts.backward_%d.dat"%iteration)
 
         if self.calc.n_print_steps > 0:
             lmp.command("dump              d1 all custom %d traj.ts.backward_%d.dat id type mass x y z vx vy vz"%(self.calc.n_print_steps,
@@ -852,7 +1738,8 @@ class Phase:
 
         #create lammps object
         lmp = ph.create_object(self.cores, self.simfolder, self.calc.md.timestep, 
-            self.calc.md.cmdargs, self.calc.md.init_commands)
+            self.calc.md.cmdargs, self.calc.md.init_commands, session=self.session, 
+            logfile=self.lammps_logfile("temperature_scaling", iteration=iteration), profile=self.profile_file)
 
         lmp.command("echo              log")
         lmp.command("variable          li equal %f"%li)
@@ -860,8 +1747,7 @@ class Phase:
 
         #read in conf
         #conf = os.path.join(self.simfolder, "conf.equilibration.dump")
-        conf = os.path.join(self.simfolder, "conf.equilibration.data")
-        lmp = ph.read_data(lmp, conf)
+        lmp = self.load_configuration(lmp)
 
         #set up potential
         lmp = ph.set_potential(lmp, self.calc, ghost_elements=self.calc._ghost_element_count)
@@ -884,7 +1770,9 @@ class Phase:
 
         lmp.command("fix               f2 all npt temp %f %f %f %s %f %f %f"%(t0, tf, self.calc.md.thermostat_damping[1],
                                         self.iso, p0, pf, self.calc.md.barostat_damping[1]))
-        lmp.command("fix               f3 all print 1 \"${dU} $(press) $(vol) ${lambda}\" screen no file ts.forward_%d.dat"%iteration)
+        lmp.command("variable          mpress equal press")
+        lmp.command("variable          mvol equal vol")
+        self.fix_switching_output(lmp, "f3", ["dU", "mpress", "mvol", "lambda"], "ts.forward_%d.dat"%iteration)
         lmp.command("run               %d"%self.calc._n_sweep_steps)
 
         lmp.command("unfix             f2")
@@ -896,22 +1784,22 @@ class Phase:
         lmp.command("unfix             1")
 
         #check melting or freezing
-        lmp.command("dump              2 all custom 1 traj.temp.dat id type mass x y z vx vy vz")
+        lmp.command("dump              2 all custom 1 traj.temp_%d.dat id type mass x y z vx vy vz"%iteration)
         lmp.command("run               0")
         lmp.command("undump            2")
         
-        self.dump_current_snapshot(lmp, "traj.temp.dat")
+        self.dump_current_snapshot(lmp, "traj.temp_%d.dat"%iteration)
         if solid:
-            self.check_if_melted(lmp, "traj.temp.dat")
+            self.check_if_melted(lmp, "traj.temp_%d.dat"%iteration)
         else:
-            self.check_if_solidfied(lmp, "traj.temp.dat")
+            self.check_if_solidfied(lmp, "traj.temp_%d.dat"%iteration)
 
         #start reverse loop
         lmp.command("variable          lambda equal ramp(${lf},${li})")
 
         lmp.command("fix               f2 all npt temp %f %f %f %s %f %f %f"%(tf, t0, self.calc.md.thermostat_damping[1],
                                         self.iso, pf, p0, self.calc.md.barostat_damping[1]))
-        lmp.command("fix               f3 all print 1 \"${dU} $(press) $(vol) ${lambda}\" screen no file ts.backward_%d.dat"%iteration)
+        self.fix_switching_output(lmp, "f3", ["dU", "mpress", "mvol", "lambda"], "ts.backward_%d.dat"%iteration)
         lmp.command("run               %d"%self.calc._n_sweep_steps)
 
         lmp.close()
@@ -938,7 +1826,8 @@ class Phase:
 
         #create lammps object
         lmp = ph.create_object(self.cores, self.simfolder, self.calc.md.timestep, 
-            self.calc.md.cmdargs, self.calc.md.init_commands)
+            self.calc.md.cmdargs, self.calc.md.init_commands, session=self.session, 
+            logfile=self.lammps_logfile("pressure_scaling", iteration=iteration), profile=self.profile_file)
 
         lmp.command("echo              log")
         lmp.command("variable          li equal %f"%li)
@@ -948,8 +1837,7 @@ class Phase:
 
         #read in conf
         #conf = os.path.join(self.simfolder, "conf.dump")
-        conf = os.path.join(self.simfolder, "conf.equilibration.data")
-        lmp = ph.read_data(lmp, conf)
+        lmp = self.load_configuration(lmp)
 
         #set up potential
         lmp = ph.set_potential(lmp, self.calc, ghost_elements=self.calc._ghost_element_count)
@@ -972,7 +1860,8 @@ class Phase:
 
         lmp.command("fix               f2 all npt temp %f %f %f %s %f %f %f"%(t0, t0, self.calc.md.thermostat_damping[1],
                                         self.iso, p0, pf, self.calc.md.barostat_damping[1]))
-        lmp.command("fix               f3 all print 1 \"${dU} ${pp} $(vol) ${lambda}\" screen no file ps.forward_%d.dat"%iteration)
+        lmp.command("variable          mvol equal vol")
+        self.fix_switching_output(lmp, "f3", ["dU", "pp", "mvol", "lambda"], "ps.forward_%d.dat"%iteration)
         lmp.command("run               %d"%self.calc._n_sweep_steps)
 
         lmp.command("unfix             f2")
@@ -990,7 +1879,7 @@ class Phase:
 
         lmp.command("fix               f2 all npt temp %f %f %f %s %f %f %f"%(t0, t0, self.calc.md.thermostat_damping[1],
                                         self.iso, pf, p0, self.calc.md.barostat_damping[1]))
-        lmp.command("fix               f3 all print 1 \"${dU} ${pp} $(vol) ${lambda}\" screen no file ps.backward_%d.dat"%iteration)
+        self.fix_switching_output(lmp, "f3", ["dU", "pp", "mvol", "lambda"], "ps.backward_%d.dat"%iteration)
         lmp.command("run               %d"%self.calc._n_sweep_steps)
 
         lmp.close()
@@ -0,0 +1,185 @@
+"""
+calphy: a Python library and command line interface for automated free
+energy calculations.
+
+Copyright 2021  (c) Sarath Menon^1, Yury Lysogorskiy^2, Ralf Drautz^2
+^1: Max Planck Institut für Eisenforschung, Dusseldorf, Germany 
+^2: Ruhr-University Bochum, Bochum, Germany
+
+calphy is published and distributed under the Academic Software License v1.0 (ASL). 
+calphy is distributed in the hope that it will be useful for non-commercial academic research, 
+but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  
+calphy API is published and distributed under the BSD 3-Clause "New" or "Revised" License
+See the LICENSE FILE for more details. 
+
+More information about the program can be found in:
+Menon, Sarath, Yury Lysogorskiy, Jutta Rogal, and Ralf Drautz.
+“Automated Free Energy Calculation from Atomistic Simulations.” Physical Review Materials 5(10), 2021
+DOI: 10.1103/PhysRevMaterials.5.103801
+
+For more information contact:
+sarath.menon@ruhr-uni-bochum.de/yury.lysogorskiy@icams.rub.de
+"""
+
+import os
+import sys
+import time
+import threading
+
+#profiles of LAMMPS objects running in parallel threads are written to the same file
+_write_lock = threading.Lock()
+
+
+def command_label(command):
+    """
+    Label of a LAMMPS command in the profile
+
+    Parameters
+    ----------
+    command : string
+        LAMMPS command
+
+    Returns
+    -------
+    label : string
+        the command name, `run 0` is kept apart from other runs
+    """
+    raw = command.split()
+    if len(raw) == 0:
+        return "[empty]"
+    if (raw[0] == "run") and (len(raw) > 1) and (raw[1] == "0"):
+        return "run 0"
+    return raw[0]
+
+
+def calling_stack(frame):
+    """
+    Functions of calphy on the call stack
+
+    Parameters
+    ----------
+    frame : frame object
+        innermost frame
+
+    Returns
+    -------
+    stack : list of strings
+        function names from the outermost to the innermost, methods
+        are given with the name of the class
+    """
+    stack = []
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("calphy") and (module != __name__):
+            name = frame.f_code.co_name
+            obj = frame.f_locals.get("self", None)
+            if obj is not None:
+                name = "%s.%s"%(type(obj).__name__, name)
+            stack.append(name)
+        frame = frame.f_back
+    return stack[::-1]
+
+
+class CommandTracer:
+    """
+    Wrapper around a LAMMPS object which times every call
+
+    Parameters
+    ----------
+    lmp : LammpsLibrary object
+
+    filename : string
+        file to which the profile is added when the object is closed
+
+    Notes
+    -----
+    Each command is attributed to the calphy functions on the call stack when it was issued,
+    and to the command name, such that `run`, `run 0` or `write_dump` appear as separate
+    entries. The time between the end of one call and the start of the next is attributed to
+    `[python]` below the functions that issued the next call. The profile is written in the
+    folded format, one line of semicolon separated functions and the time in microseconds,
+    which can be read by flame graph tools such as `flamegraph.pl` or speedscope.
+    """
+    def __init__(self, lmp, filename):
+        self._lmp = lmp
+        self._filename = filename
+        self._profile = {}
+        self._last = None
+
+    def _add(self, stack, label, duration):
+        key = ";".join([*stack, label])
+        self._profile[key] = self._profile.get(key, 0) + duration
+
+    def _traced(self, name, func):
+        def call(*args, **kwargs):
+            stack = calling_stack(sys._getframe(1))
+            start = time.perf_counter()
+            if self._last is not None:
+                self._add(stack, "[python]", start - self._last)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                if (name == "command") and (len(args) > 0):
+                    label = command_label(str(args[0]))
+                else:
+                    label = command_label(" ".join([name, *[str(x) for x in args]]))
+                self._add(stack, label, end - start)
+                self._last = end
+        return call
+
+    def __getattr__(self, name):
+        attr = getattr(self._lmp, name)
+        if callable(attr):
+            return self._traced(name, attr)
+        return attr
+
+    def command(self, command):
+        return self._traced("command", self._lmp.command)(command)
+
+    def write(self):
+        """
+        Add the profile to the output file
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        with _write_lock:
+            with open(self._filename, "a") as fout:
+                for key, val in self._profile.items():
+                    fout.write("%s %d\n"%(key, int(round(val*1E6))))
+        self._profile = {}
+
+    def close(self):
+        self._traced("close", self._lmp.close)()
+        self.write()
+
+
+def read_profile(filename):
+    """
+    Total time of each command in a profile
+
+    Parameters
+    ----------
+    filename : string
+        profile in the folded format written by `CommandTracer`
+
+    Returns
+    -------
+    totals : dict
+        time in seconds for each command name, sorted from the largest
+    """
+    totals = {}
+    with open(filename, "r") as fin:
+        for line in fin:
+            raw = line.strip().rsplit(" ", 1)
+            if len(raw) < 2:
+                continue
+            label = raw[0].split(";")[-1]
+            totals[label] = totals.get(label, 0) + int(raw[1])/1E6
+    return dict(sorted(totals.items(), key=lambda x: x[1], reverse=True))
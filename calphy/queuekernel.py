@@ -34,10 +34,10 @@ from calphy.input import read_inputfile
 from calphy.liquid import Liquid
 from calphy.solid import Solid
 from calphy.alchemy import Alchemy
-from calphy.routines import MeltingTemp, routine_fe, routine_ts, routine_only_ts, routine_pscale, routine_tscale, routine_alchemy, routine_composition_scaling
+from calphy.routines import MeltingTemp, run_averaging_cached, routine_fe, routine_ts, routine_only_ts, routine_pscale, routine_tscale, routine_alchemy, routine_composition_scaling
 
 
-def setup_calculation(calc):
+def setup_calculation(calc, resume=False):
     """
     Set up a calculation
 
@@ -49,6 +49,9 @@ def setup_calculation(calc):
     kernel: int
         index of the calculation to be run
 
+    resume: bool, optional
+        if True, stages finished in an existing simulation folder are skipped
+
     Returns
     -------
     job: Phase class
@@ -58,16 +61,21 @@ def setup_calculation(calc):
     if calc.mode == "melting_temperature":
         simfolder = None
         job = MeltingTemp(calculation=calc, simfolder=simfolder)
+        job.resume = resume
     elif calc.mode == "alchemy" or calc.mode == "composition_scaling":
-        simfolder = calc.create_folders()
+        simfolder = calc.create_folders(resume=resume)
         job = Alchemy(calculation=calc, simfolder=simfolder)
     else:
-        simfolder = calc.create_folders()
+        simfolder = calc.create_folders(resume=resume)
         if calc.reference_phase == "liquid":
             job = Liquid(calculation=calc, simfolder=simfolder)
         else:
             job = Solid(calculation=calc, simfolder=simfolder)
 
+    if resume and (simfolder is not None):
+        job.resume = True
+        job.load_ledger()
+
     return job
 
 def run_calculation(job):
@@ -82,24 +90,29 @@ def run_calculation(job):
     -------
     job : Phase class
     """
-    if job.calc.mode == "fe":
-        job = routine_fe(job)
-    elif job.calc.mode == "ts":
-        job = routine_ts(job)
-    elif job.calc.mode == "mts":
-        job = routine_only_ts(job)
-    elif job.calc.mode == "alchemy":
-        job = routine_alchemy(job)
-    elif job.calc.mode == "melting_temperature":
+    if job.calc.mode == "melting_temperature":
         job.calculate_tm()
-    elif job.calc.mode == "tscale":
-        job = routine_tscale(job)
-    elif job.calc.mode == "pscale":
-        job = routine_pscale(job)
-    elif job.calc.mode == "composition_scaling":
-        job = routine_composition_scaling(job)
-    else:
-        raise ValueError("Mode should be either fe/ts/mts/alchemy/melting_temperature/tscale/pscale/composition_scaling")
+        return job
+
+    try:
+        if job.calc.mode == "fe":
+            job = routine_fe(job)
+        elif job.calc.mode == "ts":
+            job = routine_ts(job)
+        elif job.calc.mode == "mts":
+            job = routine_only_ts(job)
+        elif job.calc.mode == "alchemy":
+            job = routine_alchemy(job)
+        elif job.calc.mode == "tscale":
+            job = routine_tscale(job)
+        elif job.calc.mode == "pscale":
+            job = routine_pscale(job)
+        elif job.calc.mode == "composition_scaling":
+            job = routine_composition_scaling(job)
+        else:
+            raise ValueError("Mode should be either fe/ts/mts/alchemy/melting_temperature/tscale/pscale/composition_scaling")
+    finally:
+        job.close_session()
     return job
 
 def main():
@@ -112,28 +125,43 @@ def main():
     arg.add_argument("-k", "--kernel", required=True, type=int, 
     help="kernel number of the calculation to be run.")
 
+    arg.add_argument("-r", "--resume", action='store_true',
+    help="resume the calculation, skipping stages finished in an earlier run.")
+
+    arg.add_argument("-s", "--stage", required=False, type=str, default="all",
+    choices=["all", "averaging"],
+    help="stage to be run, averaging only stores the equilibrated state in the cache.")
 
     #parse input
     #parse arguments
     args = vars(arg.parse_args())
     kernel = args["kernel"]
+    resume = args["resume"]
+    stage = args["stage"]
     calculations = read_inputfile(args["input"])
 
     calc = calculations[kernel]
     
     #format and parse the arguments
     identistring = calc.create_identifier()
+    if stage == "averaging":
+        identistring = ".".join([identistring, "averaging"])
     simfolder = os.path.join(os.getcwd(), identistring)
 
     #if folder exists, delete it -> then create
-    if os.path.exists(simfolder):
-        shutil.rmtree(simfolder)
-    os.mkdir(simfolder)
+    #unless the calculation is resumed
+    if resume and os.path.exists(simfolder):
+        pass
+    else:
+        if os.path.exists(simfolder):
+            shutil.rmtree(simfolder)
+        os.mkdir(simfolder)
 
     if calc.mode == "melting_temperature":
         os.rmdir(simfolder)
         simfolder = None
         job = MeltingTemp(calculation=calc, simfolder=simfolder)
+        job.resume = resume
     elif calc.mode == "alchemy" or calc.mode == "composition_scaling":
         job = Alchemy(calculation=calc, simfolder=simfolder)
         os.chdir(simfolder)
@@ -144,21 +172,17 @@ def main():
             job = Solid(calculation=calc, simfolder=simfolder)
         os.chdir(simfolder)
 
-    if job.calc.mode == "fe":
-        _ = routine_fe(job)
-    elif job.calc.mode == "ts":
-        _ = routine_ts(job)
-    elif job.calc.mode == "mts":
-        _ = routine_only_ts(job)
-    elif job.calc.mode == "alchemy":
-        _ = routine_alchemy(job)
-    elif job.calc.mode == "melting_temperature":
-        job.calculate_tm()
-    elif job.calc.mode == "tscale":
-        _ = routine_tscale(job)
-    elif job.calc.mode == "pscale":
-        _ = routine_pscale(job)
-    elif job.calc.mode == "composition_scaling":
-        _ = routine_composition_scaling(job)
-    else:
-        raise ValueError("Mode should be either fe/ts/mts/alchemy/melting_temperature/tscale/pscale/composition_scaling")
+    if resume and (simfolder is not None):
+        job.resume = True
+        job.load_ledger()
+
+    if stage == "averaging":
+        if calc.equilibration_cache.folder is None:
+            raise ValueError("averaging stage needs equilibration_cache folder")
+        try:
+            run_averaging_cached(job)
+        finally:
+            job.close_session()
+        return
+
+    _ = run_calculation(job)
@@ -25,10 +25,13 @@ from mendeleev import element
 import copy
 import numpy as np
 import os
+import queue
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from calphy.errors import *
 import calphy.helpers as ph
+from calphy.integrators import find_crossing_temperature
 
 from calphy.liquid import Liquid
 from calphy.solid import Solid
@@ -60,10 +63,10 @@ class MeltingTemp:
         self.attempts = 0
         self.exp_tm = self.calc._temperature
         self.calculations = []
+        self.resume = False
 
         self.get_props(self.calc.element[0])
         self.get_trange()
-        self.arg = None
         
 
         logfile = os.path.join(os.getcwd(), "calphy.log")
@@ -96,10 +99,46 @@ class MeltingTemp:
         clqd._temperature_high = 1.5*self.tmax
         csol.mode = 'ts'
         clqd.mode = 'ts'
+
+        #split the cores if both phases run at the same time, in the same way as the cpu sets of `run_branches`
+        if self.calc.melting_temperature.concurrent:
+            csol.queue.cores = max(1, self.calc.queue.cores//2)
+            clqd.queue.cores = csol.queue.cores
         
         #csol['directory'] = create_identifier(csol)
         #clqd['directory'] = create_identifier(clqd)
         self.calculations = [csol, clqd]
+
+    def prepare_extension(self, tstart, tstop):
+        """
+        Prepare calculations that extend the completed sweeps
+
+        Parameters
+        ----------
+        tstart : float
+            temperature at which the extension starts, one end of the completed sweeps
+
+        tstop : float
+            temperature at which the extension stops
+
+        Returns
+        -------
+        None
+
+        Notes
+        -----
+        The extensions are run in separate folders so that the completed sweeps are kept.
+        """
+        self.prepare_calcs()
+        for calc in self.calculations:
+            calc.temperature = [int(tstart), int(tstop)]
+            calc._temperature_stop = int(tstop)
+            if calc.folder_prefix is None:
+                calc.folder_prefix = "extend"
+            else:
+                calc.folder_prefix = "%s-extend"%calc.folder_prefix
+        self.calculations[0]._temperature_high = min(tstart, tstop)
+        self.calculations[1]._temperature_high = 1.5*max(tstart, tstop)
         
         
     def get_props(self, elem):
@@ -147,6 +186,32 @@ class MeltingTemp:
         self.tmin = tmin
         
         
+    def create_jobs(self):
+        """
+        Create the solid and liquid jobs from the prepared calculations
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+
+        Notes
+        -----
+        If the calculation is resumed, existing folders are kept and the stages in their
+        ledgers are skipped.
+        """
+        self.soljob = Solid(calculation=self.calculations[0], 
+            simfolder=self.calculations[0].create_folders(resume=self.resume))
+        self.lqdjob = Liquid(calculation=self.calculations[1], 
+            simfolder=self.calculations[1].create_folders(resume=self.resume))
+        if self.resume:
+            for job in [self.soljob, self.lqdjob]:
+                job.resume = True
+                job.load_ledger()
+
     def run_jobs(self):
         """
         Run calculations
@@ -162,50 +227,158 @@ class MeltingTemp:
 
         self.prepare_calcs()
 
-        self.soljob = Solid(calculation=self.calculations[0], 
-            simfolder=self.calculations[0].create_folders())
-        self.lqdjob = Liquid(calculation=self.calculations[1], 
-            simfolder=self.calculations[1].create_folders())
+        self.create_jobs()
         
         self.logger.info("Free energy of %s and %s phases will be calculated"%(self.soljob.calc.lattice, self.lqdjob.calc.lattice))
         self.logger.info("Temperature range of %f-%f"%(self.tmin, self.tmax))
         self.logger.info("STATE: Temperature range of %f-%f K"%(self.tmin, self.tmax))
-        self.logger.info('Starting solid fe calculation')
-        
-        try:
-            self.soljob = routine_fe(self.soljob)
-        except MeltedError:
-            self.logger.info('Solid phase melted')
-            return 2
-        
-        self.logger.info('Starting solid reversible scaling run')
-        for i in range(self.soljob.calc.n_iterations):
-            try:
-                self.soljob.reversible_scaling(iteration=(i+1))
-            except MeltedError:
-                self.logger.info('Solid system melted during reversible scaling run')
+
+        returncode = self.run_branches()
+        if returncode is not None:
+            return returncode
+        self.solres = np.array(sorted_sweep(self.solres))
+        self.lqdres = np.array(sorted_sweep(self.lqdres))
+
+    def run_extension(self, tstart, tstop):
+        """
+        Extend the completed sweeps of both phases to a new temperature
+
+        Parameters
+        ----------
+        tstart : float
+            temperature at which the extension starts, one end of the completed sweeps
+
+        tstop : float
+            temperature at which the extension stops
+
+        Returns
+        -------
+        returncode : int or None
+            2 if the solid transformed, 3 if the liquid transformed, None otherwise
+
+        Notes
+        -----
+        Only the averaging and reversible scaling are run at `tstart`, the free energy
+        there is taken from the completed sweeps. The new sweeps are merged into `solres`
+        and `lqdres`.
+        """
+        self.prepare_extension(tstart, tstop)
+
+        self.create_jobs()
+
+        self.logger.info("Extending sweeps from %f to %f"%(tstart, tstop))
+        self.logger.info("STATE: Extending sweeps from %f to %f K"%(tstart, tstop))
+
+        solprev, lqdprev = self.solres, self.lqdres
+        returncode = self.run_branches(solprev=solprev, lqdprev=lqdprev)
+        if returncode is not None:
+            return returncode
+        self.solres = merge_sweeps(solprev, self.solres)
+        self.lqdres = merge_sweeps(lqdprev, self.lqdres)
+
+    def run_branches(self, solprev=None, lqdprev=None):
+        """
+        Run the solid and liquid branches, one after the other or at the same time
+
+        Parameters
+        ----------
+        solprev : list of arrays, optional
+            completed sweep of the solid, passed on to `run_branch`
+
+        lqdprev : list of arrays, optional
+            completed sweep of the liquid, passed on to `run_branch`
+
+        Returns
+        -------
+        returncode : int or None
+            2 if the solid transformed, 3 if the liquid transformed, None otherwise
+        """
+        if self.calc.melting_temperature.concurrent:
+            self.logger.info("Running solid and liquid calculations at the same time on %d and %d cores"%(self.soljob.cores, 
+                self.lqdjob.cores))
+            #each branch keeps its own set of cores, see `run_iterations`
+            cpu_sets = ph.group_cpu_sets(self.calc.queue.cores, 2)
+
+            def run_bound(cpu_set, *args):
+                ph.set_group_binding(ph.binding_environment(self.calc.queue.group_binding, cpu_set=cpu_set))
+                try:
+                    return self.run_branch(*args)
+                finally:
+                    ph.set_group_binding(None)
+
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                solfuture = executor.submit(run_bound, cpu_sets[0], self.soljob, MeltedError, "solid", solprev)
+                lqdfuture = executor.submit(run_bound, cpu_sets[1], self.lqdjob, SolidifiedError, "liquid", lqdprev)
+                solres = solfuture.result()
+                lqdres = lqdfuture.result()
+        else:
+            solres = self.run_branch(self.soljob, MeltedError, "solid", solprev)
+            if solres is None:
                 return 2
-            
-            self.solres = self.soljob.integrate_reversible_scaling(scale_energy=True,
-                                           return_values=True)
-        
-        self.logger.info('Starting liquid fe calculation')
-        try:
-            self.lqdjob = routine_fe(self.lqdjob)
-        except SolidifiedError:
-            self.logger.info('Liquid froze')
+            lqdres = self.run_branch(self.lqdjob, SolidifiedError, "liquid", lqdprev)
+
+        if solres is None:
+            return 2
+        if lqdres is None:
             return 3
+        self.solres = solres
+        self.lqdres = lqdres
+
+    def run_branch(self, job, error, label, previous=None):
+        """
+        Run the free energy calculation and reversible scaling of one phase
 
-        self.logger.info('Starting liquid reversible scaling calculation')
-        for i in range(self.lqdjob.calc.n_iterations):
-            try:
-                self.lqdjob.reversible_scaling(iteration=(i+1))
-            except SolidifiedError:
-                self.logger.info('Liquid froze during reversible scaling calculation')
-                return 3
+        Parameters
+        ----------
+        job : Solid or Liquid class
+
+        error : exception class
+            error raised if the phase transforms, `MeltedError` for the solid and
+            `SolidifiedError` for the liquid
 
-        self.lqdres = self.lqdjob.integrate_reversible_scaling(scale_energy=True,
-                                           return_values=True)
+        label : string
+            name of the phase used for logging
+
+        previous : list of arrays, optional
+            completed sweep of the phase. If given, the free energy calculation is skipped and
+            the free energy at the start temperature is interpolated from it.
+
+        Returns
+        -------
+        res : list of arrays or None
+            temperature, free energy and error from reversible scaling, None if the phase transformed
+        """
+        if previous is None:
+            self.logger.info('Starting %s fe calculation'%label)
+        else:
+            self.logger.info('Starting %s averaging, fe taken from previous sweep'%label)
+        try:
+            if previous is None:
+                job = routine_fe(job)
+            else:
+                run_averaging_cached(job)
+                job.fe = np.interp(job.calc._temperature, previous[0], previous[1])
+                job.ferr = np.interp(job.calc._temperature, previous[0], previous[2])
+        except error:
+            self.logger.info('%s phase transformed'%label)
+            job.close_session()
+            return None
+        
+        self.logger.info('Starting %s reversible scaling run'%label)
+        try:
+            run_iterations(job, job.reversible_scaling, list(range(1, job.calc.n_iterations+1)), 
+                label="%s TS integration"%label)
+        except error:
+            self.logger.info('%s phase transformed during reversible scaling run'%label)
+            job.close_session()
+            return None
+        job.close_session()
+
+        res = job.integrate_reversible_scaling(scale_energy=True, return_values=True)
+        if previous is not None:
+            #the free energy at the start enters the sweep as f0*T/T0, and so does its error
+            res = (res[0], res[1], np.sqrt(res[2]**2 + (job.ferr*res[0]/job.calc._temperature)**2))
+        return res
     
     def start_calculation(self):
         """
@@ -241,33 +414,40 @@ class MeltingTemp:
                 raise ValueError('Maximum number of tries reached')
 
 
-    def extrapolate_tm(self, arg):
+    def extrapolate_tm(self):
         """
         Extrapolate Tm
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        tpred : float
+            predicted melting temperature, outside the current range
+
+        Notes
+        -----
+        The crossing of linear fits to both phases is used. If the fits cross
+        within the range, the range is moved by `step` towards the end where the
+        free energies are closest.
         """
         solfit = np.polyfit(self.solres[0], self.solres[1], 1)
         lqdfit = np.polyfit(self.lqdres[0], self.lqdres[1], 1)
+        diff = np.polysub(solfit, lqdfit)
+        if diff[0] == 0:
+            raise ValueError('failed to extrapolate melting temperature')
+        tpred = -diff[1]/diff[0]
 
-        found = False
-
-        for i in range(100):
-            if arg==0:
-                self.tmin = self.tmin-self.dtemp
-                if self.tmin < 0:
-                    self.tmin = 0
-                new_t = np.linspace(self.tmin, self.tmax, 1000)
-            elif arg==999:
-                self.tmax = self.tmax + self.dtemp
-                new_t = np.linspace(self.tmin, self.tmax, 1000)
+        if self.tmin <= tpred <= self.tmax:
+            fdiff = np.abs(self.solres[1]-self.lqdres[1])
+            if fdiff[-1] < fdiff[0]:
+                tpred = self.tmax + self.dtemp
             else:
-                break
-            #evaluate in new range
-            new_solfe = np.polyval(solfit, new_t)
-            new_lqdfe = np.polyval(lqdfit, new_t)
-    
-            arg = np.argsort(np.abs(new_solfe-new_lqdfe))[0]
-            tpred = new_t[arg]
-        else:
+                tpred = self.tmin - self.dtemp
+
+        if (tpred <= 0) or (tpred > self.tmax + 100*self.dtemp) or (tpred < self.tmin - 100*self.dtemp):
             raise ValueError('failed to extrapolate melting temperature')
         
         self.logger.info("Predicted melting temperature from extrapolation: %f"%tpred)
@@ -288,34 +468,26 @@ class MeltingTemp:
         None
         """
         for i in range(100):
-            arg = np.argsort(np.abs(self.solres[1]-self.lqdres[1]))[0]
-            self.arg = arg
+            tm, tmerr = find_crossing_temperature(self.solres, self.lqdres)
         
-            if ((arg==0) or (arg==len(self.solres[1])-1)):
+            if tm is None:
                 self.logger.info('From calculation, melting temperature is not within the selected range.')
                 self.logger.info('STATE: From calculation, Tm is not within range.')
-                if arg==len(self.solres[1])-1:
-                    arg = 999
-                #the above is just a trick to extrapolate
                 #now here we need to find a guess value;
-                tpred = self.extrapolate_tm(arg)
-                #now we have to run calcs again
-                self.tmin = tpred - self.dtemp
-                if self.tmin < 0:
-                    self.tmin = 0
-                self.tmax = tpred + self.dtemp
-                self.logger.info('Restarting calculation with predicted melting temperature +/- %f'%self.dtemp)
-                #self.logger.info('STATE: Restarting calculation with predicted melting temperature +/- %f'%self.dtemp)
-                self.start_calculation()
+                tpred = self.extrapolate_tm()
+                #keep the completed sweeps and only extend them if possible
+                if not (self.calc.melting_temperature.incremental and self.refine_tm(tpred)):
+                    #now we have to run calcs again
+                    self.tmin = tpred - self.dtemp
+                    if self.tmin < 0:
+                        self.tmin = 0
+                    self.tmax = tpred + self.dtemp
+                    self.logger.info('Restarting calculation with predicted melting temperature +/- %f'%self.dtemp)
+                    #self.logger.info('STATE: Restarting calculation with predicted melting temperature +/- %f'%self.dtemp)
+                    self.start_calculation()
                 
             else:
-                self.calc_tm = self.solres[0][arg]
-                #get errors
-                suberr = np.sqrt(self.solres[2][arg]**2 + self.lqdres[2][arg]**2)
-                sol_slope = (self.solres[1][arg+50]-self.solres[1][arg-50])/(self.solres[0][arg+50]-self.solres[0][arg-50])
-                lqd_slope = (self.lqdres[1][arg+50]-self.lqdres[1][arg-50])/(self.lqdres[0][arg+50]-self.lqdres[0][arg-50])
-                slope_diff = sol_slope-lqd_slope
-                tmerr = suberr/slope_diff
+                self.calc_tm = tm
                 self.tmerr = tmerr
                 return self.calc_tm, self.tmerr
             
@@ -324,6 +496,41 @@ class MeltingTemp:
             if self.attempts>self.maxattempts:
                 raise ValueError('Maximum number of tries reached')
     
+    def refine_tm(self, tpred):
+        """
+        Extend the completed sweeps towards a predicted melting temperature
+
+        Parameters
+        ----------
+        tpred : float
+            predicted melting temperature, outside the current range
+
+        Returns
+        -------
+        extended : bool
+            True if the sweeps were extended, False if a phase transformed and
+            the calculation has to be restarted
+        """
+        #start from the limits of the completed sweeps
+        self.tmin = self.solres[0][0]
+        self.tmax = self.solres[0][-1]
+
+        if tpred > self.tmax:
+            tstart = self.tmax
+            tstop = tpred + self.dtemp
+        else:
+            tstart = self.tmin
+            tstop = max(tpred - self.dtemp, 10)
+
+        returncode = self.run_extension(tstart, tstop)
+        if returncode is not None:
+            self.logger.info('Phase transformed while extending the sweeps, restarting calculation')
+            return False
+
+        self.tmin = self.solres[0][0]
+        self.tmax = self.solres[0][-1]
+        return True
+
     def calculate_tm(self):
         #do a first round of calculation
         self.start_calculation()
@@ -332,23 +539,249 @@ class MeltingTemp:
         self.logger.info('Experimental melting temperature = %.2f K '%(self.org_tm))
         self.logger.info('STATE: Tm = %.2f K +/- %.2f K, Exp. Tm = %.2f K'%(tm, tmerr, self.org_tm))
 
-def routine_fe(job):
+def sorted_sweep(res):
     """
-    Perform an FE calculation routine
+    Sort a temperature sweep by increasing temperature
+
+    Parameters
+    ----------
+    res : list of arrays
+        temperature, free energy and error
+
+    Returns
+    -------
+    res : list of arrays
+        sorted temperature, free energy and error
+    """
+    args = np.argsort(res[0])
+    return [np.asarray(x)[args] for x in res]
+
+def merge_sweeps(old, new):
     """
+    Merge an extension into a completed temperature sweep
+
+    Parameters
+    ----------
+    old : list of arrays
+        temperature, free energy and error of the completed sweep
+
+    new : list of arrays
+        temperature, free energy and error of the extension
+
+    Returns
+    -------
+    res : array of shape 3xN
+        merged sweep sorted by increasing temperature
+
+    Notes
+    -----
+    Points of the extension which fall within the completed sweep are dropped.
+    """
+    old = sorted_sweep(old)
+    new = sorted_sweep(new)
+    keep = (new[0] < old[0][0]) | (new[0] > old[0][-1])
+    return np.array(sorted_sweep([np.concatenate((o, n[keep])) for o, n in zip(old, new)]))
+
+def run_averaging_cached(job):
+    """
+    Run the averaging routine of a job, unless the equilibrated state is in the cache
+
+    Parameters
+    ----------
+    job : Phase class
+
+    Returns
+    -------
+    None
+    """
+    if job.stage_done("averaging"):
+        job.resume_averaging()
+        job.logger.info("Averaging routine skipped, finished in a previous run")
+        return
+
     ts = time.time()
+    if job.load_equilibration():
+        job.logger.info("Averaging routine skipped, equilibrated state taken from cache")
+        job.mark_averaging()
+        return
+
     job.run_averaging()
+    job.save_equilibration()
+    job.mark_averaging()
     te = (time.time() - ts)
     job.logger.info("Averaging routine finished in %f s"%te)
+    job.record_performance("run_averaging", te)
 
-    #now run integration loops
-    for i in range(job.calc.n_iterations):
+
+def run_iterations(job, method, iterations, label="Integration"):
+    """
+    Run iterations of a job, several at once if asked for
+
+    Parameters
+    ----------
+    job : Phase class
+
+    method : callable
+        method of the job which takes the keyword `iteration`, for example `job.run_integration`
+
+    iterations : list of ints
+        iteration numbers to be run
+
+    label : string, optional
+        name of the cycle used for logging
+
+    Returns
+    -------
+    None
+
+    Notes
+    -----
+    If `queue.iterations_in_parallel` is larger than 1, the cores of the job are split into
+    groups and each group runs one iteration at a time in its own LAMMPS instance. All iterations
+    write their files with the iteration number to the simulation folder, so they are integrated
+    as usual afterwards. A shared LAMMPS session is not used while iterations run in parallel.
+    Each group is started with the MPI binding of `queue.group_binding`, so that the groups do not
+    share cores.
+
+    Each finished iteration is recorded in the ledger of the job, and iterations finished in
+    a previous run are skipped when the calculation is resumed.
+    """
+    def run_one(iteration):
         ts = time.time()
-        job.run_integration(iteration=(i+1))
+        job.set_current_stage("%s_%d"%(method.__name__, iteration))
+        try:
+            method(iteration=iteration)
+        finally:
+            job.set_current_stage(None)
+        if job.calc.output.binary:
+            job.store_binary_output(iteration)
         te = (time.time() - ts)
-        job.logger.info("Integration cycle %d finished in %f s"%(i+1, te))
+        job.mark_stage("%s_%d"%(method.__name__, iteration))
+        job.logger.info("%s cycle %d finished in %f s"%(label, iteration, te))
+        job.record_performance(method.__name__, te, iteration=iteration)
+
+    done = [iteration for iteration in iterations if job.stage_done("%s_%d"%(method.__name__, iteration))]
+    if len(done) > 0:
+        job.logger.info("%s cycles %s skipped, finished in a previous run"%(label, 
+            " ".join([str(iteration) for iteration in done])))
+        iterations = [iteration for iteration in iterations if iteration not in done]
+
+    n_parallel = min(int(job.calc.queue.iterations_in_parallel), len(iterations))
+    if n_parallel <= 1:
+        for iteration in iterations:
+            run_one(iteration)
+        return
+
+    cores = job.cores
+    session = job.session
+    job.cores = max(1, cores//n_parallel)
+    job.session = None
+    job.logger.info("Running %d iterations in parallel with %d cores each"%(n_parallel, job.cores))
+
+    #each group keeps its own set of cores while it runs an iteration, within the cores of the
+    #calling thread if it is bound itself
+    cpu_sets = ph.group_cpu_sets(cores, n_parallel, cpu_set=ph.current_cpu_set())
+    slots = queue.Queue()
+    for slot in range(n_parallel):
+        slots.put(slot)
+
+    def run_group(iteration):
+        slot = slots.get()
+        ph.set_group_binding(ph.binding_environment(job.calc.queue.group_binding, cpu_set=cpu_sets[slot]))
+        try:
+            run_one(iteration)
+        finally:
+            ph.set_group_binding(None)
+            slots.put(slot)
+
+    try:
+        with ThreadPoolExecutor(max_workers=n_parallel) as executor:
+            futures = [executor.submit(run_group, iteration) for iteration in iterations]
+            for future in as_completed(futures):
+                future.result()
+    finally:
+        job.cores = cores
+        job.session = session
+
+
+def run_integration_cycles(job, label="Integration"):
+    """
+    Run the switching iterations of a job
 
-    job.thermodynamic_integration()
+    Parameters
+    ----------
+    job : Phase class
+
+    label : string, optional
+        name of the cycle used for logging
+
+    Returns
+    -------
+    None
+
+    Notes
+    -----
+    If `adaptive.target_error` is given, the standard error of the work is evaluated after
+    each iteration, starting from `adaptive.n_min` iterations. The cycles are stopped once the error
+    falls below the target, or after `adaptive.n_max` iterations. `n_switching_iterations` of the job
+    is set to the number of iterations that were carried out, while `n_iterations` is kept for the sweeps.
+    """
+    target = job.calc.adaptive.target_error
+    if target is None:
+        n_max = job.calc.n_iterations
+    else:
+        n_max = job.calc.n_iterations if job.calc.adaptive.n_max is None else int(job.calc.adaptive.n_max)
+        n_min = max(int(job.calc.adaptive.n_min), 2)
+        job.logger.info("Adaptive iterations: target error %f meV/atom, between %d and %d iterations"%(target, 
+            n_min, n_max))
+
+    #iterations are run in batches, which have a single iteration unless run in parallel
+    n_batch = max(1, int(job.calc.queue.iterations_in_parallel))
+    n_done = 0
+    while n_done < n_max:
+        batch = list(range(n_done+1, min(n_done+n_batch, n_max)+1))
+        pending = [iteration for iteration in batch if not job.stage_done("run_integration_%d"%iteration)]
+        if job.calc.queue.use_partitions and (len(pending) > 1):
+            ts = time.time()
+            job.run_integration_replicas(pending)
+            for iteration in pending:
+                if job.calc.output.binary:
+                    job.store_binary_output(iteration)
+                job.mark_stage("run_integration_%d"%iteration)
+            te = (time.time() - ts)
+            job.logger.info("%s cycles %d-%d finished in %f s"%(label, batch[0], batch[-1], te))
+            #each partition writes its own log, named after its iteration
+            for iteration in pending:
+                job.record_performance("run_integration", te, iteration=iteration, 
+                    cores=job.cores//len(pending))
+        else:
+            run_iterations(job, job.run_integration, batch, label=label)
+        n_done = batch[-1]
+
+        if (target is not None) and (n_done >= n_min):
+            err = 1000*job.switching_error(n_done)
+            job.logger.info("Error after %d iterations is %f meV/atom"%(n_done, err))
+            if err < target:
+                job.logger.info("Target error reached after %d iterations"%n_done)
+                break
+
+    job.n_switching_iterations = n_done
+
+
+def routine_fe(job):
+    """
+    Perform an FE calculation routine
+    """
+    run_averaging_cached(job)
+
+    if job.load_free_energy():
+        job.logger.info("Integration skipped, free energy taken from cache")
+    else:
+        #now run integration loops
+        run_integration_cycles(job)
+
+        job.thermodynamic_integration()
+        job.save_free_energy()
     job.submit_report()
     return job
 
@@ -359,11 +792,8 @@ def routine_ts(job):
     routine_fe(job)
 
     #now do rev scale steps
-    for i in range(job.calc.n_iterations):
-        ts = time.time()
-        job.reversible_scaling(iteration=(i+1))
-        te = (time.time() - ts)
-        job.logger.info("TS integration cycle %d finished in %f s"%(i+1, te))
+    run_iterations(job, job.reversible_scaling, list(range(1, job.calc.n_iterations+1)), 
+        label="TS integration")
     
     job.integrate_reversible_scaling(scale_energy=True)
     return job
@@ -373,16 +803,10 @@ def routine_only_ts(job):
     """
     Perform sweep without free energy calculation
     """
-    ts = time.time()
-    job.run_averaging()
-    te = (time.time() - ts)
-    job.logger.info("Averaging routine finished in %f s"%te)
+    run_averaging_cached(job)
 
-    for i in range(job.calc.n_iterations):
-        ts = time.time()
-        job.reversible_scaling(iteration=(i+1))
-        te = (time.time() - ts)
-        job.logger.info("TS integration cycle %d finished in %f s"%(i+1, te))
+    run_iterations(job, job.reversible_scaling, list(range(1, job.calc.n_iterations+1)), 
+        label="TS integration")
     return job
 
 def routine_tscale(job):
@@ -392,11 +816,8 @@ def routine_tscale(job):
     routine_fe(job)
 
     #now do rev scale steps
-    for i in range(job.calc.n_iterations):
-        ts = time.time()
-        job.temperature_scaling(iteration=(i+1))
-        te = (time.time() - ts)
-        job.logger.info("Temperature scaling cycle %d finished in %f s"%(i+1, te))
+    run_iterations(job, job.temperature_scaling, list(range(1, job.calc.n_iterations+1)), 
+        label="Temperature scaling")
     
     job.integrate_reversible_scaling(scale_energy=False)
     return job
@@ -408,11 +829,8 @@ def routine_pscale(job):
     routine_fe(job)
 
     #now do rev scale steps
-    for i in range(job.calc.n_iterations):
-        ts = time.time()
-        job.pressure_scaling(iteration=(i+1))
-        te = (time.time() - ts)
-        job.logger.info("Pressure scaling cycle %d finished in %f s"%(i+1, te))
+    run_iterations(job, job.pressure_scaling, list(range(1, job.calc.n_iterations+1)), 
+        label="Pressure scaling")
     
     job.integrate_pressure_scaling()
     return job
@@ -421,17 +839,10 @@ def routine_alchemy(job):
     """
     Perform an FE calculation routine
     """
-    ts = time.time()
-    job.run_averaging()
-    te = (time.time() - ts)
-    job.logger.info("Averaging routine finished in %f s"%te)
+    run_averaging_cached(job)
 
     #now run integration loops
-    for i in range(job.calc.n_iterations):
-        ts = time.time()
-        job.run_integration(iteration=(i+1))
-        te = (time.time() - ts)
-        job.logger.info("Alchemy integration cycle %d finished in %f s"%(i+1, te))
+    run_integration_cycles(job, label="Alchemy integration")
 
     job.thermodynamic_integration()
     job.submit_report()
@@ -498,17 +909,10 @@ def routine_composition_scaling(job):
 
 
     #now start cycle
-    ts = time.time()
-    job.run_averaging()
-    te = (time.time() - ts)
-    job.logger.info("Averaging routine finished in %f s"%te)
+    run_averaging_cached(job)
 
     #now run integration loops
-    for i in range(job.calc.n_iterations):
-        ts = time.time()
-        job.run_integration(iteration=(i+1))
-        te = (time.time() - ts)
-        job.logger.info("Alchemy integration cycle %d finished in %f s"%(i+1, te))
+    run_integration_cycles(job, label="Alchemy integration")
 
     flambda_arr, w_arr, q_arr, qerr_arr = job.thermodynamic_integration()
 
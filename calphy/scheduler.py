@@ -23,16 +23,160 @@ sarath.menon@ruhr-uni-bochum.de/yury.lysogorskiy@icams.rub.de
 
 import os
 import stat
+import time
+import heapq
 import subprocess as sub
+from calphy.helpers import binding_environment
+
+
+class LocalPool:
+    """
+    Pool which runs local jobs within a budget of cores
+
+    Parameters
+    ----------
+    cores : int, optional
+        number of cores that can be used at the same time, default all cores of the machine
+
+    max_jobs : int, optional
+        largest number of jobs running at the same time, default no limit
+
+    poll_interval : float, optional
+        time in seconds between checks of the running jobs
+
+    Notes
+    -----
+    Jobs are started in the order of their priority, and in the order of submission for
+    the same priority, whenever enough cores are free. A job which asks for more cores than
+    the budget is started once no other job is running. Queued jobs are started by `submit`,
+    `poll` and `wait`, so `wait` should be called once all jobs are submitted.
+
+    Each job is bound to its own free cores through the environment of `mpiexec`, see
+    `calphy.helpers.binding_environment`. A job larger than the budget is not bound.
+    Jobs are identified by the id returned from `submit`, so a script can be submitted more than once.
+    """
+    def __init__(self, cores=None, max_jobs=None, poll_interval=1.0):
+        self.cores = os.cpu_count() if cores is None else int(cores)
+        self.max_jobs = max_jobs
+        self.poll_interval = poll_interval
+        self.queue = []
+        self.running = {}
+        self.returncodes = {}
+        self.scripts = {}
+        self._count = 0
+
+    @property
+    def used_cores(self):
+        return sum([len(cpu_set) for (proc, cpu_set) in self.running.values()])
+
+    @property
+    def free_cores(self):
+        used = [cpu for (proc, cpu_set) in self.running.values() for cpu in cpu_set]
+        return [cpu for cpu in range(self.cores) if cpu not in used]
+
+    def submit(self, script, cores=1, priority=0):
+        """
+        Add a job script to the queue
+
+        Parameters
+        ----------
+        script : string
+            executable job script
+
+        cores : int, optional
+            number of cores used by the job
+
+        priority : int, optional
+            jobs with higher priority are started first
+
+        Returns
+        -------
+        job : int
+            id of the job
+        """
+        job = self._count
+        heapq.heappush(self.queue, (-priority, job, script, int(cores)))
+        self.scripts[job] = script
+        self._count += 1
+        self.poll()
+        return job
+
+    def _start(self):
+        while len(self.queue) > 0:
+            if (self.max_jobs is not None) and (len(self.running) >= self.max_jobs):
+                break
+            _, job, script, cores = self.queue[0]
+            if (len(self.running) > 0) and (self.used_cores + cores > self.cores):
+                break
+            heapq.heappop(self.queue)
+            env = dict(os.environ)
+            if cores <= self.cores:
+                cpu_set = self.free_cores[:cores]
+                env.update(binding_environment("cores", cpu_set=cpu_set))
+            else:
+                cpu_set = list(range(self.cores))
+                env.update(binding_environment("none"))
+            proc = sub.Popen([script], stdin=sub.DEVNULL, stdout=sub.DEVNULL, stderr=sub.DEVNULL, env=env)
+            self.running[job] = (proc, cpu_set)
+
+    def poll(self):
+        """
+        Collect finished jobs and start queued ones
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        njobs : int
+            number of jobs which are running or queued
+        """
+        for job in list(self.running.keys()):
+            proc, cpu_set = self.running[job]
+            returncode = proc.poll()
+            if returncode is not None:
+                self.returncodes[job] = returncode
+                del self.running[job]
+        self._start()
+        return len(self.running) + len(self.queue)
+
+    def wait(self):
+        """
+        Block until all jobs are finished
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        returncodes : dict
+            exit code of each job, by job id
+        """
+        while self.poll() > 0:
+            time.sleep(self.poll_interval)
+        return self.returncodes
+
+    @property
+    def failed(self):
+        """
+        Ids of the jobs which finished with a non-zero exit code
+        """
+        return [job for job, returncode in self.returncodes.items() if returncode != 0]
 
 
 class Local:
     """
     Local submission script
     """
-    def __init__(self, options, cores=1, directory=os.getcwd()):
+    #job arrays are not available
+    task_index = None
+
+    def __init__(self, options, cores=1, directory=os.getcwd(), pool=None):
         self.queueoptions = {"scheduler": "local",
                              "jobname": "tis",
+                             "priority": 0,
                              "walltime": None,
                              "queuename": None,
                              "memory": None,
@@ -50,6 +194,9 @@ class Local:
                     self.queueoptions[key] = val
         self.maincommand = ""
         self.script = ''
+        self.array = None
+        #jobs are run through the pool if given
+        self.pool = pool
 
     def write_script(self, outfile):
         """
@@ -75,9 +222,15 @@ class Local:
     def submit(self):
         """
         Submit the job
+
+        If the object has a `LocalPool`, the job is queued in the pool and its id in the pool is returned.
+        Otherwise it is started right away and the process is returned.
         """
         st = os.stat(self.script)
         os.chmod(self.script, st.st_mode | stat.S_IEXEC)
+        if self.pool is not None:
+            return self.pool.submit(self.script, cores=int(self.queueoptions["cores"]), 
+                priority=int(self.queueoptions["priority"]))
         cmd = [self.script]
         proc = sub.Popen(cmd, stdin=sub.PIPE, stdout=sub.PIPE, stderr=sub.PIPE)
         return proc
@@ -86,6 +239,9 @@ class SLURM:
     """
     Slurm class for writing submission script
     """
+    #index of the task in a job array, starting from zero
+    task_index = "${SLURM_ARRAY_TASK_ID}"
+
     def __init__(self, options, cores=1, directory=os.getcwd()):
         """
         Create class
@@ -113,6 +269,8 @@ class SLURM:
                     self.queueoptions[key] = val
         self.maincommand = ""
         self.script = ''
+        #number of tasks if submitted as a job array
+        self.array = None
 
     def write_script(self, outfile):
         """
@@ -120,6 +278,9 @@ class SLURM:
         """
         jobout = ".".join([outfile, "out"])
         joberr = ".".join([outfile, "err"])
+        if self.array is not None:
+            jobout = ".".join([jobout, self.task_index])
+            joberr = ".".join([joberr, self.task_index])
 
         with open(outfile, "w") as fout:
             fout.write(self.queueoptions["header"])
@@ -127,6 +288,8 @@ class SLURM:
 
             #write the main header options
             fout.write("#SBATCH --job-name=%s\n" % self.queueoptions["jobname"])
+            if self.array is not None:
+                fout.write("#SBATCH --array=0-%d\n" % (self.array-1))
             fout.write("#SBATCH --time=%s\n" % self.queueoptions["walltime"])
             # fout.write("#SBATCH --partition=%s\n"%self.queueoptions["queuename"])
             fout.write("#SBATCH --nodes=%s\n" % str(self.queueoptions["nodes"]))
@@ -170,6 +333,9 @@ class SGE:
     """
     Slurm class for writing submission script
     """
+    #index of the task in a job array, starting from zero
+    task_index = "$((SGE_TASK_ID-1))"
+
     def __init__(self, options, cores=1, directory=os.getcwd()):
         """
         Create class
@@ -196,17 +362,28 @@ class SGE:
                 if val is not None:
                     self.queueoptions[key] = val
         self.maincommand = ""
+        self.script = ''
+        #number of tasks if submitted as a job array
+        self.array = None
 
     def write_script(self, outfile):
         """
         Write the script file
         """
+        jobout = ".".join([outfile, "out"])
+        joberr = ".".join([outfile, "err"])
+        if self.array is not None:
+            jobout = ".".join([jobout, self.task_index])
+            joberr = ".".join([joberr, self.task_index])
+
         with open(outfile, "w") as fout:
             fout.write(self.queueoptions["header"])
             fout.write("\n")
 
             #write the main header options
             fout.write("#$ -N %s\n" %self.queueoptions["jobname"])
+            if self.array is not None:
+                fout.write("#$ -t 1-%d\n" %self.array)
             fout.write("#$ -l h_rt=%s\n"     %self.queueoptions["walltime"])
             fout.write("#$ -l qname=%s\n"%self.queueoptions["queuename"])
             fout.write("#$ -pe %s %s\n"   %( self.queueoptions["system"], str(self.queueoptions["cores"])))
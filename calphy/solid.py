@@ -32,6 +32,7 @@ import calphy.lattice as pl
 import calphy.helpers as ph
 import calphy.phase as cph
 from calphy.errors import *
+from calphy.convergence import equilibrated_statistics
 
 class Solid(cph.Phase):
     """
@@ -66,24 +67,24 @@ class Solid(cph.Phase):
         
         if ph.check_if_any_is_none(self.calc.spring_constants):
             #similar averaging routine
-            laststd = 0.00
+            #msd.dat is written by fix ave/time, the first column is the timestep
+            reader = IncrementalReader(os.path.join(self.simfolder, "msd.dat"), 
+                usecols=tuple(range(1, self.calc.n_elements+1)))
             for i in range(self.calc.md.n_cycles):
                 lmp.command("run              %d"%int(self.calc.md.n_small_steps))
-                ncount = int(self.calc.md.n_small_steps)//int(self.calc.md.n_every_steps*self.calc.md.n_repeat_steps)
                 #now we can check if it converted
-                file = os.path.join(self.simfolder, "msd.dat")
-                quant = np.loadtxt(file, usecols=(1,), unpack=True)[-ncount+1:]
-                quant = 3*kb*self.calc._temperature/quant
-                #self.logger.info(quant)
-                mean = np.mean(quant)
-                std = np.std(quant)
-                self.logger.info("At count %d mean k is %f std is %f"%(i+1, mean, std))
-                if (np.abs(laststd - std) < self.calc.tolerance.spring_constant):
+                reader.update()
+                quant = 3*kb*self.calc._temperature/reader.data[0]
+                stats = equilibrated_statistics(quant)
+                start = stats["start"]
+                self.logger.info("At count %d mean k is %f error is %f, %f effective samples"%(i+1, 
+                    stats["mean"], stats["error"], stats["n_effective"]))
+                if (stats["error"] < self.calc.tolerance.spring_constant) and (stats["n_effective"] >= self.calc.tolerance.effective_samples):
                     #now reevaluate spring constants
+                    self.equilibration["spring_constant"] = stats
                     k = []
                     for i in range(self.calc.n_elements):
-                        quant = np.loadtxt(file, usecols=(i+1, ), unpack=True)[-ncount+1:]
-                        quant = 3*kb*self.calc._temperature/quant
+                        quant = 3*kb*self.calc._temperature/reader.data[i][start:]
                         k.append(np.round(np.mean(quant), decimals=2))
 
                     #first replace any provided values with user values
@@ -100,7 +101,6 @@ class Solid(cph.Phase):
                     self.logger.info("finalized sprint constants")
                     self.logger.info(self.k)
                     break
-                laststd = std
 
         else:
             if not (len(self.calc.spring_constants) == self.calc.n_elements):
@@ -137,10 +137,11 @@ class Solid(cph.Phase):
         At the end of the run, the averaged box dimensions are calculated. 
         """
         lmp = ph.create_object(self.cores, self.simfolder, self.calc.md.timestep, 
-            self.calc.md.cmdargs, self.calc.md.init_commands)
+            self.calc.md.cmdargs, self.calc.md.init_commands, session=self.session, 
+            logfile=self.lammps_logfile("run_averaging"), profile=self.profile_file)
 
         #set up structure
-        lmp = ph.create_structure(lmp, self.calc, species=self.calc.n_elements+self.calc._ghost_element_count)
+        lmp = self.create_structure(lmp, species=self.calc.n_elements+self.calc._ghost_element_count)
 
         #set up potential
         if self.calc.potential_file is None:
@@ -182,10 +183,7 @@ class Solid(cph.Phase):
         #check for melting
         self.dump_current_snapshot(lmp, "traj.equilibration_stage2.dat")
         self.check_if_melted(lmp, "traj.equilibration_stage2.dat")
-        lmp = ph.write_data(lmp, "current.data")
-        #close object and process traj
-        lmp.close()
-        self.process_traj("traj.equilibration_stage2.dat", "conf.equilibration.data")
+        self.save_configuration(lmp, "traj.equilibration_stage2.dat", "conf.equilibration.data")
 
 
 
@@ -208,12 +206,12 @@ class Solid(cph.Phase):
         the lambda parameter. See algorithm 4 in publication.
         """
         lmp = ph.create_object(self.cores, self.simfolder, self.calc.md.timestep, 
-            self.calc.md.cmdargs, self.calc.md.init_commands)
+            self.calc.md.cmdargs, self.calc.md.init_commands, session=self.session, 
+            logfile=self.lammps_logfile("run_integration", iteration=iteration), profile=self.profile_file)
 
         #read in the conf file
         #conf = os.path.join(self.simfolder, "conf.equilibration.dump")
-        conf = os.path.join(self.simfolder, "conf.equilibration.data")
-        lmp = ph.read_data(lmp, conf)
+        lmp = self.load_configuration(lmp)
 
         #set up potential
         if self.calc.potential_file is None:
@@ -244,8 +242,8 @@ class Solid(cph.Phase):
             lmp.command("fix               ff%d g%d ti/spring 10.0 100 100 function 2"%(i+1, i+1))
         
         #apply temp fix
-        lmp.command("fix               f3 all langevin %f %f %f %d zero yes"%(self.calc._temperature, self.calc._temperature, self.calc.md.thermostat_damping[1], 
-                                        np.random.randint(0, 10000)))
+        lmp.command("fix               f3 all langevin %f %f %f %s zero yes"%(self.calc._temperature, self.calc._temperature, self.calc.md.thermostat_damping[1], 
+                                        self.seed()))
 
         #compute com and apply to fix
         lmp.command("compute           Tcm all temp/com")
@@ -263,7 +261,7 @@ class Solid(cph.Phase):
         lmp.command("thermo            10000")
 
         #Create velocity
-        lmp.command("velocity          all create %f %d mom yes rot yes dist gaussian"%(self.calc._temperature, np.random.randint(0, 10000)))
+        lmp.command("velocity          all create %f %s mom yes rot yes dist gaussian"%(self.calc._temperature, self.seed()))
 
         #reapply 
         for i in range(self.calc.n_elements):
@@ -274,36 +272,22 @@ class Solid(cph.Phase):
         lmp.command("run               %d"%self.calc.n_equilibration_steps)
         
         #write out energy
-        str1 = "fix f4 all print 1 \"${dU1} "
-        str2 = []
-        for i in range(self.calc.n_elements):
-            str2.append("${dU%d}"%(i+2))
-        str2.append("${lambda}\"")
-        str2 = " ".join(str2)
-        str3 = " screen no file forward_%d.dat"%iteration
-        command = str1 + str2 + str3
-        lmp.command(command)
+        self.fix_switching_output(lmp, "f4", ["dU%d"%(i+1) for i in range(self.calc.n_elements+1)] + ["lambda"], 
+            "forward_%s.dat"%iteration)
 
         #Forward switching over ts steps
-        lmp.command("run               %d"%self.calc._n_switching_steps)
+        self.run_switching(lmp, "forward_%s.dat"%iteration, self.calc._n_switching_steps)
         lmp.command("unfix             f4")
 
         #Equilibriate
         lmp.command("run               %d"%self.calc.n_equilibration_steps)
 
         #write out energy
-        str1 = "fix f4 all print 1 \"${dU1} "
-        str2 = []
-        for i in range(self.calc.n_elements):
-            str2.append("${dU%d}"%(i+2))
-        str2.append("${lambda}\"")
-        str2 = " ".join(str2)
-        str3 = " screen no file backward_%d.dat"%iteration
-        command = str1 + str2 + str3
-        lmp.command(command)
+        self.fix_switching_output(lmp, "f4", ["dU%d"%(i+1) for i in range(self.calc.n_elements+1)] + ["lambda"], 
+            "backward_%s.dat"%iteration)
 
         #Reverse switching over ts steps
-        lmp.command("run               %d"%self.calc._n_switching_steps)
+        self.run_switching(lmp, "backward_%s.dat"%iteration, self.calc._n_switching_steps)
         lmp.command("unfix             f4")
 
         #close object
@@ -330,10 +314,8 @@ class Solid(cph.Phase):
         f1 = get_einstein_crystal_fe(self.calc._temperature, 
             self.natoms, self.calc.mass, 
             self.vol, self.k, self.concentration)
-        w, q, qerr = find_w(self.simfolder, 
-            nelements=self.calc.n_elements, 
-            concentration=self.concentration, nsims=self.calc.n_iterations, 
-            full=True, solid=True)
+        w, q, qerr = self.find_w(nelements=self.calc.n_elements, 
+            concentration=self.concentration, solid=True)
         
         self.fref = f1
         self.w = w
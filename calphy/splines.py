@@ -576,4 +576,5 @@ sum_spline75 = [0.0208656914702533,0.0421335911164029,0.063670659694271,0.085446
 sum_spline100 = [0.022751120037216,0.045910532808262,0.069358886314654,0.093111074332860,0.117193421001055,0.141590628241591,0.166322354449552,0.191384838705569,0.216783189118122,0.242528215537895,0.268620650085640,0.295067156179220,0.321877113204317,0.349060002629334,0.376608779352532,0.404526116361092,0.432826329629026,0.461516598754625,0.490608087814006,0.520098744854098,0.549998589556064,0.580313886093840,0.611042422021131,0.642198386422815,0.673785350112000,0.705810878229726,0.738282703229342,0.771207048892062,0.804591961793084,0.838436905388695,0.872758381474059,0.907561036175287,0.942846603767524,0.978625367185550,1.014903295330200,1.051686407918390,1.088980922859230,1.126797655939330,1.165141004877230,1.204018512792680,1.623677596465690,2.104370910113270,2.653008220727520,3.275979576925120,3.978923839960030,4.766450436575240,5.641977302440640,6.607574516351870,7.664068081251860,8.811188730960130,10.047707473241200,11.371559331958000,12.780062993792400,14.270100584286200,15.838239772969900,17.480824496419700,19.194110106141100,20.974404874909700,22.818033169025700,24.721404291025700,26.681081620554200,28.693777743176400,30.756365300567500,32.865885098080900,35.019567569746600,37.214805116699300,39.449156150761500,41.720343675582300,44.026242064232500,46.364873708591800,48.734393689770700,51.133080789475600,53.559334176702700,56.011672897612300,58.488711702450300,60.989157573392400,71.202211031757100,81.707105874834700,92.454214656498000,103.405240329003000,114.530211680502000,125.805339025108000,137.211452823616000,148.732919115523000,160.356818930707000,172.072353003607000,183.870405493372000,195.743198822087000,207.684039226795000,219.687114803139000,231.747350331965000,243.860281653511000,256.021956470225000,268.228858659096000,280.477840724457000,292.766082311122000,305.091036447450000,317.450392248597000,329.842058607862000,342.264125899782000,354.714844033488000,367.192616055157000,379.695974154135000,392.223562929583000,404.774131143285000,417.346524791109000]
 
 
-splines = {1 : spline1, 25 : spline25, 50 : spline50, 75 : spline75, 100 : spline100}
\ No newline at end of file
+splines = {1 : spline1, 25 : spline25, 50 : spline50, 75 : spline75, 100 : spline100}
+sum_splines = {1 : sum_spline1, 25 : sum_spline25, 50 : sum_spline50, 75 : sum_spline75, 100 : sum_spline100}
\ No newline at end of file
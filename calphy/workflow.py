@@ -0,0 +1,324 @@
+"""
+calphy: a Python library and command line interface for automated free
+energy calculations.
+
+Copyright 2021  (c) Sarath Menon^1, Yury Lysogorskiy^2, Ralf Drautz^2
+^1: Max Planck Institut für Eisenforschung, Dusseldorf, Germany 
+^2: Ruhr-University Bochum, Bochum, Germany
+
+calphy is published and distributed under the Academic Software License v1.0 (ASL). 
+calphy is distributed in the hope that it will be useful for non-commercial academic research, 
+but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  
+calphy API is published and distributed under the BSD 3-Clause "New" or "Revised" License
+See the LICENSE FILE for more details. 
+
+More information about the program can be found in:
+Menon, Sarath, Yury Lysogorskiy, Jutta Rogal, and Ralf Drautz.
+“Automated Free Energy Calculation from Atomistic Simulations.” Physical Review Materials 5(10), 2021
+DOI: 10.1103/PhysRevMaterials.5.103801
+
+For more information contact:
+sarath.menon@ruhr-uni-bochum.de/yury.lysogorskiy@icams.rub.de
+"""
+
+import os
+import re
+import argparse as ap
+import yaml
+
+from calphy.input import read_inputfile
+from calphy.kernel import create_scheduler, kernel_command
+import calphy.scheduler as pq
+import calphy.cache as cc
+
+
+class Node:
+    """
+    Stage of a workflow, run as one job
+
+    Parameters
+    ----------
+    name : string
+        unique name of the stage
+
+    calc : Calculation object
+        calculation whose queue options are used for the job
+
+    command : string
+        command run by the job
+
+    dependencies : list of strings, optional
+        names of the stages which should finish successfully before this one starts
+    """
+    def __init__(self, name, calc, command, dependencies=None):
+        self.name = name
+        self.calc = calc
+        self.command = command
+        self.dependencies = [] if dependencies is None else dependencies
+        self.jobid = None
+        self.script = None
+        self.status = "waiting"
+
+    def __repr__(self):
+        return "%s: %s"%(self.name, self.status)
+
+
+class Workflow:
+    """
+    Workflow of the calculations of an input file
+
+    Parameters
+    ----------
+    inputfile : string
+        name of the input file
+
+    resume : bool, optional
+        pass the resume flag to the calculations
+
+    Notes
+    -----
+    The workflow has three kinds of stages. If `equilibration_cache` is used, calculations with
+    the same equilibrated state, for example `fe` and `ts` calculations of the same structure
+    and potential at the same starting temperature and pressure, share one `averaging` stage, which
+    stores the state in the cache. Each calculation is one stage, which depends on its averaging
+    stage and takes the state from the cache. A `ts`, `tscale` or `pscale` calculation also depends on
+    the `fe` calculation with the same settings at its starting temperature and pressure, and takes
+    the free energy from the cache instead of integrating again. A `summary` stage, which depends on
+    all calculations, collects the results in `workflow_summary.yaml`.
+
+    Stages whose dependencies are met are dispatched through the scheduler of the calculations.
+    For `slurm`, all stages are submitted at once with `--dependency=afterok`, and for `sge`
+    with `-hold_jid`. For `local`, the stages are run in rounds through a `LocalPool`, and stages
+    which depend on a failed stage are skipped.
+    """
+    def __init__(self, inputfile, resume=False):
+        self.inputfile = inputfile
+        self.resume = resume
+        self.calculations = read_inputfile(inputfile)
+        self.nodes = {}
+        self.build()
+
+    def add_node(self, node):
+        for dependency in node.dependencies:
+            if dependency not in self.nodes.keys():
+                raise ValueError("stage %s depends on unknown stage %s"%(node.name, dependency))
+        self.nodes[node.name] = node
+
+    def build(self):
+        """
+        Create the stages and their dependencies
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        averaging = {}
+        free_energies = {}
+        calculations = []
+        #fe calculations first, so that the sweeps can depend on them
+        order = sorted(range(len(self.calculations)), key=lambda count: self.calculations[count].mode != "fe")
+        for count in order:
+            calc = self.calculations[count]
+            dependencies = []
+            if (calc.mode != "melting_temperature") and (calc.equilibration_cache.folder is not None):
+                key = (cc.equilibration_key(calc), float(calc._temperature), str(calc._pressure))
+                if key not in averaging.keys():
+                    name = "averaging_%d"%count
+                    command = " ".join([kernel_command(self.inputfile, count), "--stage averaging"])
+                    self.add_node(Node(name, calc, command))
+                    averaging[key] = name
+                dependencies.append(averaging[key])
+
+                if calc.mode in ["fe", "ts", "tscale", "pscale"]:
+                    fekey = (cc.free_energy_key(calc), float(calc._temperature), str(calc._pressure))
+                    if fekey in free_energies.keys():
+                        dependencies.append(free_energies[fekey])
+                    elif calc.mode == "fe":
+                        free_energies[fekey] = "calculation_%d"%count
+
+            name = "calculation_%d"%count
+            command = kernel_command(self.inputfile, count, resume=self.resume)
+            self.add_node(Node(name, calc, command, dependencies=dependencies))
+            calculations.append(name)
+
+        command = "calphy_workflow -i %s --summary"%self.inputfile
+        self.add_node(Node("summary", self.calculations[0], command, dependencies=calculations))
+
+    def write_script(self, node, pool=None):
+        """
+        Write the job script of a stage
+
+        Parameters
+        ----------
+        node : Node
+
+        pool : LocalPool, optional
+            pool of the local scheduler
+
+        Returns
+        -------
+        scheduler : scheduler object
+        """
+        scheduler = create_scheduler(node.calc, pool=pool)
+        jobids = [self.nodes[dependency].jobid for dependency in node.dependencies 
+            if self.nodes[dependency].jobid is not None]
+        if len(jobids) > 0:
+            options = list(scheduler.queueoptions["options"])
+            if node.calc.queue.scheduler == "slurm":
+                options.append("--dependency=afterok:%s"%":".join(jobids))
+            elif node.calc.queue.scheduler == "sge":
+                options.append("-hold_jid %s"%",".join(jobids))
+            scheduler.queueoptions["options"] = options
+        scheduler.maincommand = node.command
+        node.script = os.path.join(os.getcwd(), "%s.%s.sub"%(node.calc.queue.jobname, node.name))
+        scheduler.write_script(node.script)
+        return scheduler
+
+    def submit(self):
+        """
+        Submit all stages to the queue, with dependencies between the jobs
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        for node in self.nodes.values():
+            scheduler = self.write_script(node)
+            proc = scheduler.submit()
+            out, err = proc.communicate()
+            #the first number in the output is the job id for both sbatch and qsub
+            raw = re.search(r"\d+", out.decode())
+            if raw is None:
+                raise RuntimeError("job id of stage %s not found, output: %s %s"%(node.name, out.decode(), err.decode()))
+            node.jobid = raw.group(0)
+            node.status = "submitted"
+            print("Submitted stage %s as job %s"%(node.name, node.jobid))
+
+    def run_local(self):
+        """
+        Run the stages on the local machine
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        calc = self.calculations[0]
+        pool = pq.LocalPool(cores=calc.queue.total_cores, max_jobs=calc.queue.max_jobs)
+        pending = list(self.nodes.values())
+        while len(pending) > 0:
+            ready = []
+            for node in pending:
+                states = [self.nodes[dependency].status for dependency in node.dependencies]
+                if any([state in ["failed", "skipped"] for state in states]):
+                    node.status = "skipped"
+                elif all([state == "done" for state in states]):
+                    ready.append(node)
+            pending = [node for node in pending if (node.status == "waiting") and (node not in ready)]
+
+            if len(ready) == 0:
+                continue
+            jobs = {}
+            for node in ready:
+                scheduler = self.write_script(node, pool=pool)
+                jobs[node.name] = scheduler.submit()
+            returncodes = pool.wait()
+            for node in ready:
+                node.status = "done" if returncodes[jobs[node.name]] == 0 else "failed"
+                print("Stage %s %s"%(node.name, node.status))
+
+    def run(self):
+        """
+        Dispatch the stages through the scheduler of the calculations
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        schedulers = list(set([calc.queue.scheduler for calc in self.calculations]))
+        if len(schedulers) > 1:
+            raise ValueError("all calculations of a workflow should use the same scheduler")
+        if schedulers[0] == "local":
+            self.run_local()
+        else:
+            self.submit()
+
+
+def write_summary(inputfile, outfile="workflow_summary.yaml"):
+    """
+    Collect the results of the calculations of an input file
+
+    Parameters
+    ----------
+    inputfile : string
+        name of the input file
+
+    outfile : string, optional
+        name of the output file
+
+    Returns
+    -------
+    summary : dict
+        results from `report.yaml` of each calculation, by simulation folder
+    """
+    summary = {}
+    for calc in read_inputfile(inputfile):
+        identistring = calc.create_identifier()
+        reportfile = os.path.join(os.getcwd(), identistring, "report.yaml")
+        if not os.path.exists(reportfile):
+            summary[identistring] = None
+            continue
+        with open(reportfile, "r") as fin:
+            report = yaml.safe_load(fin)
+        summary[identistring] = report["results"]
+
+    with open(outfile, "w") as fout:
+        yaml.safe_dump(summary, fout)
+    return summary
+
+
+def main():
+    """
+    Main method to parse arguments and run a workflow
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    None
+    """
+    arg = ap.ArgumentParser()
+
+    arg.add_argument("-i", "--input", required=True, type=str,
+    help="name of the input file")
+
+    arg.add_argument("-r", "--resume", action='store_true',
+    help="resume calculations, skipping stages finished in an earlier run")
+
+    arg.add_argument("--summary", action='store_true',
+    help="only collect the results of the calculations")
+
+    args = vars(arg.parse_args())
+
+    if args["summary"]:
+        write_summary(args["input"])
+    else:
+        workflow = Workflow(args["input"], resume=args["resume"])
+        workflow.run()
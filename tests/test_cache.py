@@ -0,0 +1,36 @@
+import pytest
+import calphy.cache as cc
+import numpy as np
+import os
+
+def test_state_cache(tmp_path):
+	folder = str(tmp_path)
+	state = {"temperature": 1000.0, "input_pressure": 0.0, "lx": 10.0}
+	cc.store_state(cc.state_folder(folder, "abc", 1000.0, 0.0), state)
+	state["temperature"] = 1200.0
+	cc.store_state(cc.state_folder(folder, "abc", 1200.0, 0.0), state,
+		configuration={"ntypes": 1, "x": np.ones((2, 3))})
+
+	found, exact = cc.find_state(folder, "abc", 1000.0, 0.0)
+	assert exact == True
+	found, exact = cc.find_state(folder, "abc", 1150.0, 0.0)
+	assert exact == False
+	state, conffile, conf = cc.load_state(found)
+	assert state["temperature"] == 1200.0
+	assert conffile is None
+	assert conf["ntypes"] == 1
+	found, exact = cc.find_state(folder, "abc", 1150.0, 0.0, near_match=False)
+	assert found is None
+	found, exact = cc.find_state(folder, "xyz", 1000.0, 0.0)
+	assert found is None
+
+def test_free_energy_cache(tmp_path):
+	folder = cc.state_folder(str(tmp_path), "abc", 1000.0, 0.0)
+	cc.store_state(folder, {"temperature": 1000.0, "input_pressure": 0.0})
+	assert cc.load_free_energy(folder, "def") is None
+	cc.store_free_energy(folder, "def", {"free_energy": -4.1, "error": 0.001})
+	assert cc.load_free_energy(folder, "def")["free_energy"] == -4.1
+	assert cc.load_free_energy(folder, "xyz") is None
+	#a new state removes the free energies of the old one
+	cc.store_state(folder, {"temperature": 1000.0, "input_pressure": 0.0})
+	assert cc.load_free_energy(folder, "def") is None
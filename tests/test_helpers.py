@@ -1,6 +1,8 @@
 import pytest
 import calphy.helpers as ch
 import numpy as np
+import calphy.performance as cperf
+import calphy.profiling as cprof
 
 def test_nones():
 	a = [None, 1, 2]
@@ -38,3 +40,72 @@ def test_validate_spring_constants():
 	d = [1, np.NaN, 4]
 	e = ch.validate_spring_constants(d)
 	assert e[1] == 1
+
+def test_parse_lammps_log(tmp_path):
+	logfile = tmp_path / "log.lammps"
+	logfile.write_text("\n".join(["Per MPI rank memory allocation (min/avg/max) = 3.13 | 3.13 | 3.5 Mbytes",
+		"Loop time of 2.5 on 4 procs for 1000 steps with 500 atoms",
+		"Section |  min time  |  avg time  |  max time  |%varavg| %total",
+		"Pair    | 1.9        | 2          | 2.1        |   0.0 | 80.00",
+		"Other   |            | 0.03       |            |       |  1.20",
+		"Loop time of 2.5 on 4 procs for 1000 steps with 500 atoms"]))
+	record = cperf.stage_record("run_integration", 6.0, 4, logfile=str(logfile), iteration=1)
+	assert record["md_steps"] == 2000
+	assert np.abs(record["timesteps_per_second"] - 400) < 1E-5
+	assert np.abs(record["atom_steps_per_second_per_core"] - 50000) < 1E-5
+	assert np.abs(record["lammps_timing"]["Pair"] - 2) < 1E-5
+	assert np.abs(record["lammps_memory_per_rank"] - 3.5) < 1E-5
+
+def test_command_tracer(tmp_path):
+	class Lammps:
+		def command(self, command):
+			pass
+		def close(self):
+			pass
+	profile = tmp_path / "profile.folded"
+	lmp = cprof.CommandTracer(Lammps(), str(profile))
+	lmp.command("run 0")
+	lmp.command("run 1000")
+	lmp.command("fix 1 all nve")
+	lmp.close()
+	totals = cprof.read_profile(str(profile))
+	assert "run 0" in totals
+	assert "run" in totals
+	assert "fix" in totals
+	assert "[python]" in totals
+
+def test_group_cpu_sets():
+	cpu_sets = ch.group_cpu_sets(64, 8)
+	assert len(cpu_sets) == 8
+	assert all([len(x) == 8 for x in cpu_sets])
+	assert [x[0] for x in cpu_sets] == list(range(0, 64, 8))
+	assert len(np.unique(np.concatenate(cpu_sets))) == 64
+	env = ch.binding_environment("cores", cpu_set=cpu_sets[1])
+	assert env["OMPI_MCA_hwloc_base_cpu_set"] == "8,9,10,11,12,13,14,15"
+	assert ch.binding_environment("default") == {}
+	#groups within a bound thread split the cores of the thread
+	ch.set_group_binding(ch.binding_environment("cores", cpu_set=ch.group_cpu_sets(16, 2)[1]))
+	try:
+		assert ch.current_cpu_set() == list(range(8, 16))
+		assert ch.group_cpu_sets(8, 2, cpu_set=ch.current_cpu_set()) == [[8, 9, 10, 11], [12, 13, 14, 15]]
+	finally:
+		ch.set_group_binding(None)
+	assert ch.current_cpu_set() is None
+
+def test_restart_replay():
+	class FakeLammps:
+		def __init__(self):
+			self.commands = []
+		def command(self, cmd):
+			self.commands.append(cmd)
+	lmp = FakeLammps()
+	replay = ch.RestartReplay(lmp, {"filename": "forward_1.dat"})
+	replay.command("pair_style eam/alloy")
+	replay.command("run               0")
+	replay.command("velocity all create 300 1")
+	replay.command("change_box all x final 0 4 remap units box")
+	replay.command("fix f1 all nve")
+	assert lmp.commands == ["pair_style eam/alloy", "fix f1 all nve"]
+	replay.replaying = False
+	replay.command("run 100 start 0 stop 1000")
+	assert lmp.commands[-1] == "run 100 start 0 stop 1000"
@@ -1,5 +1,6 @@
 import pytest
 from calphy.integrators import *
+from calphy.convergence import autocorrelation_time, equilibrated_statistics
 
 def test_ideal_gas():
 	a = get_ideal_gas_fe(1000, 0.07, 1000, [26], [1])
@@ -12,3 +13,146 @@ def test_uf():
 def test_solid_ref():
 	a = get_einstein_crystal_fe(1000, 1000, [26], 200, [1.2], [1])
 	assert np.abs(a+0.4727067261423942) < 1E-5
+
+def test_load_switching_data(tmp_path):
+	filename = str(tmp_path / "forward_1.dat")
+	np.savetxt(filename, np.random.rand(20, 4), header="Fix print output")
+	data = load_switching_data(filename)
+	assert data.shape == (4, 20)
+	assert np.allclose(data, np.loadtxt(filename, unpack=True))
+
+	cached = load_switching_data(filename, cache=True)
+	assert os.path.exists(filename + ".npy")
+	assert np.allclose(cached, load_switching_data(filename, cache=True))
+
+def test_find_w_batched(tmp_path):
+	lmbda = np.linspace(0, 1, 50)
+	ws = []
+	for i in range(3):
+		fwd = str(tmp_path / ("forward_%d.dat"%(i+1)))
+		bkd = str(tmp_path / ("backward_%d.dat"%(i+1)))
+		np.savetxt(fwd, np.column_stack((np.random.rand(50), np.random.rand(50), lmbda)))
+		np.savetxt(bkd, np.column_stack((np.random.rand(50), np.random.rand(50), lmbda[::-1])))
+		w, q, _ = integrate_path(fwd, bkd, solid=False)
+		ws.append(w)
+	w, q, err = find_w(str(tmp_path), nsims=3, full=True, solid=False)
+	assert np.abs(w - np.mean(ws)) < 1E-10
+	assert np.abs(err - np.std(ws, ddof=1)/np.sqrt(3)) < 1E-10
+	assert standard_error([w]) == 0.0
+
+def test_streaming_integrator(tmp_path):
+	filename = str(tmp_path / "forward_1.dat")
+	data = np.column_stack((np.random.rand(100), np.random.rand(100), np.linspace(1, 0, 100)))
+	lines = ["%f %f %f\n"%tuple(row) for row in data]
+	si = StreamingIntegrator(filename, solid=False)
+	with open(filename, "w") as fout:
+		fout.write("# Fix print output\n")
+		fout.writelines(lines[:40])
+		fout.write(lines[40][:5])
+	assert si.update() == 40
+	with open(filename, "w") as fout:
+		fout.write("# Fix print output\n")
+		fout.writelines(lines)
+	assert si.update() == 60
+	du, lmbda = get_du_lambda(load_switching_data(filename), solid=False)
+	assert np.abs(si.work - np.trapz(du, lmbda)) < 1E-10
+	assert np.abs(si.du_std - np.std(du)) < 1E-10
+
+def test_uf_array():
+	rho = np.array([0.05, 0.07, 0.09])
+	a = get_uhlenbeck_ford_fe(1000, rho, 50, 2)
+	for count, r in enumerate(rho):
+		assert np.abs(a[count] - get_uhlenbeck_ford_fe(1000, r, 50, 2)) < 1E-10
+	assert np.abs(a[1]-5.37158083028874) < 1E-5
+
+def test_bar():
+	rng = np.random.default_rng(0)
+	wf = rng.normal(4.0, 2.0, 1000)
+	wr = rng.normal(0.0, 2.0, 1000)
+	assert np.abs(bar_estimate(wf, wr) - 2.0) < 0.2
+	assert np.abs(crooks_gaussian_estimate(wf, wr) - 2.0) < 0.2
+	assert np.abs(bar_estimate(wr, wf) + bar_estimate(wf, wr)) < 1E-6
+
+def test_remove_peaks():
+	w = np.array([0.0, 0.1, 0.2, 5.0, 0.4, 0.5, 0.6, 0.7])
+	k = remove_peaks(w, 1.0)
+	assert np.abs(k[3] - 0.3) < 1E-10
+	assert np.allclose(np.delete(k, 3), np.delete(w, 3))
+	assert np.allclose(smooth_curve(np.ones(10), "savgol", window=5), 1.0)
+
+def test_incremental_reader(tmp_path):
+	file = str(tmp_path / "avg.dat")
+	with open(file, "w") as fout:
+		fout.write("# Time-averaged data\n100 1.0 2.0\n200 3.0 4.")
+	reader = IncrementalReader(file, usecols=(1, 2))
+	assert reader.update() == 1
+	with open(file, "a") as fout:
+		fout.write("0\n300 5.0 6.0\n")
+	assert reader.update() == 2
+	assert np.allclose(reader.data, [[1.0, 3.0, 5.0], [2.0, 4.0, 6.0]])
+
+def test_equilibration_detection():
+	rng = np.random.default_rng(1)
+	x = np.zeros(5000)
+	for i in range(1, len(x)):
+		x[i] = 0.8*x[i-1] + rng.normal()
+	assert np.abs(autocorrelation_time(x) - 9.0) < 1.5
+	stats = equilibrated_statistics(x + 50*np.exp(-np.arange(len(x))/100))
+	assert stats["start"] > 200
+	assert np.abs(stats["mean"]) < 4*stats["error"]
+
+def test_block_averaged_switching(tmp_path):
+	nsteps, nblock = 1000, 10
+	lmbda = np.arange(1, nsteps+1)/nsteps
+	du = np.sin(3*lmbda) + lmbda**2
+	work = np.sum(du)/nsteps
+	file = str(tmp_path / "forward_1.dat")
+	with open(file, "w") as fout:
+		fout.write("# Time-averaged data for fix f3\n# TimeStep v_dU1 v_flambda\n")
+		for i in range(nsteps//nblock):
+			fout.write("%d %.12f %.12f\n"%((i+1)*nblock, np.mean(du[i*nblock:(i+1)*nblock]), np.mean(lmbda[i*nblock:(i+1)*nblock])))
+	data = load_switching_data(file)
+	assert data.shape == (2, nsteps//nblock+2)
+	assert np.abs(np.trapz(data[0], data[1]) - work) < 1E-6
+	store_switching_data(file, keep_text=False)
+	assert np.allclose(load_switching_data(file), data)
+
+def test_msd_reader(tmp_path):
+	file = str(tmp_path / "msd.dat")
+	msd = np.random.rand(2, 10)
+	with open(file, "w") as fout:
+		fout.write("# Time-averaged data for fix 4\n# TimeStep v_msd1 v_msd2\n")
+		for i in range(10):
+			fout.write("%d %.12f %.12f\n"%((i+1)*100, msd[0][i], msd[1][i]))
+	reader = IncrementalReader(file, usecols=tuple(range(1, 3)))
+	reader.update()
+	assert reader.data.shape == (2, 10)
+	assert np.allclose(reader.data, msd)
+	reader = IncrementalReader(file)
+	reader.update()
+	assert np.allclose(reader.data, msd)
+
+def test_find_crossing_temperature():
+	t = np.linspace(1000, 1400, 401)
+	err = 0.001*np.ones(len(t))
+	fsol = -3 - 1E-3*t - 1E-7*t**2
+	flqd = fsol + 0.2*(1 - t/1250)
+	tm, tmerr = find_crossing_temperature([t, fsol, err], [t, flqd, err])
+	assert np.abs(tm - 1250) < 1E-6
+	assert np.abs(tmerr - np.sqrt(2)*0.001*1250/0.2) < 1E-6
+	assert find_crossing_temperature([t, fsol, err], [t, flqd - 0.1, err]) == (None, None)
+
+def test_truncate_switching_data(tmp_path):
+	file = str(tmp_path / "forward_1.dat")
+	data = np.random.rand(20, 3)
+	np.savetxt(file, data, header="Fix print output")
+	with open(file, "a") as fout:
+		fout.write("0.1 0.2")
+	truncate_switching_data(file, 12)
+	assert np.allclose(np.loadtxt(file), data[:12])
+
+def test_check_block_averaging():
+	check_block_averaging(10, {"n_switching_steps": 1000, "n_equilibration_steps": 500})
+	check_block_averaging(1, {"n_switching_steps": 1005})
+	with pytest.raises(ValueError):
+		check_block_averaging(10, {"n_switching_steps": 1000, "n_equilibration_steps": 505})
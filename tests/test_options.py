@@ -1,6 +1,150 @@
+import os
+import copy
+import subprocess
 import pytest
+import yaml
 from calphy.input import read_inputfile
+import calphy.kernel as ck
+import calphy.scheduler as pq
+import calphy.workflow as cw
 
 def test_options():
 	options = read_inputfile("tests/input.yaml")
-	assert options[0]._temperature == 1300
\ No newline at end of file
+	assert options[0]._temperature == 1300
+def test_output_options(tmp_path):
+	with open("tests/input.yaml") as fin:
+		indata = yaml.safe_load(fin)
+	indata["output"] = {"n_average": 10, "binary": True, "keep_text": False}
+	file = str(tmp_path / "input.yaml")
+	with open(file, "w") as fout:
+		yaml.safe_dump(indata, fout)
+	options = read_inputfile(file)
+	assert options[0].output.n_average == 10
+	assert options[0].output.binary == True
+	assert options[0].output.keep_text == False
+
+def _fake_kernel(tmp_path, monkeypatch, failing=None):
+	bindir = tmp_path / "bin"
+	bindir.mkdir()
+	script = bindir / "calphy_kernel"
+	with open(script, "w") as fout:
+		fout.write("#!/bin/bash\n")
+		fout.write("echo $OMPI_MCA_hwloc_base_cpu_set $4\n")
+		if failing is not None:
+			fout.write("if [ $4 -eq %d ]; then exit 1; fi\n"%failing)
+	os.chmod(script, 0o755)
+	monkeypatch.setenv("PATH", "%s:%s"%(str(bindir), os.environ["PATH"]))
+
+def _run(command, tmp_path):
+	return subprocess.run(["bash", "-c", command], cwd=str(tmp_path)).returncode
+
+def test_kernel_command():
+	assert ck.kernel_command("input.yaml", 3) == "calphy_kernel -i input.yaml -k 3"
+	assert ck.kernel_command("input.yaml", "${K}", resume=True) == "calphy_kernel -i input.yaml -k ${K} --resume"
+
+def test_packed_command(tmp_path, monkeypatch):
+	_fake_kernel(tmp_path, monkeypatch, failing=4)
+	assert _run(ck.packed_command("input.yaml", "2 3", 2, 2), tmp_path) == 0
+	assert open(tmp_path / "kernel_2.out").read().split() == ["0,1", "2"]
+	assert open(tmp_path / "kernel_3.out").read().split() == ["2,3", "3"]
+	#a failing calculation fails the job, even if it is not the last one
+	assert _run(ck.packed_command("input.yaml", "4 5", 1, 2), tmp_path) != 0
+	assert open(tmp_path / "kernel_5.out").read().split() == ["1", "5"]
+	#within a bound job, the calculations share the cores of the job
+	monkeypatch.setenv("OMPI_MCA_hwloc_base_cpu_set", "4,5,6,7")
+	assert _run(ck.packed_command("input.yaml", "2 3", 2, 2), tmp_path) == 0
+	assert open(tmp_path / "kernel_3.out").read().split() == ["6,7", "3"]
+
+def test_group_calculations():
+	calcs = read_inputfile("tests/input.yaml")*3
+	calcs = [copy.deepcopy(calc) for calc in calcs]
+	calcs[1].queue.cores = 4
+	assert ck.group_calculations(calcs) == [[0, 2], [1]]
+
+def test_array_scripts(tmp_path, monkeypatch):
+	slurm = pq.SLURM({"jobname": "ti"}, cores=4)
+	slurm.array = 3
+	slurm.maincommand = ck.array_command("input.yaml", [1, 4, 6, 7, 9], slurm.task_index, 2, 2)
+	slurm.write_script(str(tmp_path / "slurm.sub"))
+	lines = open(tmp_path / "slurm.sub").read().splitlines()
+	assert "#SBATCH --array=0-2" in lines
+	assert lines[-1].endswith("slurm.sub.err.${SLURM_ARRAY_TASK_ID}")
+
+	sge = pq.SGE({"jobname": "ti"}, cores=4)
+	sge.array = 3
+	sge.maincommand = ck.kernel_command("input.yaml", sge.task_index)
+	sge.write_script(str(tmp_path / "sge.sub"))
+	lines = open(tmp_path / "sge.sub").read().splitlines()
+	assert "#$ -t 1-3" in lines
+	assert lines[-1].startswith("calphy_kernel -i input.yaml -k $((SGE_TASK_ID-1))")
+
+	#each task runs its own slice of the calculations, the last one runs what is left
+	_fake_kernel(tmp_path, monkeypatch)
+	for task, kernels in enumerate([[1, 4], [6, 7], [9]]):
+		assert _run(ck.array_command("input.yaml", [1, 4, 6, 7, 9], str(task), 2, 2), tmp_path) == 0
+		for count, kernel in enumerate(kernels):
+			assert open(tmp_path / ("kernel_%d.out"%kernel)).read().split() == ["%d,%d"%(2*count, 2*count+1), str(kernel)]
+
+def _job(tmp_path, name, seconds=0, code=0):
+	script = tmp_path / ("%s.sh"%name)
+	with open(script, "w") as fout:
+		fout.write("#!/bin/bash\n")
+		fout.write("echo %s $OMPI_MCA_hwloc_base_binding_policy $OMPI_MCA_hwloc_base_cpu_set >> %s\n"%(name, str(tmp_path / "jobs.log")))
+		fout.write("sleep %f\n"%seconds)
+		fout.write("exit %d\n"%code)
+	os.chmod(script, 0o755)
+	return str(script)
+
+def _log(tmp_path):
+	return [line.split() for line in open(tmp_path / "jobs.log").read().splitlines()]
+
+def test_local_pool_cores(tmp_path):
+	pool = pq.LocalPool(cores=2, poll_interval=0.05)
+	a = pool.submit(_job(tmp_path, "a", seconds=0.5), cores=2)
+	b = pool.submit(_job(tmp_path, "b"), cores=1)
+	#b waits until the cores of a are free
+	assert list(pool.running.keys()) == [a]
+	assert len(pool.queue) == 1
+	c = pool.submit(_job(tmp_path, "c"), cores=3)
+	assert pool.wait() == {a: 0, b: 0, c: 0}
+	assert _log(tmp_path) == [["a", "core", "0,1"], ["b", "core", "0"], ["c", "none"]]
+
+def test_local_pool_order(tmp_path):
+	pool = pq.LocalPool(cores=4, max_jobs=1, poll_interval=0.05)
+	a = pool.submit(_job(tmp_path, "a", seconds=0.3), cores=1)
+	b = pool.submit(_job(tmp_path, "b", code=1), cores=1)
+	c = pool.submit(_job(tmp_path, "c"), cores=1, priority=5)
+	#the same script can be submitted again
+	d = pool.submit(pool.scripts[b], cores=1)
+	assert len(pool.running) == 1
+	returncodes = pool.wait()
+	assert [line[0] for line in _log(tmp_path)] == ["a", "c", "b", "b"]
+	assert returncodes == {a: 0, b: 1, c: 0, d: 1}
+	assert pool.failed == [b, d]
+
+def test_workflow_build(tmp_path):
+	with open("tests/input.yaml") as fin:
+		indata = yaml.safe_load(fin)
+	ts = indata["calculations"][0]
+	fe = dict(ts, mode="fe", temperature=1300)
+	fe_high = dict(ts, mode="fe", temperature=1400)
+	ts_short = dict(ts, n_switching_steps=1000)
+	indata["calculations"] = [ts, fe, fe_high, ts_short]
+	indata["equilibration_cache"] = {"folder": str(tmp_path / "cache")}
+	file = str(tmp_path / "input.yaml")
+	with open(file, "w") as fout:
+		yaml.safe_dump(indata, fout)
+
+	workflow = cw.Workflow(file)
+	assert sorted(workflow.nodes.keys()) == ["averaging_1", "averaging_2", "calculation_0", "calculation_1", 
+		"calculation_2", "calculation_3", "summary"]
+	assert workflow.nodes["averaging_1"].command.endswith("-k 1 --stage averaging")
+	assert workflow.nodes["averaging_1"].dependencies == []
+	#the ts calculation takes the free energy of the fe calculation at its starting temperature
+	assert workflow.nodes["calculation_0"].dependencies == ["averaging_1", "calculation_1"]
+	assert workflow.nodes["calculation_1"].dependencies == ["averaging_1"]
+	assert workflow.nodes["calculation_2"].dependencies == ["averaging_2"]
+	#different switching settings share the state, but not the free energy
+	assert workflow.nodes["calculation_3"].dependencies == ["averaging_1"]
+	assert sorted(workflow.nodes["summary"].dependencies) == ["calculation_0", "calculation_1", 
+		"calculation_2", "calculation_3"]